@@ -9,6 +9,7 @@ import re
 import simpleFarm
 from meshroom.core.desc import Level
 from meshroom.core.submitter import BaseSubmitter
+from tractorSubmitter.api.base import RezContext
 
 currentDir = os.path.dirname(os.path.realpath(__file__))
 binDir = os.path.dirname(os.path.dirname(os.path.dirname(currentDir)))
@@ -34,28 +35,14 @@ class SimpleFarmSubmitter(BaseSubmitter):
         self.engine = os.environ.get('MESHROOM_SIMPLEFARM_ENGINE', 'tractor')
         self.share = os.environ.get('MESHROOM_SIMPLEFARM_SHARE', 'vfx')
         self.prod = os.environ.get('PROD', 'mvg')
-        if 'REZ_USED_REQUEST' in os.environ:
-            requestPackages = os.environ.get('REZ_USED_REQUEST', '').split()
-            resolvedPackages = os.environ.get('REZ_RESOLVE', '').split()
-            resolvedVersions = {}
-            for r in resolvedPackages:
-                # remove implicit packages
-                if r.startswith('~'):
-                    continue
-                # logging.info('REZ: {}'.format(str(r)))
-                name, version = self.REZ_DELIMITER_PATTERN.split(r, maxsplit=1)
-                # logging.info('    v: {}'.format(str(v)))
-                resolvedVersions[name] = version
-            requestPackageNames = set()  # Use set to remove duplicates
-            for p in requestPackages:
-                if p.startswith('~'):
-                    continue
-                v = self.REZ_DELIMITER_PATTERN.split(p, maxsplit=1)
-                requestPackageNames.add(v[0])
-            for p in requestPackageNames:
-                # Use "==" to guarantee that the job uses the exact same version
-                # as the environment where Meshroom was launched.
-                self.reqPackages.append(f"{p}=={resolvedVersions[p]}")
+        # Rez env is parsed once and shared with the other submitters
+        self.rezContext = RezContext.current()
+        if self.rezContext.usedRequest:
+            # Use "==" to guarantee that the job uses the exact same version
+            # as the environment where Meshroom was launched.
+            self.reqPackages = [
+                f"{p}=={self.rezContext.resolvedVersions[p]}" for p in sorted(self.rezContext.requestedNames)
+            ]
             logging.debug(f'REZ Packages: {str(self.reqPackages)}')
         elif 'REZ_MESHROOM_VERSION' in os.environ:
             self.reqPackages = [f"meshroom-{os.environ.get('REZ_MESHROOM_VERSION', '')}"]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+asyncio version of the Tractor query and action functions
+
+The Tractor query API is blocking, so calls are run on a dedicated thread pool
+and share the engine sessions of tractorJobQuery. The number of requests sent
+to the engine at the same time is bounded by MAX_CONCURRENCY.
+Paginated queries await each page separately so they can be cancelled between pages.
+
+Example :
+>>> from tractorSubmitter.api import aio
+>>> jobs = await aio.refreshJobs([1234, 1235, 1236])
+>>> await aio.killTask(1234, 12)
+
+From synchronous code :
+>>> jobs = aio.runSync(aio.refreshJobs([1234, 1235, 1236]))
+"""
+
+import os
+import asyncio
+import weakref
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tractorSubmitter.api.tractorJobQuery as tq
+
+
+MAX_CONCURRENCY = int(os.environ.get("TRACTOR_AIO_MAX_CONCURRENCY", max(tq.SESSION_POOL_SIZE, 1)))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="tractorQuery")
+# asyncio primitives are bound to an event loop so we keep one semaphore per loop
+_semaphores = weakref.WeakKeyDictionary()
+_semaphoresLock = threading.Lock()
+
+
+def _getSemaphore(loop):
+    with _semaphoresLock:
+        semaphore = _semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+            _semaphores[loop] = semaphore
+        return semaphore
+
+
+async def _run(func, *args, **kwargs):
+    """ Run a blocking query function on the query thread pool """
+    loop = asyncio.get_running_loop()
+    async with _getSemaphore(loop):
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _async(func):
+    """ Create the async version of a blocking query function """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await _run(func, *args, **kwargs)
+    return wrapper
+
+
+def runSync(coro):
+    """ Run a coroutine from synchronous code and return its result
+    If an event loop is already running in this thread, the coroutine is run
+    in a new loop on another thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+#
+# Query job/task infos
+#
+
+getJob = _async(tq.getJob)
+getJobs = _async(tq.getJobs)
+getTask = _async(tq.getTask)
+getTasks = _async(tq.getTasks)
+pollJobTasks = _async(tq.pollJobTasks)
+
+
+async def iterJobTasks(jid, pageSize=tq.TASK_PAGE_SIZE):
+    """ Iterate over all the tasks of the job, ordered by tid, one page at a time """
+    lastKey = None
+    while True:
+        tasks = await _run(tq._getTasksPage, {"jid": jid}, lastKey, pageSize)
+        for task in tasks:
+            task = tq._formatTask(task)
+            lastKey = (task.get("jid"), task.get("tid"))
+            yield task
+        if len(tasks) < pageSize:
+            return
+
+
+async def getJobTasks(jid):
+    """ Get all the tasks of the job as a dict {tid: task} """
+    tractorTasks = {}
+    async for task in iterJobTasks(jid):
+        tractorTasks[task.get("tid")] = task
+    return tractorTasks
+
+
+async def refreshJob(jid):
+    """ Get the job and its tasks, both requests are sent concurrently """
+    return await asyncio.gather(getJob(jid), getJobTasks(jid))
+
+
+async def refreshJobs(jids):
+    """ Refresh multiple jobs concurrently
+    Returns a dict {jid: (job, tasks)}
+    If the caller is cancelled, all pending requests are cancelled too.
+    """
+    jids = list(jids)
+    results = await asyncio.gather(*[refreshJob(jid) for jid in jids])
+    return dict(zip(jids, results))
+
+
+#
+# Job actions
+#
+
+pauseJob = _async(tq.pauseJob)
+unpauseJob = _async(tq.unpauseJob)
+interruptJob = _async(tq.interruptJob)
+restartJob = _async(tq.restartJob)
+retryErrorTasks = _async(tq.retryErrorTasks)
+
+
+#
+# Task actions
+#
+
+retryTask = _async(tq.retryTask)
+resumeTask = _async(tq.resumeTask)
+killTask = _async(tq.killTask)
+skipTask = _async(tq.skipTask)
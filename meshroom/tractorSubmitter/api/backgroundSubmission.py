@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Background job submission
+
+Cooking and spooling a big job can take a while, so Job.submit can run on a worker
+thread instead. submitInBackground returns a Submission handle right away :
+- progress callbacks are called when the submission enters a phase
+  (queued, cook, serialize, spool, done, failed or cancelled)
+- cancel() works until the spool starts (the job is never partially spooled)
+- result() waits for the result of Job.submit
+Several submissions run at the same time (up to MAX_SUBMISSIONS).
+
+Tasks must be created before (e.g. from the Meshroom nodes on the main thread),
+only the cooking and the spooling are done in the background.
+
+Example :
+>>> submission = submitInBackground(job, share="vfx")
+>>> submission.addProgressCallback(lambda submission, phase: print(submission.name, phase))
+>>> submission.cancel()  # Returns False if the spool has started
+>>> res = submission.result()
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+MAX_SUBMISSIONS = int(os.environ.get("MESHROOM_TRACTOR_MAX_SUBMISSIONS", 2))
+
+PHASE_QUEUED = "queued"
+PHASE_COOK = "cook"
+PHASE_SERIALIZE = "serialize"
+PHASE_SPOOL = "spool"
+PHASE_DONE = "done"
+PHASE_FAILED = "failed"
+PHASE_CANCELLED = "cancelled"
+
+_executor = None
+_executorLock = threading.Lock()
+
+
+def _getExecutor():
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_SUBMISSIONS, thread_name_prefix="tractorSubmission")
+        return _executor
+
+
+class SubmissionCancelled(CancelledError):
+    """ Raised in the worker when the submission is cancelled before the spool """
+
+
+class Submission:
+    """ Handle of a job submitted in the background """
+
+    def __init__(self, name):
+        self.name = name
+        self.phase = PHASE_QUEUED
+        self._future = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._cancelRequested = False
+        self._spoolStarted = False
+        self._transform = None
+
+    def __repr__(self):
+        return f"<Submission {self.name} ({self.phase})>"
+
+    def addProgressCallback(self, callback):
+        """ callback(submission, phase) is called from the worker thread """
+        self._callbacks.append(callback)
+
+    def setPhase(self, phase):
+        """ Called by Job.submit when a phase starts. Stops the submission if it has been cancelled """
+        with self._lock:
+            if self._cancelRequested and not self._spoolStarted:
+                raise SubmissionCancelled(f"Submission {self.name} cancelled")
+            if phase == PHASE_SPOOL:
+                self._spoolStarted = True
+        self._notify(phase)
+
+    def _notify(self, phase):
+        self.phase = phase
+        for callback in self._callbacks:
+            try:
+                callback(self, phase)
+            except Exception as e:
+                logging.warning(f"TractorSubmitter: Progress callback failed for {self.name}: {e}")
+
+    def cancel(self):
+        """ Cancel the submission if the spool has not started yet
+        Returns True if the submission will not be spooled
+        """
+        with self._lock:
+            if self._spoolStarted or self._future.done():
+                return self._future.cancelled() or self.phase == PHASE_CANCELLED
+            self._cancelRequested = True
+        if self._future.cancel():
+            # Still queued : the worker will never run
+            self._notify(PHASE_CANCELLED)
+        return True
+
+    def cancelled(self):
+        return self.phase == PHASE_CANCELLED
+
+    def done(self):
+        return self._future.done()
+
+    def transformResult(self, transform):
+        """ result() returns transform(result of Job.submit) """
+        self._transform = transform
+
+    def result(self, timeout=None):
+        """ Result of Job.submit. Raises SubmissionCancelled if the submission has been cancelled """
+        try:
+            res = self._future.result(timeout)
+        except CancelledError as e:
+            raise SubmissionCancelled(f"Submission {self.name} cancelled") from e
+        return self._transform(res) if self._transform else res
+
+    def exception(self, timeout=None):
+        try:
+            return self._future.exception(timeout)
+        except CancelledError:
+            return None
+
+    def addDoneCallback(self, callback):
+        """ callback(submission) is called when the submission is done, failed or cancelled """
+        self._future.add_done_callback(lambda _: callback(self))
+
+    def _run(self, submit, kwargs):
+        try:
+            res = submit(progress=self.setPhase, **kwargs)
+        except SubmissionCancelled:
+            logging.info(f"TractorSubmitter: Submission {self.name} cancelled")
+            self._notify(PHASE_CANCELLED)
+            raise
+        except Exception as e:
+            logging.error(f"TractorSubmitter: Submission {self.name} failed: {e}")
+            self._notify(PHASE_FAILED)
+            raise
+        self._notify(PHASE_DONE)
+        return res
+
+
+def submitInBackground(job, progressCallback=None, **submitKwargs) -> Submission:
+    """ Run job.submit(**submitKwargs) on a worker thread and return the Submission handle """
+    submission = Submission(job.jobInfos.name)
+    if progressCallback is not None:
+        submission.addProgressCallback(progressCallback)
+    submission._notify(PHASE_QUEUED)
+    submission._future = _getExecutor().submit(submission._run, job.submit, submitKwargs)
+    return submission
@@ -12,11 +12,15 @@ Here goes all the boilerplate code
 
 import re
 import os
+import copy
 import json
+import shlex
+import hashlib
 import getpass
 import logging
-import shlex
+import subprocess
 from collections import namedtuple
+from collections.abc import Sequence
 
 TRACTOR_JOB_URL = "http://tractor-engine/tv/#jid={jid}"
 Chunk = namedtuple("chunk", ["iteration", "start", "end"])
@@ -34,19 +38,164 @@ PRIORITY_DICT = {
     }
 
 
+# Environment variables the rez context depends on
+REZ_ENV_KEYS = ("REZ_RESOLVE", "REZ_REQUEST", "REZ_USED_REQUEST", "REZ_MESHROOM_VERSION", "REZ_BIN", "REZ_PACKAGES_ROOT")
+# Max duration (in seconds) of a rez resolve when baking a context file
+REZ_BAKE_TIMEOUT = 300
+# Mode of tractorSubtaskWrapper for the expanding tasks (shell, exec, inprocess, auto). Empty : wrapper default
+EXPAND_WRAPPER_MODE = os.environ.get("MESHROOM_TRACTOR_EXPAND_MODE", "")
+
+
+class RezContext:
+    """ Rez infos of an environment, parsed once
+    The packages strings and the command prefixes ("rez env <packages> -- ") are 
+    cached so that wrapping the commands of thousands of chunks is a dict lookup.
+    Use RezContext.current() to get the (memoized) context of the current environment.
+
+    Baked contexts : with a bake directory (see withBakeDirectory), each set of packages is
+    resolved once at submit time and stored in a .rxt context file. Commands then use
+    "rez env --input <file> -- " so the blades don't resolve the packages again.
+    If the resolve fails, the packages are resolved on the farm as usual.
+    """
+
+    _current = None
+
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        self.key = tuple(environ.get(k) for k in REZ_ENV_KEYS)
+        self.resolvedPackages = tuple(p for p in environ.get('REZ_RESOLVE', '').split(" ") if p)
+        self.resolvedVersions = self._parseResolvedVersions(self.resolvedPackages)
+        self.hasRequest = 'REZ_REQUEST' in environ
+        self.usedRequest = 'REZ_USED_REQUEST' in environ
+        self.requestedNames = self._parseRequestedNames(environ.get('REZ_USED_REQUEST', '').split())
+        self.meshroomVersion = environ.get('REZ_MESHROOM_VERSION')
+        self.rezBin = "rez"
+        if "REZ_BIN" in environ:
+            self.rezBin = environ["REZ_BIN"]
+        elif "REZ_PACKAGES_ROOT" in environ:
+            self.rezBin = os.path.join(environ["REZ_PACKAGES_ROOT"], "/bin/rez")
+        self.bakeDirectory = None
+        self._requestPackages = {}
+        self._prefixes = {}
+        self._prefixesArgv = {}
+
+    @classmethod
+    def current(cls):
+        """ Get the context of the current environment, only parsed again if the rez env vars changed """
+        key = tuple(os.environ.get(k) for k in REZ_ENV_KEYS)
+        if cls._current is None or cls._current.key != key:
+            cls._current = cls()
+        return cls._current
+
+    def withBakeDirectory(self, directory):
+        """ Get a copy of this context that bakes rez context files in the directory """
+        context = copy.copy(self)
+        context.bakeDirectory = directory
+        context._prefixes = {}
+        context._prefixesArgv = {}
+        return context
+
+    def bake(self, packages):
+        """ Resolve the packages and write the context file, unless it already exists
+        Returns the path of the context file or None if the resolve failed
+        """
+        name = hashlib.sha1(" ".join(packages).encode()).hexdigest()[:16]
+        path = os.path.join(self.bakeDirectory, f"rezContext_{name}.rxt")
+        if os.path.exists(path):
+            return path
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.bakeDirectory, exist_ok=True)
+            subprocess.run([self.rezBin, "env", *packages, "--output", tmpPath], 
+                           check=True, capture_output=True, timeout=REZ_BAKE_TIMEOUT)
+            os.replace(tmpPath, path)
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.warning(f"TractorSubmitter: Could not bake rez context for {packages}, "
+                            f"packages will be resolved on the farm ({e})")
+            return None
+        logging.info(f"TractorSubmitter: Baked rez context {path}")
+        return path
+
+    @staticmethod
+    def _parseResolvedVersions(resolvedPackages):
+        resolvedVersions = {}
+        for r in resolvedPackages:
+            if r.startswith('~'):  # remove implicit packages
+                continue
+            v = r.split('-')
+            if len(v) == 2:
+                resolvedVersions[v[0]] = v[1]
+            elif len(v) > 2:  # Handle case with multiple hyphen-minus
+                resolvedVersions[v[0]] = "-".join(v[1:])
+        return resolvedVersions
+
+    @staticmethod
+    def _parseRequestedNames(requestedPackages):
+        """ Get the names of the packages that have been requested """
+        usedPackages = set()  # Use set to remove duplicates
+        for p in requestedPackages:
+            if p.startswith('~') or p.startswith("!"):
+                continue
+            v = REZ_DELIMITER_PATTERN.split(p)
+            usedPackages.add(v[0])
+        return frozenset(usedPackages)
+
+    def getRequestPackages(self, packagesDelimiter="=="):
+        """ See getRequestPackages """
+        if packagesDelimiter not in self._requestPackages:
+            reqPackages = set()
+            if self.hasRequest:
+                for p in self.requestedNames:
+                    reqPackages.add(packagesDelimiter.join([p, self.resolvedVersions[p]]))
+                logging.debug(f"TractorSubmitter: REZ Packages: {str(reqPackages)}")
+            elif self.meshroomVersion is not None:
+                reqPackages.add(f"meshroom{packagesDelimiter}{self.meshroomVersion}")
+            self._requestPackages[packagesDelimiter] = tuple(sorted(reqPackages))
+        return list(self._requestPackages[packagesDelimiter])
+
+    def getPrefix(self, useCurrentContext=False, useRequestedContext=True, otherRezPkg=None):
+        """ Get the "rez env <packages> -- " prefix (empty if there is no package) """
+        key = (useCurrentContext, useRequestedContext, frozenset(otherRezPkg or ()))
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            packages = set()
+            if useCurrentContext:
+                # In this case we want to use the full context
+                packages.update(self.resolvedPackages)
+            elif useRequestedContext:
+                # In this case we want to use only packages in the rez request
+                packages.update(self.getRequestPackages())
+            # Add additional packages
+            if otherRezPkg:
+                packages.update(otherRezPkg)
+            packages = sorted(p for p in packages if p)
+            contextFile = self.bake(packages) if (packages and self.bakeDirectory) else None
+            if contextFile:
+                prefix = f"{self.rezBin} env --input {shlex.quote(contextFile)} -- "
+            elif packages:
+                prefix = f"{self.rezBin} env {' '.join(packages)} -- "
+            else:
+                prefix = ""
+            self._prefixes[key] = prefix
+        return prefix
+
+    def getPrefixArgv(self, useCurrentContext=False, useRequestedContext=True, otherRezPkg=None):
+        """ Same as getPrefix but split as an argv list (the list must not be modified) """
+        key = (useCurrentContext, useRequestedContext, frozenset(otherRezPkg or ()))
+        argv = self._prefixesArgv.get(key)
+        if argv is None:
+            argv = shlex.split(self.getPrefix(useCurrentContext, useRequestedContext, otherRezPkg))
+            self._prefixesArgv[key] = argv
+        return argv
+
+    def wrapCommand(self, cmd, useCurrentContext=False, useRequestedContext=True, otherRezPkg=None):
+        """ See rezWrapCommand """
+        return self.getPrefix(useCurrentContext, useRequestedContext, otherRezPkg) + cmd
+
+
 def getResolvedVersionsDict():
     """ Get a dict {packageName: version} corresponding to the current context """
-    resolvedPackages = os.environ.get('REZ_RESOLVE', '').split()
-    resolvedVersions = {}
-    for r in resolvedPackages:
-        if r.startswith('~'):  # remove implicit packages
-            continue
-        v = r.split('-')
-        if len(v) == 2:
-            resolvedVersions[v[0]] = v[1]
-        elif len(v) > 2:  # Handle case with multiple hyphen-minus
-            resolvedVersions[v[0]] = "-".join(v[1:])
-    return resolvedVersions
+    return dict(RezContext.current().resolvedVersions)
 
 
 def getRequestPackages(packagesDelimiter="=="):
@@ -57,27 +206,11 @@ def getRequestPackages(packagesDelimiter="=="):
     By default we use the "==" delimiter to make sure we have the same version
     in the job that the one we have in the env where meshroom is launched
     """
-    reqPackages = set()
-    if 'REZ_REQUEST' in os.environ:
-        # Get the names of the packages that have been requested
-        requestedPackages = os.environ.get('REZ_USED_REQUEST', '').split()
-        usedPackages = set()  # Use set to remove duplicates
-        for p in requestedPackages:
-            if p.startswith('~') or p.startswith("!"):
-                continue
-            v = REZ_DELIMITER_PATTERN.split(p)
-            usedPackages.add(v[0])
-        # Add requested packages to the reqPackages set 
-        resolvedVersions = getResolvedVersionsDict()
-        for p in usedPackages:
-            reqPackages.add(packagesDelimiter.join([p, resolvedVersions[p]]))
-        logging.debug(f"TractorSubmitter: REZ Packages: {str(reqPackages)}")
-    elif 'REZ_MESHROOM_VERSION' in os.environ:
-        reqPackages.add(f"meshroom{packagesDelimiter}{os.environ.get('REZ_MESHROOM_VERSION', '')}")
-    return list(reqPackages)
+    return RezContext.current().getRequestPackages(packagesDelimiter)
 
 
-def rezWrapCommand(cmd, useCurrentContext=False, useRequestedContext=True, otherRezPkg: list[str] = None):
+def rezWrapCommand(cmd, useCurrentContext=False, useRequestedContext=True, otherRezPkg: list[str] = None, 
+                   rezContext: RezContext = None):
     """ Wrap command to be runned using rez
     :param cmd: command to run
     :type cmd: bool
@@ -87,26 +220,58 @@ def rezWrapCommand(cmd, useCurrentContext=False, useRequestedContext=True, other
     :type useRequestedContext: bool
     :param otherRezPkg: Additionnal rez packages
     :type otherRezPkg: list[str]
+    :param rezContext: Rez context to use (default : context of the current environment)
+    :type rezContext: RezContext
     """
-    packages = set()
-    if useCurrentContext:
-        # In this case we want to use the full context
-        packages.update([p for p in os.environ.get('REZ_RESOLVE', '').split(" ") if p])
-    elif useRequestedContext:
-        # In this case we want to use only packages in the rez request
-        packages.update(getRequestPackages())
-    # Add additional packages
-    if otherRezPkg:
-        packages.update(otherRezPkg)
-    packagesStr = " ".join([p for p in packages if p])
-    if packagesStr:
-        rezBin = "rez"
-        if "REZ_BIN" in os.environ:
-            rezBin = os.environ["REZ_BIN"]
-        elif "REZ_PACKAGES_ROOT" in os.environ:
-            rezBin = os.path.join(os.environ["REZ_PACKAGES_ROOT"], "/bin/rez")
-        return f"{rezBin} env {packagesStr} -- {cmd}"
-    return cmd
+    rezContext = rezContext or RezContext.current()
+    return rezContext.wrapCommand(cmd, useCurrentContext, useRequestedContext, otherRezPkg)
+
+
+class ChunkRange(Sequence):
+    """ Lazy sequence of chunks over the frames range(start, end+1, step)
+    Each chunk contains `packetSize` frames (the last one can be smaller).
+    Chunks are computed on access so the frame list is never built.
+    """
+
+    def __init__(self, start, end, step=1, packetSize=1):
+        if step < 1 or packetSize < 1:
+            raise ValueError(f"Invalid chunk range: step={step}, packetSize={packetSize}")
+        self.start = start
+        self.step = step
+        self.packetSize = packetSize
+        self.nbFrames = len(range(start, end + 1, step))
+        self.end = start + (self.nbFrames - 1) * step  # Last frame
+        self._len = -(-self.nbFrames // packetSize)  # ceil
+
+    def __repr__(self):
+        return f"ChunkRange(start={self.start}, end={self.end}, step={self.step}, packetSize={self.packetSize})"
+
+    def __len__(self):
+        return self._len
+
+    def _chunk(self, iteration):
+        first = iteration * self.packetSize
+        last = min(first + self.packetSize, self.nbFrames) - 1
+        return Chunk(iteration, self.start + first * self.step, self.start + last * self.step)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._chunk(i) for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("ChunkRange index out of range")
+        return self._chunk(index)
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self._chunk(i)
+
+    def __eq__(self, other):
+        if isinstance(other, ChunkRange):
+            return (len(self), self.start, self.step, self.packetSize, self.nbFrames) == \
+                   (len(other), other.start, other.step, other.packetSize, other.nbFrames)
+        return NotImplemented
 
 
 def toTractorEnv(environment):
@@ -114,6 +279,51 @@ def toTractorEnv(environment):
     return [f"setenv {k}={v}" for k, v in environment.items()]
 
 
+#
+# Quoting of the values written in Alfred scripts (e.g. subtask definitions)
+#
+
+# Characters escaped with a backslash when a value can't be braced
+TCL_ESCAPE_PATTERN = re.compile(r'[\\{}\[\]$";\s]')
+TCL_ESCAPES = {"\n": "\\n", "\t": "\\t", "\r": "\\r"}
+# Words of a command line that don't need to be quoted
+TCL_BARE_WORD_PATTERN = re.compile(r'[^\\{}\[\]$";\s]+')
+
+
+def _canBrace(value):
+    """ A braced value is read as is if it has no backslash and its braces are balanced """
+    if "\\" in value:
+        return False
+    depth = 0
+    for c in value:
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+def _escape(match):
+    c = match.group()
+    return TCL_ESCAPES.get(c, "\\" + c)
+
+
+def tclQuote(value):
+    """ Quote a value as a single TCL word : braced, or with the special characters
+    escaped by a backslash if braces can't hold it (unbalanced braces, backslashes)
+    """
+    value = str(value)
+    if _canBrace(value):
+        return "{" + value + "}"
+    return TCL_ESCAPE_PATTERN.sub(_escape, value)
+
+
+def tclArgv(argv):
+    return "{" + " ".join(a if TCL_BARE_WORD_PATTERN.fullmatch(a) else tclQuote(a) for a in argv) + "}"
+
+
 # 
 # Job and Task boilerplate code
 # Here are objects that can be used to prepare args for jobs and tasks
@@ -160,6 +370,8 @@ class JobInfos:
         # auto. add FARM_USER user
         self.environment = environment or {}
         self.environment['FARM_USER'] = self.user
+        # Jobs that must be done before this job starts (when a submission is split)
+        self.afterjids = []
 
     @staticmethod
     def getShare(share):
@@ -173,7 +385,7 @@ class JobInfos:
     def cook(self):
         tags = self.tags.copy()
         env = self.environment.copy()
-        return {
+        jobKwargs = {
             "title": self.name,
             "service": self.service,
             "metadata": json.dumps(tags),
@@ -183,12 +395,15 @@ class JobInfos:
             "spoolcwd": '/tmp',
             "projects": [self.share],
         }
+        if self.afterjids:
+            jobKwargs["afterjids"] = list(self.afterjids)
+        return jobKwargs
 
 
 class TaskInfos:
     def __init__(self, name, cmdArgs, nodeUid, environment=None, rezPackages=None, 
                  service=None, licenses=None, tags=None, 
-                 expandingTask=False, chunkParams=None):
+                 expandingTask=False, chunkParams=None, rezContext=None):
         self.name = name
         self.uid = nodeUid
         self.taskCommandArgs = cmdArgs
@@ -196,6 +411,8 @@ class TaskInfos:
         self.environment = environment or {}
         # Rez packages
         self.rezPackages = rezPackages or []
+        self.rezContext: RezContext = rezContext or RezContext.current()
+        self._computeArgv = None
         # self.limits
         self.service = service or os.environ.get('DEFAULT_TRACTOR_SERVICE')
         if not self.service:
@@ -217,34 +434,54 @@ class TaskInfos:
         return taskLimits
 
     @staticmethod
-    def getChunks(chunkParams) -> list[Chunk]:
-        """ Get list of chunks """
+    def getChunks(chunkParams) -> ChunkRange:
+        """ Get the (lazy) sequence of chunks """
         it = None
         if chunkParams:
             start, end = chunkParams.get("start", -1), chunkParams.get("end", -2)
+            step = chunkParams.get("step", 1)
             size = chunkParams.get("packetSize", 1)
-            frameRange = list(range(start, end+1, 1))
-            if frameRange:
-                slices = [frameRange[i:i + size] for i in range(0, len(frameRange), size)]
-                it = [Chunk(i, item[0], item[-1]) for i, item in enumerate(slices)]
+            chunks = ChunkRange(start, end, step=step, packetSize=size)
+            if chunks:
+                it = chunks
         return it
     
     @property
     def envkey(self):
         return toTractorEnv(self.environment)
 
+    @property
+    def rezPrefixArgv(self) -> list[str]:
+        return self.rezContext.getPrefixArgv(otherRezPkg=self.rezPackages)
+
+    @property
+    def meshroomComputeArgv(self) -> list[str]:
+        """ argv of the meshroom_compute command (split once, shared by all chunks) """
+        if self._computeArgv is None:
+            self._computeArgv = shlex.split(f"meshroom_compute {self.taskCommandArgs}")
+        return self._computeArgv
+
+    @property
+    def computeArgv(self) -> list[str]:
+        """ argv of the meshroom_compute command wrapped with rez """
+        return self.rezPrefixArgv + self.meshroomComputeArgv
+
     def cook(self):
         if self.expandingTask:
             # Chunks are not created yet so we use the wrapper and the task will expand itself
-            cmd = f"tractorSubtaskWrapper meshroom_createChunks --submitter Tractor {self.taskCommandArgs}"
-            cmd = rezWrapCommand(cmd, otherRezPkg=self.rezPackages)
+            wrapper = "tractorSubtaskWrapper"
+            if EXPAND_WRAPPER_MODE:
+                # e.g. inprocess : meshroom_createChunks runs in the wrapper process
+                wrapper += f" --mode {EXPAND_WRAPPER_MODE}"
+            cmd = f"{wrapper} meshroom_createChunks --submitter Tractor {self.taskCommandArgs}"
+            cmd = self.rezContext.wrapCommand(cmd, otherRezPkg=self.rezPackages)
         elif self.chunks:
             # Empty task with multiple commands (sub-tasks) to execute in parallel
             cmd = None
         else:
             # Simple task with only one command to execute
             cmd = f"meshroom_compute {self.taskCommandArgs}"
-            cmd = rezWrapCommand(cmd, otherRezPkg=self.rezPackages)
+            cmd = self.rezContext.wrapCommand(cmd, otherRezPkg=self.rezPackages)
         return {
             "title": self.name,
             "argv": shlex.split(cmd) if cmd else cmd,
@@ -264,18 +501,34 @@ class ChunkTaskInfos:
         self.taskInfos: TaskInfos = taskInfos
         self.chunk: Chunk = chunk
 
+    @property
+    def iterations(self):
+        """ Meshroom iterations computed by this task (a chunk can hold a packet of iterations)
+        These are iteration indices (as in the unpacked submission), not frame values
+        """
+        chunks = self.taskInfos.chunks
+        if isinstance(chunks, ChunkRange) and chunks.packetSize > 1:
+            first = self.chunk.iteration * chunks.packetSize
+            return range(first, min(first + chunks.packetSize, chunks.nbFrames))
+        return range(self.chunk.iteration, self.chunk.iteration + 1)
+
     def cook(self):
         title = f"{self.taskInfos.name}_{self.chunk.start}_{self.chunk.end}"
-        # Update cmd
-        cmd = f"meshroom_compute {self.taskInfos.taskCommandArgs}"
-        cmd = f"{cmd} --iteration {self.chunk.iteration}"
-        cmd = rezWrapCommand(cmd, otherRezPkg=self.taskInfos.rezPackages)
-        # Update tags
         chunkTags = self.taskInfos.tags.copy()
-        chunkTags["iteration"] = self.chunk.iteration
+        iterations = self.iterations
+        if len(iterations) == 1:
+            argv = self.taskInfos.computeArgv + ["--iteration", str(iterations[0])]
+            chunkTags["iteration"] = iterations[0]
+        else:
+            # Packet of iterations : run them one after the other in the same rez env
+            computeArgv = self.taskInfos.meshroomComputeArgv
+            script = " && ".join(shlex.join(computeArgv + ["--iteration", str(i)]) for i in iterations)
+            argv = self.taskInfos.rezPrefixArgv + ["bash", "-c", script]
+            chunkTags["iteration"] = iterations[0]
+            chunkTags["iterations"] = list(iterations)
         return {
             "title": title,
-            "argv": shlex.split(cmd),  # Never None
+            "argv": argv,  # Never None
             "service": self.taskInfos.service,
             "metadata": json.dumps(chunkTags),
         }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Adaptive packet sizing and task duration estimation
+
+By default each chunk (iteration) of a node is a tractor task, so short chunks
+pay the full rez and Meshroom startup cost each time. The packet sizer groups
+iterations into tasks that should last about `targetDuration` seconds, based on
+the runtime recorded for the node type.
+
+Runtimes are read from a source providing `get(nodeType)` -> seconds per iteration
+(or None if unknown) :
+- a dict, e.g. loaded from the JSON file MESHROOM_TRACTOR_RUNTIMES_FILE
+  ({"FeatureExtraction": 40.0, ...})
+- a RuntimeHistory (median of the recorded runtimes) if MESHROOM_TRACTOR_HISTORY_DB is set
+
+The same runtimes are used by the DurationEstimator to weight the tasks when
+computing the critical path of a job.
+
+Example :
+>>> sizer = PacketSizer({"FeatureExtraction": 40.0}, targetDuration=300)
+>>> sizer.getPacketSize("FeatureExtraction", nbIterations=100)
+7
+"""
+
+import os
+import json
+import logging
+
+
+TARGET_TASK_DURATION = float(os.environ.get("MESHROOM_TRACTOR_TARGET_TASK_DURATION", 300))
+MAX_PACKET_SIZE = int(os.environ.get("MESHROOM_TRACTOR_MAX_PACKET_SIZE", 50))
+
+
+def loadRuntimes(path=None):
+    """ Load runtimes {nodeType: seconds per iteration} from a JSON file """
+    path = path or os.environ.get("MESHROOM_TRACTOR_RUNTIMES_FILE")
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as runtimesFile:
+            return json.load(runtimesFile)
+    except (OSError, ValueError) as e:
+        logging.warning(f"TractorSubmitter: Could not load runtimes from {path}: {e}")
+        return {}
+
+
+def getRuntimesSource():
+    """ Runtime history if MESHROOM_TRACTOR_HISTORY_DB is set, else the runtimes file """
+    historyPath = os.environ.get("MESHROOM_TRACTOR_HISTORY_DB")
+    if historyPath and os.path.exists(historyPath):
+        from tractorSubmitter.api.runtimeHistory import RuntimeHistory
+        try:
+            return RuntimeHistory(historyPath)
+        except Exception as e:
+            logging.warning(f"TractorSubmitter: Could not open runtime history {historyPath}: {e}")
+    return loadRuntimes()
+
+
+class PacketSizer:
+    def __init__(self, runtimes=None, targetDuration=TARGET_TASK_DURATION, maxPacketSize=MAX_PACKET_SIZE):
+        self.runtimes = getRuntimesSource() if runtimes is None else runtimes
+        self.targetDuration = targetDuration
+        self.maxPacketSize = max(1, maxPacketSize)
+
+    def getPacketSize(self, nodeType, nbIterations) -> int:
+        """ Number of iterations to run in each task """
+        runtime = self.runtimes.get(nodeType)
+        if not runtime or runtime <= 0 or nbIterations <= 1:
+            return 1
+        size = int(self.targetDuration // runtime)
+        size = max(1, min(size, self.maxPacketSize, nbIterations))
+        # Spread the iterations evenly between the tasks
+        nbPackets = -(-nbIterations // size)
+        return -(-nbIterations // nbPackets)
+
+
+class DurationEstimator:
+    """ Estimate the duration of a task (in seconds) from the runtime of its node type
+    When the runtime is unknown the node size is used instead (1 frame = 1 second).
+    Chunks run in parallel so a chunked task lasts as long as one of its chunks.
+    """
+    def __init__(self, runtimes=None, defaultFrameDuration=1.0):
+        self.runtimes = getRuntimesSource() if runtimes is None else runtimes
+        self.defaultFrameDuration = defaultFrameDuration
+
+    def estimate(self, taskInfos) -> float:
+        chunks = taskInfos.chunks
+        runtime = self.runtimes.get(taskInfos.tags.get("nodeType"))
+        if runtime and runtime > 0:
+            # Runtimes are recorded per iteration, iterations of a packet run one after the other
+            return runtime * (getattr(chunks, "packetSize", 1) if chunks else 1)
+        try:
+            nbFrames = max(1, int(taskInfos.tags.get("nbFrames") or 1))
+        except (TypeError, ValueError):
+            nbFrames = 1
+        if chunks:
+            nbFrames = -(-nbFrames // len(chunks))
+        return nbFrames * self.defaultFrameDuration
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+"""
+Local history of the task runtimes
+
+Finished tasks of the submitted jobs are stored in a SQLite database
+(MESHROOM_TRACTOR_HISTORY_DB, default ~/.meshroom/tractorHistory.db) :
+node type, node uid, iteration(s), elapsed time, retry count and blade.
+
+- ingestJob(jid) only requests the tasks that changed since the last import of the job
+- ingestJobs(jids) imports many jobs with batched requests (e.g. to import past jobs)
+- percentile()/stats() give p50/p95 runtimes per node type and node size
+- get(nodeType) gives the median runtime of one iteration, so the history can be
+  used as the runtimes source of the PacketSizer
+
+Example :
+>>> history = RuntimeHistory()
+>>> history.ingestJob(1234)
+>>> history.stats("FeatureExtraction")
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import datetime
+import threading
+
+
+DEFAULT_HISTORY_DB = os.environ.get(
+    "MESHROOM_TRACTOR_HISTORY_DB",
+    os.path.join(os.path.expanduser("~"), ".meshroom", "tractorHistory.db")
+)
+# Used when the node type is not in the metadata (jobs submitted before it was added) :
+# "FeatureExtraction_1" or "FeatureExtraction_1_0_9" -> "FeatureExtraction"
+TITLE_NODE_TYPE_PATTERN = re.compile(r"^(.*?)(_\d+)*$")
+DONE_STATES = {"done"}
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS taskRuns (
+    jid INTEGER NOT NULL,
+    tid INTEGER NOT NULL,
+    nodeType TEXT,
+    nodeUid TEXT,
+    iteration INTEGER,
+    nbIterations INTEGER,
+    size INTEGER,
+    sizeBucket INTEGER,
+    elapsed REAL,
+    iterationElapsed REAL,
+    retryCount INTEGER,
+    blade TEXT,
+    finishedAt REAL,
+    PRIMARY KEY (jid, tid)
+);
+CREATE INDEX IF NOT EXISTS taskRunsByType ON taskRuns (nodeType, iterationElapsed);
+CREATE INDEX IF NOT EXISTS taskRunsBySize ON taskRuns (nodeType, sizeBucket, iterationElapsed);
+CREATE TABLE IF NOT EXISTS importedJobs (
+    jid INTEGER PRIMARY KEY,
+    lastPoll REAL
+);
+"""
+
+
+def toTimestamp(value):
+    """ Convert a time returned by Tractor (datetime, timestamp or string) to a timestamp """
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    try:
+        return datetime.datetime.fromisoformat(str(value).strip()).timestamp()
+    except ValueError:
+        return None
+
+
+def sizeBucket(size):
+    """ Sizes are grouped by power of 2 : bucket b contains sizes in [2^(b-1), 2^b) """
+    try:
+        return int(size).bit_length()
+    except (TypeError, ValueError):
+        return 0
+
+
+def getNodeType(task):
+    metadata = task.get("metadata") or {}
+    if metadata.get("nodeType"):
+        return metadata["nodeType"]
+    match = TITLE_NODE_TYPE_PATTERN.match(task.get("title") or "")
+    return match.group(1) if match else None
+
+
+def historyTaskKeys():
+    import tractorSubmitter.api.tractorJobQuery as tq
+    return tq.POLL_TASK_KEYS
+
+
+class RuntimeHistory:
+    def __init__(self, path=DEFAULT_HISTORY_DB):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM taskRuns").fetchone()[0]
+
+    #
+    # Ingestion
+    #
+
+    @staticmethod
+    def recordFromTask(task, invocation=None):
+        """ Create a record from a finished task, returns None if the task is not a finished command """
+        if str(task.get("state", "")).lower() not in DONE_STATES:
+            return None
+        if not task.get("cids"):
+            return None  # No command (e.g. node task holding the chunks)
+        metadata = task.get("metadata") or {}
+        iterations = metadata.get("iterations") or [metadata.get("iteration")]
+        elapsed = None
+        if invocation and invocation.get("elapsedreal") not in (None, ""):
+            elapsed = float(invocation["elapsedreal"])
+        else:
+            start, end = toTimestamp(task.get("activetime")), toTimestamp(task.get("statetime"))
+            if start is not None and end is not None:
+                elapsed = end - start
+        if elapsed is None or elapsed <= 0:
+            return None  # e.g. skipped task
+        iteration = iterations[0]
+        size = metadata.get("nbFrames")
+        return {
+            "jid": task.get("jid"),
+            "tid": task.get("tid"),
+            "nodeType": getNodeType(task),
+            "nodeUid": metadata.get("nodeUid"),
+            "iteration": int(iteration) if iteration not in (None, "") else None,
+            "nbIterations": len(iterations),
+            "size": int(size) if size not in (None, "") else None,
+            "sizeBucket": sizeBucket(size),
+            "elapsed": elapsed,
+            "iterationElapsed": elapsed / len(iterations),
+            "retryCount": int(task.get("retrycount") or 0),
+            "blade": invocation.get("blade") if invocation else None,
+            "finishedAt": toTimestamp(task.get("statetime")),
+        }
+
+    def addRecords(self, records):
+        records = [r for r in records if r]
+        if not records:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO taskRuns VALUES (:jid, :tid, :nodeType, :nodeUid, :iteration, :nbIterations, "
+                ":size, :sizeBucket, :elapsed, :iterationElapsed, :retryCount, :blade, :finishedAt)",
+                records
+            )
+        return len(records)
+
+    def _getLastPoll(self, jid):
+        with self._lock:
+            row = self._conn.execute("SELECT lastPoll FROM importedJobs WHERE jid=?", (jid,)).fetchone()
+        return row[0] if row else None
+
+    def isImported(self, jid):
+        """ Whether the job has already been imported (its next import is incremental) """
+        return self._getLastPoll(jid) is not None
+
+    def _setLastPoll(self, jid, lastPoll):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO importedJobs VALUES (?, ?)", (jid, lastPoll))
+
+    def _ingestTasks(self, jid, tasks):
+        import tractorSubmitter.api.tractorJobQuery as tq
+        doneTids = [tid for tid, task in tasks.items() if str(task.get("state", "")).lower() in DONE_STATES]
+        invocations = {}
+        if doneTids:
+            try:
+                invocations = tq.getTasksInvocations(jid, doneTids)
+            except Exception as e:
+                logging.warning(f"TractorRuntimeHistory: Could not get invocations of job {jid}, "
+                                f"elapsed times are computed from the task times ({e})")
+        return self.addRecords(self.recordFromTask(tasks[tid], invocations.get(tid)) for tid in doneTids)
+
+    def ingestJob(self, jid, full=False):
+        """ Import the tasks of the job that finished since the last import
+        Returns the number of imported tasks
+        """
+        import tractorSubmitter.api.tractorJobQuery as tq
+        since = None if full else self._getLastPoll(jid)
+        if since is None:
+            tasks = tq.getTasksForJobs([jid], columns=historyTaskKeys()).get(jid, {})
+        else:
+            tasks = tq.pollJobTasks(jid, since=since, columns=historyTaskKeys())
+        nbRecords = self._ingestTasks(jid, tasks)
+        self._setLastPoll(jid, toTimestamp(tq.lastChangeTime(tasks.values(), since)))
+        return nbRecords
+
+    def ingestJobs(self, jids):
+        """ Import all the finished tasks of multiple jobs (tasks are requested in batches)
+        Returns the number of imported tasks
+        """
+        import tractorSubmitter.api.tractorJobQuery as tq
+        nbRecords = 0
+        for chunk in tq.chunkIds(jids):
+            tasksByJob = tq.getTasksForJobs(chunk, columns=historyTaskKeys())
+            for jid, tasks in tasksByJob.items():
+                nbRecords += self._ingestTasks(jid, tasks)
+                self._setLastPoll(jid, toTimestamp(tq.lastChangeTime(tasks.values())))
+        return nbRecords
+
+    #
+    # Queries
+    #
+
+    def _percentile(self, nodeType, q, bucket=None):
+        where, params = "nodeType=?", (nodeType,)
+        if bucket is not None:
+            where, params = "nodeType=? AND sizeBucket=?", (nodeType, bucket)
+        with self._lock:
+            count = self._conn.execute(f"SELECT COUNT(*) FROM taskRuns WHERE {where}", params).fetchone()[0]
+            if count == 0:
+                return None
+            offset = int(round(q * (count - 1)))
+            row = self._conn.execute(
+                f"SELECT iterationElapsed FROM taskRuns WHERE {where} ORDER BY iterationElapsed LIMIT 1 OFFSET ?",
+                params + (offset,)
+            ).fetchone()
+        return row[0]
+
+    def percentile(self, nodeType, q, size=None):
+        """ Runtime of one iteration (in seconds) at the percentile q (0 <= q <= 1)
+        :param size: only use nodes with a similar size (same power of 2)
+        """
+        return self._percentile(nodeType, q, None if size is None else sizeBucket(size))
+
+    def stats(self, nodeType=None, bySize=False):
+        """ Get count, p50 and p95 per node type (and per size bucket) """
+        groupBy = "nodeType, sizeBucket" if bySize else "nodeType"
+        query = f"SELECT {groupBy}, COUNT(*), AVG(retryCount) FROM taskRuns"
+        params = ()
+        if nodeType is not None:
+            query += " WHERE nodeType=?"
+            params = (nodeType,)
+        query += f" GROUP BY {groupBy} ORDER BY {groupBy}"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        stats = []
+        for row in rows:
+            bucket = row[1] if bySize else None
+            stat = {
+                "nodeType": row[0],
+                "count": row[-2],
+                "avgRetries": row[-1],
+                "p50": self._percentile(row[0], 0.5, bucket),
+                "p95": self._percentile(row[0], 0.95, bucket),
+            }
+            if bySize:
+                stat["sizeBucket"] = bucket
+            stats.append(stat)
+        return stats
+
+    def get(self, nodeType, default=None):
+        """ Median runtime of one iteration (runtimes source for the PacketSizer) """
+        runtime = self.percentile(nodeType, 0.5)
+        return default if runtime is None else runtime
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""
+Pool of logged-in Tractor engine sessions
+
+Opening a session on the engine means a login round-trip, so instead of
+opening and closing one session per query we keep a few of them open and
+hand them out to the query functions.
+
+- Sessions are created lazily through the factory (e.g. `_tlm.start_query`)
+- A session is reused as long as it has not been idle for more than `idleTimeout`
+  seconds, otherwise it is closed (the engine would have expired it anyway)
+- A session idle for more than `pingAfter` seconds is checked with `ping` (a cheap
+  query) before being reused. If the check fails it is closed and we log in again.
+  Sessions that expire while they are used are handled by the callers (see tractorQuery)
+- At most `maxSize` sessions exist at the same time, other threads wait for one
+  to be released
+- A session that failed can be discarded so that the next acquire logs in again
+
+Example :
+>>> pool = SessionPool(_tlm.start_query, maxSize=4, ping=lambda tq: tq.jobs("jid=0", limit=1))
+>>> with pool.session() as tq:
+>>>     tq.jobs("jid=1234")
+"""
+
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+
+def closeSession(session):
+    """ Close the engine client of a session, errors are ignored """
+    try:
+        session.closeEngineClient()
+    except Exception as e:
+        logging.debug(f"TractorSessionPool: Could not close session {session}: {e}")
+
+
+class SessionPool:
+    def __init__(self, factory, maxSize=4, idleTimeout=300.0, closer=closeSession, ping=None, pingAfter=60.0):
+        self.factory = factory
+        self.closer = closer
+        self.maxSize = max(1, maxSize)
+        self.idleTimeout = idleTimeout
+        self.ping = ping
+        self.pingAfter = pingAfter
+        self._idle = []  # [(lastUsed, session)], most recently used last
+        self._nbSessions = 0
+        self._condition = threading.Condition()
+        # Stats
+        self.nbLogins = 0
+        self.nbReuses = 0
+        self.nbEvictions = 0
+        self.nbPings = 0
+        self.nbPingFailures = 0
+
+    def __len__(self):
+        return self._nbSessions
+
+    def _evictIdle(self, now):
+        """ Pop idle sessions that exceeded the idle timeout. Must be called with the lock held """
+        expired = [s for lastUsed, s in self._idle if now - lastUsed > self.idleTimeout]
+        if expired:
+            self._idle = [(lastUsed, s) for lastUsed, s in self._idle if now - lastUsed <= self.idleTimeout]
+            self._nbSessions -= len(expired)
+            self.nbEvictions += len(expired)
+        return expired
+
+    def acquire(self, fresh=False):
+        """ Get a session from the pool, or log in a new one
+        :param fresh: drop all idle sessions and log in again (e.g. after a session expired)
+        """
+        with self._condition:
+            toClose = self._evictIdle(time.monotonic())
+            if fresh:
+                toClose.extend(s for _, s in self._idle)
+                self._nbSessions -= len(self._idle)
+                self._idle = []
+            while not self._idle and self._nbSessions >= self.maxSize:
+                self._condition.wait()
+            session = None
+            idleTime = 0.0
+            if self._idle:
+                lastUsed, session = self._idle.pop()
+                idleTime = time.monotonic() - lastUsed
+            else:
+                # Reserve the slot now, login is done outside of the lock
+                self._nbSessions += 1
+        if session is not None and self.ping is not None and idleTime > self.pingAfter:
+            # The slot of the session is kept for the new login if the check fails
+            if not self._ping(session, idleTime):
+                toClose.append(session)
+                session = None
+        for s in toClose:
+            self.closer(s)
+        if session is not None:
+            with self._condition:
+                self.nbReuses += 1
+        else:
+            try:
+                session = self.factory()
+            except Exception:
+                with self._condition:
+                    self._nbSessions -= 1
+                    self._condition.notify()
+                raise
+            with self._condition:
+                self.nbLogins += 1
+        return session
+
+    def _ping(self, session, idleTime):
+        """ Check that an idle session is still valid """
+        try:
+            self.ping(session)
+            valid = True
+        except Exception as e:
+            logging.info(f"TractorSessionPool: Session idle for {idleTime:.0f}s is not valid anymore ({e}), "
+                         "logging in again")
+            valid = False
+        with self._condition:
+            self.nbPings += 1
+            self.nbPingFailures += not valid
+        return valid
+
+    def release(self, session, discard=False):
+        """ Give back a session to the pool
+        :param discard: close the session instead of keeping it (e.g. after an error)
+        """
+        with self._condition:
+            if discard:
+                self._nbSessions -= 1
+            else:
+                self._idle.append((time.monotonic(), session))
+            self._condition.notify()
+        if discard:
+            self.closer(session)
+
+    @contextmanager
+    def session(self):
+        session = self.acquire()
+        try:
+            yield session
+        except Exception:
+            self.release(session, discard=True)
+            raise
+        else:
+            self.release(session)
+
+    def closeAll(self):
+        """ Close all idle sessions """
+        with self._condition:
+            idle = [s for _, s in self._idle]
+            self._idle = []
+            self._nbSessions -= len(idle)
+            self._condition.notify_all()
+        for s in idle:
+            self.closer(s)
+
+    def registerAtExit(self):
+        atexit.register(self.closeAll)
+        return self
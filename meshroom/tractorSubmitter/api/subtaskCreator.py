@@ -6,30 +6,48 @@ Helper functions to create subtasks
 Provides queueSubtask() to write Tractor subtask definitions to stdout.
 Works with tractorSubtaskWrapper.py to ensure proper stream handling.
 
+To create many subtasks, use a SubtaskBatch (or queueSubtasks) : the definitions
+are buffered and written in large blocks with a single flush at the end, and only
+a summary is logged (set MESHROOM_TRACTOR_SUBTASK_DEBUG=1 to log each subtask).
+
 Example :
 >>> from tractorSubmitter.api.subtaskCreator import queueSubtask
 >>> queueSubtask(command1, **args)
 >>> queueSubtask(command2, **args)
 >>> ...
+>>> with SubtaskBatch() as batch:
+...     for i in range(10000):
+...         batch.queue(f"frame_{i}", argv, **args)
+>>> queueSubtasks(dict(title=f"frame_{i}", argv=argv) for i in range(10000))
 """
 
 import sys
 import os
 import json
 import shlex
-from tractorSubmitter.api.base import TaskInfos, ChunkTaskInfos
+from tractorSubmitter.api.base import TaskInfos, ChunkTaskInfos, tclQuote, tclArgv
 
 
 # Original stdout file descriptor
 # Cached to avoid reopening file descriptor multiple times
 _stdout = None
 
+# Size of the blocks written by SubtaskBatch
+SUBTASK_BUFFER_SIZE = 1 << 20
+# Log each subtask
+SUBTASK_DEBUG = os.environ.get("MESHROOM_TRACTOR_SUBTASK_DEBUG", "0") == "1"
+
 
 def log(*text):
     text = " ".join(text)
     sys.stderr.write(text + "\n")
 
 
+def logDebug(*text):
+    if SUBTASK_DEBUG:
+        log(*text)
+
+
 def _getCachedSubtaskStdout():
     """
     Get cached subtask stdout
@@ -40,18 +58,57 @@ def _getCachedSubtaskStdout():
             try:
                 fd = int(os.environ['TRACTOR_SUBTASK_STDOUT_FD'])
                 # Open the file descriptor for writing
-                _stdout = os.fdopen(fd, 'w', buffering=1)
+                # Subtasks are flushed explicitly (after each one or after each batch)
+                _stdout = os.fdopen(fd, 'w', buffering=SUBTASK_BUFFER_SIZE)
             except (ValueError, OSError):
                 _stdout = sys.stdout
-            log(f"(_getCachedSubtaskStdout) stdout={_stdout}")
+            logDebug(f"(_getCachedSubtaskStdout) stdout={_stdout}")
         else:
             raise FileNotFoundError("(_getCachedSubtaskStdout) Could not find TRACTOR_SUBTASK_STDOUT_FD")
     return _stdout
 
 
+def formatSubtask(title, argv, service="", limits=None, metadata=None, envkey=None):
+    """ Alfred definition of a subtask (see queueSubtask for the arguments) """
+    # Parse command
+    if isinstance(argv, str):
+        cmd_argv = shlex.split(argv)
+    else:
+        cmd_argv = list(argv)
+
+    # Each word is quoted : the command is run as this argv list (e.g. "bash -c <script>" of a packet)
+    cmd_str = tclArgv(cmd_argv)
+
+    # Build tags string
+    tags_str = ""
+    if limits:
+        tags_str = f"-tags {tclQuote(' '.join(limits))}"
+
+    # Build metadata string
+    if isinstance(metadata, dict):
+        metadata = json.dumps(metadata)
+    metadata_str = f"-metadata {tclQuote(metadata)}"
+
+    # Build envkey string
+    envkey_str = ""
+    if envkey:
+        envkey_str = f"-envkey {tclQuote(' '.join(envkey))}"
+
+    # Build service string
+    service_str = f"-service {tclQuote(service)}" if service else ""
+
+    # Alfred task definition
+    return f"""
+Task -title {tclQuote(title)} {service_str} {metadata_str} -cmds {{
+    RemoteCmd {cmd_str} {service_str} {tags_str} {envkey_str}
+}}
+"""
+
+
 def queueSubtask(title, argv, service="", limits=None, metadata=None, envkey=None):
     """
     Queue a subtask to be created in Tractor.
+    The definition is written and flushed right away, use a SubtaskBatch to create many subtasks.
 
     Args:
         title (str): Task title
@@ -74,49 +131,78 @@ def queueSubtask(title, argv, service="", limits=None, metadata=None, envkey=Non
     """
     # Get the correct stdout for Tractor
     tractor_stdout = _getCachedSubtaskStdout()
+    tractor_stdout.write(formatSubtask(title, argv, service, limits, metadata, envkey))
+    tractor_stdout.flush()
+    logDebug(f"Queued subtask: {title}")
 
-    # Parse command
-    if isinstance(argv, str):
-        cmd_argv = shlex.split(argv)
-    else:
-        cmd_argv = list(argv)
-
-    cmd_str = " ".join(cmd_argv)
-
-    # Build tags string
-    tags_str = ""
-    if limits:
-        tags_str = f"-tags {{{' '.join(limits)}}}"
-
-    # Build metadata string
-    if isinstance(metadata, dict):
-        metadata = json.dumps(metadata)
-    metadata_str = f"-metadata {{{metadata}}}"
-
-    # Build envkey string
-    envkey_str = ""
-    if envkey:
-        envkey_str = f"-envkey {{{' '.join(envkey)}}}"
 
-    # Build service string
-    service_str = f"-service {{{service}}}" if service else ""
+class SubtaskBatch:
+    """ Buffer subtask definitions and write them in blocks of `bufferSize` characters
+    Everything is flushed when the batch is closed (at the end of the with block)
+    """
 
-    # Write Alfred task definition
-    task_def = f"""
-Task -title {{{title}}} {service_str} {metadata_str} -cmds {{
-    RemoteCmd {{{cmd_str}}} {service_str} {tags_str} {envkey_str}
-}}
-"""
-    tractor_stdout.write(task_def)
-    tractor_stdout.flush()
-    log(f"Queued subtask: {title}")
+    def __init__(self, stream=None, bufferSize=SUBTASK_BUFFER_SIZE, name="subtasks"):
+        self.stream = stream
+        self.bufferSize = bufferSize
+        self.name = name
+        self.nbSubtasks = 0
+        self.nbBytes = 0
+        self.nbWrites = 0
+        self._buffer = []
+        self._bufferLength = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # Subtasks queued before an error are still created, as with queueSubtask
+        self.close()
+
+    def queue(self, title, argv, service="", limits=None, metadata=None, envkey=None):
+        """ Same arguments as queueSubtask """
+        definition = formatSubtask(title, argv, service, limits, metadata, envkey)
+        self._buffer.append(definition)
+        self._bufferLength += len(definition)
+        self.nbSubtasks += 1
+        logDebug(f"Queued subtask: {title}")
+        if self._bufferLength >= self.bufferSize:
+            self._write()
+
+    def _write(self):
+        if not self._buffer:
+            return
+        if self.stream is None:
+            self.stream = _getCachedSubtaskStdout()
+        data = "".join(self._buffer)
+        self.stream.write(data)
+        self.nbBytes += len(data)
+        self.nbWrites += 1
+        self._buffer, self._bufferLength = [], 0
+
+    def close(self):
+        self._write()
+        if self.stream is not None:
+            self.stream.flush()
+        if self.nbSubtasks:
+            log(f"Queued {self.nbSubtasks} {self.name} ({self.nbBytes} bytes in {self.nbWrites} writes)")
+
+
+def queueSubtasks(subtasks, stream=None, name="subtasks"):
+    """ Queue subtasks from an iterable of queueSubtask keyword arguments (dicts)
+    Returns the number of subtasks
+    """
+    with SubtaskBatch(stream, name=name) as batch:
+        for params in subtasks:
+            batch.queue(**params)
+    return batch.nbSubtasks
 
 
-def queueChunkTask(node, cmdArgs, service, tags=None, rezPackages=None, environment=None):
+def queueChunkTask(node, cmdArgs, service, tags=None, rezPackages=None, environment=None, rezContext=None, 
+                   packetSize=1):
     chunkParams = None
     blockSize, fullSize, nbBlocks = node.nodeDesc.parallelization.getSizes(node)
     if nbBlocks > 1:  # Is it better like this ?
-        chunkParams = {'start': 0, 'end': nbBlocks - 1, 'step': 1}
+        chunkParams = {'start': 0, 'end': nbBlocks - 1, 'step': 1, 'packetSize': packetSize}
     licenses = node.nodeDesc._licenses
     taskInfos = TaskInfos(
         node.name, 
@@ -128,14 +214,19 @@ def queueChunkTask(node, cmdArgs, service, tags=None, rezPackages=None, environm
         licenses=licenses,
         tags=tags.copy() if tags else None,
         expandingTask=False,
-        chunkParams=chunkParams
+        chunkParams=chunkParams,
+        rezContext=rezContext
     )
-    for chunk in TaskInfos.getChunks(chunkParams):
-        chunkInfos = ChunkTaskInfos(taskInfos, chunk)
-        # title, argv, service, metadata
-        chunkParams = chunkInfos.cook()
-        # limits, envkey
-        chunkParams['limits'] = taskInfos.limits
-        chunkParams['envkey'] = taskInfos.envkey
-        print(f"Create task with params :\n{chunkParams}")
-        queueSubtask(**chunkParams)
+
+    def iterChunkParams():
+        for chunk in taskInfos.chunks or ():
+            chunkInfos = ChunkTaskInfos(taskInfos, chunk)
+            # title, argv, service, metadata
+            chunkParams = chunkInfos.cook()
+            # limits, envkey
+            chunkParams['limits'] = taskInfos.limits
+            chunkParams['envkey'] = taskInfos.envkey
+            logDebug(f"Create task with params :\n{chunkParams}")
+            yield chunkParams
+
+    return queueSubtasks(iterChunkParams(), name=f"chunk tasks for {node.name}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""
+Cache for the job and tasks infos fetched from Tractor
+
+- Entries expire after `ttl` seconds (None : never expire)
+- refresh() forces a new fetch
+- invalidate(tids) marks some tasks as stale : only those tasks are
+  fetched again on the next access (e.g. after killing or retrying them)
+- hits/misses counters help tuning the polling load on the engine
+- In incremental mode, once all tasks have been fetched, an expired task table
+  is updated with the tasks that changed since the newest change of the previous
+  reply only. The tasks above the maxtid of the job have been deleted and are
+  dropped, the whole table is fetched again every `fullRefreshPolls` polls
+- The task table is indexed by node, chunk and state (see TaskIndex). The index
+  is built once each time the task table changes
+"""
+
+import os
+import time
+from collections import defaultdict
+
+import tractorSubmitter.api.tractorJobQuery as tq
+
+
+DEFAULT_TTL = float(os.environ.get("TRACTOR_JOB_CACHE_TTL", 10))
+INCREMENTAL = os.environ.get("TRACTOR_JOB_CACHE_INCREMENTAL", "1") == "1"
+# Number of incremental polls between two full fetches of the tasks (catch all deleted tasks)
+FULL_REFRESH_POLLS = int(os.environ.get("TRACTOR_JOB_CACHE_FULL_REFRESH_POLLS", 20))
+
+
+def _toIteration(value):
+    """ Iterations can be stored as int or str in the metadata """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TaskIndex:
+    """ Index of the tasks of a job
+    - byNode : {nodeUid: [tid]}
+    - byChunk : {(nodeUid, iteration): tid}
+    - byIteration : {iteration: [tid]} (for lookups without node)
+    - byState : {state: [tid]}
+    """
+
+    def __init__(self, tasks):
+        self.byNode = defaultdict(list)
+        self.byChunk = {}
+        self.byIteration = defaultdict(list)
+        self.byState = defaultdict(list)
+        for tid, task in tasks.items():
+            metadata = task.get("metadata") or {}
+            uid = metadata.get("nodeUid")
+            # Tasks running a packet of iterations have an "iterations" list
+            iterations = metadata.get("iterations") or [metadata.get("iteration")]
+            if uid is not None:
+                self.byNode[uid].append(tid)
+            for iteration in iterations:
+                iteration = _toIteration(iteration)
+                if iteration is None:
+                    continue
+                self.byChunk[(uid, iteration)] = tid
+                self.byIteration[iteration].append(tid)
+            self.byState[task.get("state")].append(tid)
+
+    def chunkTid(self, uid, iteration):
+        return self.byChunk.get((uid, _toIteration(iteration)))
+
+
+class TractorJobCache:
+    def __init__(self, jid, ttl=DEFAULT_TTL, incremental=INCREMENTAL, fullRefreshPolls=FULL_REFRESH_POLLS):
+        self.jid = jid
+        self.ttl = ttl
+        self.incremental = incremental
+        self.fullRefreshPolls = fullRefreshPolls
+        self._job = None
+        self._tasks = None
+        self._jobTime = None
+        self._tasksTime = None
+        self._since = None  # Newest change of the fetched tasks (engine time), start of the next poll
+        self._nbPolls = 0  # Incremental polls since the last full fetch
+        self._staleTids = set()
+        self._index = None
+        # Stats
+        self.hits = 0
+        self.misses = 0
+
+    def _isExpired(self, fetchTime):
+        if fetchTime is None:
+            return True
+        return self.ttl is not None and time.monotonic() - fetchTime > self.ttl
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _fetchJob(self):
+        self._job = tq.getJob(self.jid)
+        self._jobTime = time.monotonic()
+
+    @property
+    def job(self):
+        if self._isExpired(self._jobTime):
+            self.misses += 1
+            self._fetchJob()
+        else:
+            self.hits += 1
+        return self._job
+
+    def _dropDeletedTasks(self, polledTasks):
+        """ Remove the tasks above the maxtid of the job (e.g. subtasks of an expanding task
+        that has been retried). The job infos are fetched after the poll so that maxtid
+        includes all the polled tasks
+        """
+        self.misses += 1
+        self._fetchJob()
+        maxtid = (self._job or {}).get("maxtid")
+        if maxtid is None:
+            return
+        for tid in [tid for tid in self._tasks if tid > maxtid and tid not in polledTasks]:
+            del self._tasks[tid]
+
+    def _fetchTasks(self):
+        if (self.incremental and self._tasks is not None and self._since is not None
+                and self._nbPolls < self.fullRefreshPolls):
+            # Merge tasks that changed since the last poll
+            tasks = tq.pollJobTasks(self.jid, since=self._since, columns=tq.POLL_TASK_KEYS)
+            self._tasks.update(tasks)
+            self._dropDeletedTasks(tasks)
+            self._since = tq.lastChangeTime(tasks.values(), self._since)
+            self._nbPolls += 1
+        else:
+            self._tasks = tq.getJobTasks(self.jid, columns=tq.POLL_TASK_KEYS)
+            self._since = tq.lastChangeTime(self._tasks.values())
+            self._nbPolls = 0
+        self._tasksTime = time.monotonic()
+        self._staleTids.clear()
+        self._index = None
+
+    @property
+    def tasks(self):
+        if self._isExpired(self._tasksTime):
+            self.misses += 1
+            self._fetchTasks()
+        elif self._staleTids:
+            # Only fetch the tasks that have been invalidated
+            self.misses += 1
+            staleTids, self._staleTids = self._staleTids, set()
+            tasks = tq.getTasks(self.jid, sorted(staleTids))
+            for tid in staleTids:
+                self._tasks.pop(tid, None)
+            self._tasks.update(tasks)
+            self._index = None
+        else:
+            self.hits += 1
+        return self._tasks
+
+    @property
+    def index(self) -> TaskIndex:
+        tasks = self.tasks
+        if self._index is None:
+            self._index = TaskIndex(tasks)
+        return self._index
+
+    def set(self, job, tasks):
+        """ Fill the cache with infos that have already been fetched """
+        now = time.monotonic()
+        self._job, self._jobTime = job, now
+        self._tasks, self._tasksTime = tasks, now
+        # Without the change times (see tq.POLL_TASK_KEYS) the next fetch gets all the tasks
+        self._since = tq.lastChangeTime(tasks.values())
+        self._nbPolls = 0
+        self._staleTids.clear()
+        self._index = None
+
+    def refresh(self):
+        """ Fetch job and tasks infos again """
+        self.invalidate()
+        self.misses += 2
+        self._fetchJob()
+        self._fetchTasks()
+
+    def invalidate(self, tids=None):
+        """ Invalidate cached infos
+        :param tids: only invalidate these tasks (and the job infos because its counters changed)
+        """
+        self._jobTime = None
+        if tids is None:
+            self._tasksTime = None
+            self._since = None  # Next fetch gets all the tasks
+            self._staleTids.clear()
+        elif self._tasksTime is not None:
+            if not isinstance(tids, (list, tuple, set)):
+                tids = [tids]
+            self._staleTids.update(tids)
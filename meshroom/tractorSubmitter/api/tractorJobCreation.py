@@ -6,10 +6,16 @@ from tractorSubmitter.api.base import Chunk
 from tractorSubmitter.api.base import TRACTOR_JOB_URL, PRIORITY_DICT
 from tractorSubmitter.api.base import toTractorEnv
 from tractorSubmitter.api.base import TaskInfos, ChunkTaskInfos, JobInfos
+from tractorSubmitter.api.backgroundSubmission import Submission, submitInBackground
+from tractorSubmitter.api.backgroundSubmission import PHASE_COOK, PHASE_SERIALIZE, PHASE_SPOOL
 
 from tractor.api import author as tractorAuthor
 
 
+def _noProgress(phase):
+    pass
+
+
 class TractorTask:
     """ Stores a task and the additional tasks spawned for each chunks
     Will be helpful later to resubmit only failed chunks for example
@@ -60,15 +66,21 @@ class Task:
         self.taskInfos = taskInfos
         self._children = set()
         self._parents = set()
+        self._graph = None  # Set when the task is registered in a TaskGraph
+        # Name and uid don't change so the key and hash are computed once
+        self._key = frozenset(["TractorTask", self.taskInfos.name, self.taskInfos.uid])
+        self._hash = hash(self._key)
     
     def __repr__(self):
         return f"<Task {self.taskInfos.name} {self.taskInfos.uid}>"
     
     def __hash__(self):
-        return hash(frozenset(["TractorTask", self.taskInfos.name, self.taskInfos.uid]))
+        return self._hash
     
     def __eq__(self, __value: object) -> bool:
-        return hash(self) == hash(__value)
+        if not isinstance(__value, Task):
+            return NotImplemented
+        return self._hash == __value._hash and self._key == __value._key
 
     def addChild(self, task):
         """ Add a task in the children of the current task
@@ -79,6 +91,8 @@ class Task:
         else:
             self._children.add(task)  # Add task as current object children
             task._parents.add(self)   # Add current object as task parent
+            if self._graph is not None:
+                self._graph._onEdgeAdded(self, task)
 
 
 class TaskGraph:
@@ -90,46 +104,225 @@ class TaskGraph:
     
     def __init__(self, job):
         self.job = job
-        self._tasks = set()
+        self._tasks: dict[frozenset, Task] = {}  # Registry {task key: task}
+        # Roots and leaves are maintained when tasks and edges are added
+        # (dicts are used as ordered sets)
+        self._roots: dict[Task, None] = {}
+        self._leaves: dict[Task, None] = {}
         self.__cooked = {}
+        # Collapse chunk fan-in through a barrier task when it reduces the number of edges
+        self.useBarriers = False
+        # Estimated finish time of each task, set by computeCriticalPath
+        self._finishTimes: dict[Task, float] = {}
+        self.stats = {"removedEdges": 0, "barriers": 0, "barrierSavedEdges": 0}
     
     def __len__(self):
         return len(self._tasks)
+
+    def __contains__(self, task):
+        return task._key in self._tasks
+
+    def getTask(self, task):
+        """ Get the registered task equal to the given task """
+        return self._tasks.get(task._key)
+
+    def addTask(self, task: Task) -> Task:
+        """ Register the task. If an equal task exists, the existing task is returned """
+        existing = self._tasks.get(task._key)
+        if existing is not None:
+            return existing
+        self._tasks[task._key] = task
+        task._graph = self
+        if not task._parents:
+            self._roots[task] = None
+        if not task._children:
+            self._leaves[task] = None
+        return task
+
+    def _onEdgeAdded(self, parent: Task, child: Task):
+        self._leaves.pop(parent, None)
+        self._roots.pop(child, None)
     
     @property
     def roots(self):
-        return [task for task in self._tasks if not task._parents]
+        return list(self._roots)
 
     @property
     def leaves(self):
-        return [task for task in self._tasks if not task._children]
+        return list(self._leaves)
+
+    @property
+    def nbEdges(self):
+        return sum(len(task._children) for task in self._tasks.values())
     
-    def cookTask(self, task: Task):
-        """ Cook task, chunk tasks, and set tasks dependencies """
-        if task.taskInfos.uid not in self.__cooked:
+    def _topologicalOrder(self, roots):
+        """ Tasks reachable from roots, children before parents
+        Iterative depth first search so that deep graphs don't hit the recursion limit
+        """
+        order = []
+        visited = set()
+        for root in roots:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(root._children))]
+            while stack:
+                task, children = stack[-1]
+                for child in children:
+                    if child not in visited:
+                        visited.add(child)
+                        stack.append((child, iter(child._children)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(task)
+        return order
+
+    def transitiveReduction(self):
+        """ Remove the dependencies that are implied by other dependencies
+        (e.g. if A -> B -> C then A -> C is removed). The graph must be acyclic.
+        Returns the number of removed edges
+        """
+        order = self._topologicalOrder(self.roots)
+        position = {task: i for i, task in enumerate(order)}
+        descendants = {}  # {task: bitmask of the positions of its descendants}
+        removed = 0
+        for task in order:
+            reach = 0
+            # Closest children first : a child reachable through another child is redundant
+            for child in sorted(task._children, key=position.get, reverse=True):
+                bit = 1 << position[child]
+                if reach & bit:
+                    task._children.discard(child)
+                    child._parents.discard(task)
+                    removed += 1
+                else:
+                    reach |= bit | descendants[child]
+            descendants[task] = reach
+        self.stats["removedEdges"] += removed
+        return removed
+
+    def _criticalKey(self, task: Task):
+        return (self._finishTimes.get(task, 0.0), task.taskInfos.name)
+
+    def computeCriticalPath(self, estimateDuration):
+        """ Longest chain of dependencies weighted by the estimated task durations
+        A task starts when all its children are done, so it finishes at the latest
+        finish time of its children plus its own duration.
+        Returns (path, makespan), the path goes from the first task to run to the last one
+        """
+        self._finishTimes = {}
+        for task in self._topologicalOrder(self.roots):
+            start = max((self._finishTimes[child] for child in task._children), default=0.0)
+            self._finishTimes[task] = start + estimateDuration(task.taskInfos)
+        if not self._finishTimes:
+            return [], 0.0
+        task = max(self._roots, key=self._criticalKey)
+        makespan = self._finishTimes[task]
+        path = [task]
+        while task._children:
+            task = max(task._children, key=self._criticalKey)
+            path.append(task)
+        path.reverse()
+        return path, makespan
+
+    def _orderedChildren(self, task: Task):
+        """ Children on the longest chains first, so that Tractor dispatches them first """
+        if not self._finishTimes:
+            return list(task._children)
+        return sorted(task._children, key=self._criticalKey, reverse=True)
+
+    def _createBarrier(self, task: Task, childTasks, nbParents):
+        """ Use a task without command that waits for all the children
+        so that each chunk only depends on this task : n+m edges instead of n*m
+        """
+        barrier = tractorAuthor.Task(title=f"{task.taskInfos.name}_dependencies", argv=None, 
+                                     service=task.taskInfos.service)
+        for childTask in childTasks:
+            barrier.addChild(childTask)
+        self.stats["barriers"] += 1
+        self.stats["barrierSavedEdges"] += nbParents * len(childTasks) - (nbParents + len(childTasks))
+        return barrier
+
+    def _cookTasks(self, roots):
+        """ Cook the tasks reachable from roots that have not been cooked yet,
+        then set their dependencies in a single pass
+        """
+        cooked = []
+        for task in self._topologicalOrder(roots):
+            if task.taskInfos.uid in self.__cooked:
+                continue
             logging.info(f"TractorSubmitter: Create Tractor Task: {task.taskInfos.name}")
-            tractorTask = cookTractorTask(task.taskInfos)
-            self.__cooked[task.taskInfos.uid] = tractorTask
+            self.__cooked[task.taskInfos.uid] = cookTractorTask(task.taskInfos)
+            cooked.append(task)
+        for task in cooked:
+            tractorTask = self.__cooked[task.taskInfos.uid]
+            # Children must wait for all the chunks of the task
+            parents = list(tractorTask.chunkTasks.values()) or [tractorTask.task]
+            childTasks = [self.__cooked[child.taskInfos.uid].task for child in self._orderedChildren(task)]
+            if self.useBarriers and len(parents) * len(childTasks) > len(parents) + len(childTasks):
+                childTasks = [self._createBarrier(task, childTasks, len(parents))]
+            for childTask in childTasks:
+                for parent in parents:
+                    parent.addChild(childTask)
+
+    @staticmethod
+    def _nbTractorTasks(task: Task):
+        """ Number of tractor tasks created for the task (node task and chunk tasks) """
+        chunks = task.taskInfos.chunks
+        return 1 + (len(chunks) if chunks else 0)
+
+    @property
+    def nbTractorTasks(self):
+        return sum(self._nbTractorTasks(task) for task in self._tasks.values())
+
+    def partition(self, maxTasks):
+        """ Split the tasks in groups of at most maxTasks tractor tasks
+        Tasks are sorted by depth (dependencies first) so that the groups are cut between 
+        dependency levels, and each group only depends on previous groups.
+        Returns a list of (tasks, indices of the groups it depends on)
+        """
+        order = self._topologicalOrder(self.roots)
+        depths = {}
+        for task in order:
+            depths[task] = 1 + max((depths[child] for child in task._children), default=-1)
+        position = {task: i for i, task in enumerate(order)}
+        groups, groupIndex, count = [[]], {}, 0
+        for task in sorted(order, key=lambda t: (depths[t], position[t])):
+            nbTasks = self._nbTractorTasks(task)
+            if groups[-1] and count + nbTasks > maxTasks:
+                groups.append([])
+                count = 0
+            groups[-1].append(task)
+            groupIndex[task] = len(groups) - 1
+            count += nbTasks
+        dependencies = [set() for _ in groups]
+        for task, index in groupIndex.items():
             for child in task._children:
-                childTask = self.cookTask(child)
-                if tractorTask.chunkTasks:
-                    for chkTask in tractorTask.chunkTasks.values():
-                        chkTask.addChild(childTask)
-                else:
-                    tractorTask.task.addChild(childTask)
+                if groupIndex[child] != index:
+                    dependencies[index].add(groupIndex[child])
+        return list(zip(groups, dependencies))
+
+    def cookTask(self, task: Task):
+        """ Cook task, chunk tasks, and set tasks dependencies """
+        self._cookTasks([task])
         return self.__cooked[task.taskInfos.uid].task
     
     def cook(self, jobTask):
         """ Cook the graph (i.e. create all tractor tasks) and dependencies
         jobTask is the root task for the whole job
         """
-        for task in self.roots:
-            child = self.cookTask(task)
-            jobTask.addChild(child)
+        roots = self.roots
+        if self._finishTimes:
+            roots.sort(key=self._criticalKey, reverse=True)
+        self._cookTasks(roots)
+        for task in roots:
+            jobTask.addChild(self.__cooked[task.taskInfos.uid].task)
 
 
 class Job:
-    def __init__(self, name, tags=None, requirements=None, environment=None, user=None, comment="", paused=False):
+    def __init__(self, name, tags=None, requirements=None, environment=None, user=None, comment="", paused=False, 
+                 rezContext=None):
         self.jobInfos = JobInfos(
             name, 
             share="", 
@@ -141,6 +334,10 @@ class Job:
             paused=paused
         )
         self._graph = TaskGraph(self)
+        self.rezContext = rezContext  # Shared by all the tasks of the job
+        # Set by prioritizeCriticalPath
+        self.criticalPath: list[Task] = []
+        self.makespan = None
     
     def createTask(self, name, commandArgs, uid, tags=None, rezPackages=None, service=None, 
                    licenses=None, expandingTask=None, chunkParams=None) -> Task:
@@ -154,19 +351,52 @@ class Job:
             licenses=licenses, 
             tags=tags.copy() if tags else None, 
             expandingTask=expandingTask, 
-            chunkParams=chunkParams
+            chunkParams=chunkParams,
+            rezContext=self.rezContext
         )
         task = Task(taskInfos)
         # Dont add the task if it has already been created
-        for t in self._graph._tasks:
-            if t == task:
-                logging.error(f"TractorSubmitter: Task already created : {t}")
-                return t
-        self._graph._tasks.add(task)
-        return task
+        existing = self._graph.getTask(task)
+        if existing is not None:
+            logging.error(f"TractorSubmitter: Task already created : {existing}")
+            return existing
+        return self._graph.addTask(task)
     
-    def cook(self):
-        """ Cook job and tasks graph """
+    def prioritizeCriticalPath(self, estimateDuration):
+        """ Compute the critical path and order the dependencies so that the tasks
+        on the longest chains are dispatched first. Tasks on the path are tagged in their metadata.
+        :param estimateDuration: function taskInfos -> estimated duration in seconds
+        """
+        self.criticalPath, self.makespan = self._graph.computeCriticalPath(estimateDuration)
+        for task in self.criticalPath:
+            task.taskInfos.tags["criticalPath"] = True
+        return self.criticalPath, self.makespan
+
+    def criticalPathReport(self):
+        """ Critical path with the estimated start and end time of each task """
+        lines = [f"Critical path: {len(self.criticalPath)} tasks, estimated makespan {self.makespan or 0:.1f}s"]
+        start = 0.0
+        for task in self.criticalPath:
+            end = self._graph._finishTimes[task]
+            lines.append(f"  {start:>10.1f}s -> {end:>10.1f}s  {task.taskInfos.name}")
+            start = end
+        return "\n".join(lines)
+    
+    def cook(self, reduceEdges=False, estimateDuration=None):
+        """ Cook job and tasks graph
+        :param reduceEdges: remove redundant dependencies and use barrier tasks for chunks fan-in
+        :param estimateDuration: if set, tasks on the critical path are dispatched first
+                                 (see prioritizeCriticalPath)
+        """
+        if reduceEdges:
+            nbEdges = self._graph.nbEdges
+            removed = self._graph.transitiveReduction()
+            logging.info(f"TractorSubmitter: Transitive reduction removed {removed}/{nbEdges} edges")
+        if estimateDuration is not None:
+            _, makespan = self.prioritizeCriticalPath(estimateDuration)
+            logging.info(f"TractorSubmitter: Critical path of {len(self.criticalPath)} tasks, "
+                         f"estimated makespan {makespan:.1f}s")
+        self._graph.useBarriers = reduceEdges
         # Create job
         tractorJob = tractorAuthor.Job(**self.jobInfos.cook())
         serialsubtasks = (len(self._graph.leaves) == 1)
@@ -177,20 +407,98 @@ class Job:
             # tractor API will raise a RequiredValueError if no task are in job so we add a dummy one
             # note that the job will not even appear in Tractor web ui
             _ = tractorJob.newTask(title='dummy')
+        if reduceEdges:
+            logging.info(f"TractorSubmitter: Edges stats: {self._graph.stats}")
         return tractorJob
-    
-    def submit(self, priority="normal", share="", dryRun=False, block=False):
-        """Submit to Tractor, or print TCL if dryRun."""
+
+    def _subJob(self, tasks, name):
+        """ New job with the same settings holding the given tasks and the dependencies between them """
+        jobInfos = self.jobInfos
+        job = Job(name, tags=jobInfos.tags.copy(), requirements=jobInfos.service, 
+                  environment=jobInfos.environment.copy(), user=jobInfos.user, comment=jobInfos.comment, 
+                  paused=jobInfos.paused, rezContext=self.rezContext)
+        job.jobInfos.share = jobInfos.share
+        subTasks = {task: job._graph.addTask(Task(task.taskInfos)) for task in tasks}
+        for task, subTask in subTasks.items():
+            for child in task._children:
+                if child in subTasks:
+                    subTask.addChild(subTasks[child])
+        return job
+
+    def split(self, maxTasks):
+        """ Split the job in jobs of at most maxTasks tractor tasks (see TaskGraph.partition)
+        Returns a list of (job, indices of the jobs it depends on)
+        """
+        groups = self._graph.partition(maxTasks)
+        jobs = []
+        for i, (tasks, dependencies) in enumerate(groups):
+            job = self._subJob(tasks, f"{self.jobInfos.name} ({i + 1}/{len(groups)})")
+            jobs.append((job, dependencies))
+        return jobs
+
+    def _submitSplit(self, maxTasks, priority, dryRun, block, reduceEdges, estimateDuration, progress):
+        """ Spool the sub-jobs in order, each one waits for the jobs it depends on (afterjids)
+        The last job stores the ids of the group in its metadata (groupJids)
+        """
+        jobs = self.split(maxTasks)
+        logging.info(f"TractorSubmitter: {self._graph.nbTractorTasks} tasks, split in {len(jobs)} jobs "
+                     f"of at most {maxTasks} tasks")
+        jids = []
+        for i, (job, dependencies) in enumerate(jobs):
+            job.jobInfos.afterjids = [jids[j] for j in sorted(dependencies)]
+            if i == len(jobs) - 1:
+                job.jobInfos.tags["groupJids"] = list(jids)
+            try:
+                res = job.submit(priority, dryRun=dryRun, block=block, reduceEdges=reduceEdges, 
+                                 estimateDuration=estimateDuration, progress=progress)
+            except Exception:
+                if jids:
+                    logging.error(f"TractorSubmitter: Could not spool {job.jobInfos.name}, "
+                                  f"jobs already spooled : {jids}")
+                raise
+            # In dry run the jobs are numbered instead
+            jids.append(res.get("id", f"job{i + 1}"))
+        if dryRun:
+            return {}
+        return {"id": jids[-1], "jids": jids, "url": TRACTOR_JOB_URL.format(jid=jids[-1])}
+
+    def _logDryRun(self, tcl, estimateDuration):
+        logging.info("TractorSubmitter: Job in TCL format :")
+        logging.info(tcl)
+        if estimateDuration is not None:
+            # The critical path has been computed while cooking
+            logging.info(f"TractorSubmitter: {self.criticalPathReport()}")
+
+    def submit(self, priority="normal", share="", dryRun=False, block=False, reduceEdges=False, 
+               estimateDuration=None, maxTasks=None, progress=None):
+        """Submit to Tractor, or print TCL if dryRun.
+        :param maxTasks: split the job in linked jobs of at most maxTasks tractor tasks.
+                         The result then has the ids of all the jobs in "jids" ("id" is the last one)
+        :param progress: function called with the phase (cook, serialize, spool) when it starts.
+                         The script is serialized during the spool.
+        """
+        progress = progress or _noProgress
         if share:
             self.jobInfos.share = share
 
-        job = self.cook()
+        if maxTasks and self._graph.nbTractorTasks > maxTasks:
+            return self._submitSplit(maxTasks, priority, dryRun, block, reduceEdges, estimateDuration, progress)
+
+        progress(PHASE_COOK)
+        job = self.cook(reduceEdges=reduceEdges, estimateDuration=estimateDuration)
         job.priority = PRIORITY_DICT.get(priority, 5000)
 
         if dryRun:
-            logging.info("TractorSubmitter: Job in TCL format :")
-            logging.info(job.asTcl())
+            progress(PHASE_SERIALIZE)
+            self._logDryRun(job.asTcl(), estimateDuration)
             return {}
         else:
+            progress(PHASE_SPOOL)
             jid = job.spool(block=block, owner=self.jobInfos.user)
             return {"id": jid, "url": TRACTOR_JOB_URL.format(jid=jid)}
+
+    def submitInBackground(self, progressCallback=None, **submitKwargs) -> Submission:
+        """ Cook and spool the job on a worker thread (see backgroundSubmission)
+        Returns a Submission handle, its result is the result of submit()
+        """
+        return submitInBackground(self, progressCallback, **submitKwargs)
@@ -1,8 +1,22 @@
 #!/usr/bin/env python
 
 import os
+import re
 import json
+import time
+import logging
+import datetime
+import functools
 
+from tractorSubmitter.api.sessionPool import SessionPool
+
+
+# Number of engine sessions kept open (0 to open a new session for each query)
+SESSION_POOL_SIZE = int(os.environ.get("TRACTOR_SESSION_POOL_SIZE", 4))
+# Idle sessions are closed after this delay (in seconds)
+SESSION_IDLE_TIMEOUT = float(os.environ.get("TRACTOR_SESSION_IDLE_TIMEOUT", 300))
+# Sessions idle for more than this delay (in seconds) are checked before being reused
+SESSION_PING_AFTER = float(os.environ.get("TRACTOR_SESSION_PING_AFTER", 60))
 
 _tlm = None
 _tq = None
@@ -22,33 +36,118 @@ except ImportError:
     _tq = tractor.api.query
     _tq.setEngineClientParam(user=credentials['username'], password=credentials['password'])
 
+def pingSession(tq):
+    """ Cheap query that fails if the session is not valid anymore """
+    tq.jobs("jid=0", columns=["jid"], limit=1)
+
+_pool = None
+if _tlm is not None and SESSION_POOL_SIZE > 0:
+    _pool = SessionPool(_tlm.start_query, maxSize=SESSION_POOL_SIZE, idleTimeout=SESSION_IDLE_TIMEOUT,
+                        ping=pingSession, pingAfter=SESSION_PING_AFTER).registerAtExit()
+
+
+# Maximum number of ids in a single 'key in [...]' expression
+MAX_REQUEST_IDS = 200
+
+
+def _wrapCondition(key, value):
+    if isinstance(value, (list, tuple, set)):
+        return f"{key} in [{' '.join(str(v) for v in value)}]"
+    return f"{key}={value}"
+
 
 def wrapRequest(request):
+    """ Request follows : 'CONDITION1 and CONDITION 2 and ...'
+    List values are converted to 'key in [v1 v2 ...]'
+    """
     if isinstance(request, str):
         return request
     elif isinstance(request, dict):
-        return " and ".join([f"{k}={v}" for k, v in request.items()])
+        return " and ".join([_wrapCondition(k, v) for k, v in request.items()])
+
 
+def chunkIds(ids, size=MAX_REQUEST_IDS):
+    """ Split ids in lists of at most `size` elements to keep expressions small """
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
 
-def tractorQuery(func):
+
+# Exceptions raised by the engine client when the session is not valid anymore
+SESSION_ERROR_NAMES = {"PasswordRequired", "LoginRequired", "LoginError", "SessionExpired", "InvalidSession"}
+# Messages of the other errors that mean the same (expired session, HTTP 401 of the engine)
+SESSION_ERROR_PATTERN = re.compile(
+    r"\bsession (has |is )?(expired|invalid)\b|\b(expired|invalid) session\b"
+    r"|\b401 unauthori[sz]ed\b|\b(http|status|error)( code)?[ :=]*401\b",
+    re.IGNORECASE
+)
+
+
+def isSessionError(error):
+    """ True if the error means that we have to log in again (expired or invalid session)
+    Other errors (e.g. a query that mentions a session or a login) are not retried
+    """
+    if any(cls.__name__ in SESSION_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    return SESSION_ERROR_PATTERN.search(str(error)) is not None
+
+
+def tractorQuery(func, retry=True):
+    """ Provide an engine session as first argument of the decorated function
+    Sessions are taken from the pool. If the session has expired, we log in again
+    and retry once (only if `retry` : actions are never sent twice, see tractorAction).
+    Other errors are raised, the session is kept.
+    """
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         if _tlm is None:
             res = func(_tq, *args, **kwargs)
             return res
-        else:
+        elif _pool is None:
             tq = _tlm.start_query()
+            try:
+                res = func(tq, *args, **kwargs)
+            finally:
+                tq.closeEngineClient()
+            return res
+        tq = _pool.acquire()
+        try:
             res = func(tq, *args, **kwargs)
-            tq.closeEngineClient()
+        except Exception as e:
+            if not isSessionError(e):
+                _pool.release(tq)
+                raise
+            _pool.release(tq, discard=True)
+            if not retry:
+                # The action may have reached the engine
+                logging.warning(f"TractorQuery: {func.__name__} failed, the session has expired ({e})")
+                raise
+            logging.warning(f"TractorQuery: {func.__name__} failed, the session has expired ({e}), "
+                            "retrying with a new session")
+            tq = _pool.acquire(fresh=True)
+            try:
+                res = func(tq, *args, **kwargs)
+            except Exception as e:
+                _pool.release(tq, discard=isSessionError(e))
+                raise
+        _pool.release(tq)
         return res
     return wrapper
 
 
+def tractorAction(func):
+    """ tractorQuery for the actions (kill, retry, skip...) : they are not idempotent so they are never re-sent """
+    return tractorQuery(func, retry=False)
+
+
 # 
 # Query job/task infos
 # 
 
+# The metadata holds the ids of the group of a split submission (see jobGroupFromMetadata)
 JOB_KEYS = [
-    "jid", "title", "spoolhost", "numactive", "numready", "numdone", "numerror", "maxtid", "priority", "afterjids"
+    "jid", "title", "spoolhost", "numactive", "numready", "numdone", "numerror", "maxtid", "priority", "afterjids",
+    "metadata"
 ]
 
 @tractorQuery
@@ -67,10 +166,46 @@ def getCurrentRunningJobInfos():
         return None
     return getJob(jid=jid)
 
+@tractorQuery
+def _getJobsChunk(tq, jids, columns):
+    request = {"jid": jids}
+    return tq.jobs(wrapRequest(request), columns=columns, limit=len(jids))
+
+def getJobs(jids, columns=JOB_KEYS):
+    """ Get multiple jobs with one request per MAX_REQUEST_IDS jobs
+    Returns a dict {jid: job}, jobs that could not be found are missing
+    """
+    columns = list(columns)
+    if "jid" not in columns:
+        columns.append("jid")
+    jobs = {}
+    for chunk in chunkIds(jids):
+        for job in _getJobsChunk(chunk, columns):
+            jobs[int(job["jid"])] = job
+    return jobs
+
+def jobGroupFromMetadata(jid, metadata):
+    """ Ids of the jobs spooled together when a submission has been split
+    They are stored in the metadata of the last job of the group (groupJids)
+    Returns [jid] if the job is not part of a group
+    """
+    try:
+        metadata = json.loads(metadata or "{}") if isinstance(metadata, str) else (metadata or {})
+    except ValueError:
+        metadata = {}
+    return [int(j) for j in metadata.get("groupJids", [])] + [int(jid)]
+
+def getJobGroup(jid):
+    job = getJobs([jid], columns=["jid", "metadata"]).get(int(jid)) or {}
+    return jobGroupFromMetadata(jid, job.get("metadata"))
+
 
 TASK_KEYS = [
     "jid", "title", "state", "tid", "ptids", "progress", "retrycount", "currcid", "cids", "metadata"
 ]
+# Last changes of a task (engine time), used by the incremental polls
+CHANGE_TIME_KEYS = ["statetime", "activetime"]
+POLL_TASK_KEYS = TASK_KEYS + CHANGE_TIME_KEYS
 
 def _formatTask(task):
     tractorTask = {}
@@ -91,20 +226,148 @@ def _formatTask(task):
         tractorTask[k] = v
     return tractorTask
 
+# Number of tasks requested per page
+TASK_PAGE_SIZE = 1000
+
 @tractorQuery
-def getJobTasks(tq, jid):
-    request = {"jid": jid}
-    limit = 1000
-    tasks = tq.tasks(wrapRequest(request), columns=TASK_KEYS, limit=limit)
-    if len(tasks) >= limit:
-        print(f"[Warning] Tractor might have not collected all the tasks ! Limit of {limit} reached")
+def _getTasksPage(tq, request, lastKey, limit, columns=TASK_KEYS):
+    """ Get at most `limit` tasks matching the request, sorted by (jid, tid)
+    and located after lastKey=(jid, tid)
+    """
+    request = wrapRequest(request)
+    if lastKey is not None:
+        jid, tid = lastKey
+        request = f"{request} and (jid>{jid} or (jid={jid} and tid>{tid}))"
+    return tq.tasks(request, columns=columns, sortby=["jid", "tid"], limit=limit)
+
+def _iterTasks(request, pageSize=TASK_PAGE_SIZE, columns=TASK_KEYS):
+    lastKey = None
+    while True:
+        tasks = _getTasksPage(request, lastKey, pageSize, columns)
+        for task in tasks:
+            task = _formatTask(task)
+            lastKey = (task.get("jid"), task.get("tid"))
+            yield task
+        if len(tasks) < pageSize:
+            return
+
+def iterJobTasks(jid, pageSize=TASK_PAGE_SIZE, columns=TASK_KEYS):
+    """ Iterate over all the tasks of the job, ordered by tid
+    Tasks are requested page by page so there is no limit on the number of tasks
+    and only one page is held in memory at a time.
+    """
+    return _iterTasks({"jid": jid}, pageSize, columns)
+
+def getJobTasks(jid, columns=TASK_KEYS):
+    """ Get all the tasks of the job as a dict {tid: task} """
     tractorTasks = {}
-    for task in tasks:
-        task = _formatTask(task)
+    for task in iterJobTasks(jid, columns=columns):
         tid = task.get("tid")
         tractorTasks[tid] = task
     return tractorTasks
 
+# Time format used in time conditions (e.g. statetime>='2024-01-31 12:00:00')
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Newest change seen by the polls of each job {jid: engine time}
+_lastChangeTimes = {}
+
+def _engineTime(value):
+    """ Time returned by the engine (string, datetime or timestamp) in TIME_FORMAT, None if not set """
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return time.strftime(TIME_FORMAT, time.localtime(value))
+    if not isinstance(value, datetime.datetime):
+        try:
+            value = datetime.datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            return str(value)
+    return value.strftime(TIME_FORMAT)
+
+def lastChangeTime(tasks, since=None):
+    """ Newest statetime/activetime of the tasks, or `since` if no task changed after it
+    This is the `since` of the next poll : it comes from the engine clock, not from the local one
+    """
+    newest = _engineTime(since)
+    for task in tasks:
+        for key in CHANGE_TIME_KEYS:
+            changeTime = _engineTime(task.get(key))
+            if changeTime is not None and (newest is None or changeTime > newest):
+                newest = changeTime
+    return newest
+
+def getLastChangeTime(jid):
+    return _lastChangeTimes.get(jid)
+
+def resetPoll(jid=None):
+    """ Forget the last change time so that the next poll fetches all the tasks """
+    if jid is None:
+        _lastChangeTimes.clear()
+    else:
+        _lastChangeTimes.pop(jid, None)
+
+def pollJobTasks(jid, since=None, columns=TASK_KEYS):
+    """ Incremental poll : get the tasks of the job that changed since the last poll
+    :param since: engine time (e.g. lastChangeTime of the previous reply) to use instead of the
+                  newest change seen by the previous polls of this job (in this case it is not updated)
+    :param columns: task columns to request, the change times are always requested
+    Returns a dict {tid: task}. If the job has never been polled all tasks are returned.
+    """
+    remember = since is None
+    if since is None:
+        since = _lastChangeTimes.get(jid)
+    columns = list(columns) + [key for key in CHANGE_TIME_KEYS if key not in columns]
+    if since is None:
+        request = {"jid": jid}
+    else:
+        # The tasks that changed in the same second as the newest change are fetched again
+        sinceStr = _engineTime(since)
+        request = f"{wrapRequest({'jid': jid})} and (statetime>='{sinceStr}' or activetime>='{sinceStr}')"
+    tractorTasks = {}
+    for task in _iterTasks(request, columns=columns):
+        tractorTasks[task.get("tid")] = task
+    if remember:
+        changeTime = lastChangeTime(tractorTasks.values(), since)
+        if changeTime is not None:
+            _lastChangeTimes[jid] = changeTime
+    return tractorTasks
+
+def getTasks(jid, tids):
+    """ Get some tasks of the job as a dict {tid: task} """
+    tractorTasks = {}
+    for chunk in chunkIds(tids):
+        for task in _iterTasks({"jid": jid, "tid": chunk}):
+            tractorTasks[task.get("tid")] = task
+    return tractorTasks
+
+INVOCATION_KEYS = ["jid", "tid", "cid", "blade", "elapsedreal"]
+
+@tractorQuery
+def _getInvocations(tq, jid, tids, columns):
+    request = f"{wrapRequest({'jid': jid, 'tid': tids})} and current"
+    return tq.invocations(request, columns=columns)
+
+def getTasksInvocations(jid, tids, columns=INVOCATION_KEYS):
+    """ Get the current invocation (i.e. last execution) of the commands of the tasks
+    Returns a dict {tid: invocation}
+    """
+    invocations = {}
+    for chunk in chunkIds(tids):
+        for invocation in _getInvocations(jid, chunk, columns):
+            invocations[int(invocation["tid"])] = invocation
+    return invocations
+
+def getTasksForJobs(jids, columns=TASK_KEYS):
+    """ Get all the tasks of multiple jobs as a dict {jid: {tid: task}}
+    Jobs are requested together, MAX_REQUEST_IDS jobs at a time
+    """
+    jids = list(jids)
+    tractorTasks = {int(jid): {} for jid in jids}
+    for chunk in chunkIds(jids):
+        for task in _iterTasks({"jid": chunk}, columns=columns):
+            tractorTasks.setdefault(task.get("jid"), {})[task.get("tid")] = task
+    return tractorTasks
+
 @tractorQuery
 def getTask(tq, jid, tid):
     request = {"jid": jid, "tid": tid}
@@ -124,90 +387,68 @@ def getCurrentRunningTaskInfos():
 
 # 
 # Job actions
+# Actions accept one id or a list of ids : a list is sent as 'jid in [...]' / 'tid in [...]'
+# requests of at most MAX_REQUEST_IDS ids
 # 
 
-@tractorQuery
-def pauseJob(tq, jid):
+def _idChunks(ids):
+    if isinstance(ids, (list, tuple, set)):
+        return list(chunkIds(sorted(ids)))
+    return [ids]
+
+@tractorAction
+def _jobAction(tq, action, jids):
+    getattr(tq, action)(wrapRequest({"jid": jids}))
+
+def _applyJobAction(action, jid):
+    for jids in _idChunks(jid):
+        _jobAction(action, jids)
+
+def pauseJob(jid):
     """ Pause job : scheduled tasks won't be launched """
-    if isinstance(jid, list):
-        jobs = [{"jid": j} for j in jid]
-    else:
-        jobs = {"jid": jid}
-    tq.pause(wrapRequest(jobs))
+    _applyJobAction("pause", jid)
 
-@tractorQuery
-def unpauseJob(tq, jid):
+def unpauseJob(jid):
     """ Unpause the job : Allow scheduled tasks to be launched """
-    if isinstance(jid, list):
-        jobs = [{"jid": j} for j in jid]
-    else:
-        jobs = {"jid": jid}
-    tq.unpause(wrapRequest(jobs))
+    _applyJobAction("unpause", jid)
 
-@tractorQuery
-def interruptJob(tq, jid):
+def interruptJob(jid):
     """ Interrupt all running tasks and block the job """
-    if isinstance(jid, list):
-        jobs = [{"jid": j} for j in jid]
-    else:
-        jobs = {"jid": jid}
-    tq.interrupt(wrapRequest(jobs))
+    _applyJobAction("interrupt", jid)
 
-@tractorQuery
-def restartJob(tq, jid):
+def restartJob(jid):
     """ Respool the job """
-    if isinstance(jid, list):
-        jobs = [{"jid": j} for j in jid]
-    else:
-        jobs = {"jid": jid}
-    tq.interrupt(wrapRequest(jobs))
+    _applyJobAction("interrupt", jid)
 
-@tractorQuery
-def retryErrorTasks(tq, jid):
+def retryErrorTasks(jid):
     """ Retry all error tasks """
-    if isinstance(jid, list):
-        jobs = [{"jid": j} for j in jid]
-    else:
-        jobs = {"jid": jid}
-    tq.retryerrors(wrapRequest(jobs))
+    _applyJobAction("retryerrors", jid)
 
 
 # 
 # Task actions
 # 
 
-@tractorQuery
-def retryTask(tq, jid, tid):
+@tractorAction
+def _taskAction(tq, action, jid, tids):
+    getattr(tq, action)(wrapRequest({"jid": jid, "tid": tids}))
+
+def _applyTaskAction(action, jid, tid):
+    for tids in _idChunks(tid):
+        _taskAction(action, jid, tids)
+
+def retryTask(jid, tid):
     """ Relaunch a task """
-    if isinstance(tid, list):
-        tasks = [{"jid": jid, "tid": t} for t in tid]
-    else:
-        tasks = {"jid": jid, "tid": tid}
-    tq.retry(wrapRequest(tasks))
+    _applyTaskAction("retry", jid, tid)
 
-@tractorQuery
-def resumeTask(tq, jid, tid):
+def resumeTask(jid, tid):
     """ Resume a tasks (that have been killed, paused or interrupted I guess ? We should test this one) """
-    if isinstance(tid, list):
-        tasks = [{"jid": jid, "tid": t} for t in tid]
-    else:
-        tasks = {"jid": jid, "tid": tid}
-    tq.resume(wrapRequest(tasks))
+    _applyTaskAction("resume", jid, tid)
 
-@tractorQuery
-def killTask(tq, jid, tid):
+def killTask(jid, tid):
     """ Kills a running task """
-    if isinstance(tid, list):
-        tasks = [{"jid": jid, "tid": t} for t in tid]
-    else:
-        tasks = {"jid": jid, "tid": tid}
-    tq.kill(wrapRequest(tasks))
+    _applyTaskAction("kill", jid, tid)
 
-@tractorQuery
-def skipTask(tq, jid, tid):
+def skipTask(jid, tid):
     """ Skips a task : job won't be blocked by this task and considers it as done """
-    if isinstance(tid, list):
-        tasks = [{"jid": jid, "tid": t} for t in tid]
-    else:
-        tasks = {"jid": jid, "tid": tid}
-    tq.skip(wrapRequest(tasks))
+    _applyTaskAction("skip", jid, tid)
@@ -7,56 +7,189 @@ import logging
 import importlib
 from meshroom.core.submitter import BaseSubmitter, SubmitterOptions, SubmitterOptionsEnum
 import tractorSubmitter.api.tractorJobQuery as tq
-from tractorSubmitter.api.base import getRequestPackages
+from tractorSubmitter.api.base import RezContext, TRACTOR_JOB_URL
 from tractorSubmitter.api.base import TaskInfos, ChunkTaskInfos
 from tractorSubmitter.api.tractorJobCreation import Task, Job
+from tractorSubmitter.api.tractorJobCache import TractorJobCache
+from tractorSubmitter.api.packetSizing import PacketSizer, DurationEstimator
 from tractorSubmitter.api.subtaskCreator import queueChunkTask
+from tractorSubmitter.api.backgroundSubmission import Submission
 from meshroom.core.submitter import BaseSubmittedJob
 
 currentDir = os.path.dirname(os.path.realpath(__file__))
 binDir = os.path.dirname(os.path.dirname(os.path.dirname(currentDir)))
 
 
+TASK_STATE_ACTIVE = "active"
+TASK_STATE_ERROR = "error"
+TASK_STATE_DONE = "done"
+
+
 class TractorJob(BaseSubmittedJob):
     """
     Interface to manipulate the job via Meshroom
+    If the submission has been split in several jobs (see Job.submit maxTasks), jid is the
+    last job and the node methods are applied on the job that holds the node.
     """
 
-    def __init__(self, jid, submitter):
+    def __init__(self, jid, submitter, jids=None):
         super().__init__(jid, submitter)
         self.jid = jid
         self.submitter: TractorSubmitter = submitter
         # self.jobUrl = TRACTOR_JOB_URL.format(jid=jid)
-        self.__tractorJob = None
-        self.__tractorJobTasks = None
+        self._cache = TractorJobCache(jid)
+        self._caches = {jid: self._cache}
+        self._jids = list(jids) if jids else None
+    
+    @property
+    def jids(self) -> list[int]:
+        """ Jobs of the group (only this job if the submission was not split) """
+        if self._jids is None:
+            # The group is in the metadata of the job, fetched with the job infos
+            job = self._cache.job or {}
+            self._jids = tq.jobGroupFromMetadata(self.jid, job.get("metadata"))
+        return self._jids
+
+    def _getCache(self, jid):
+        if jid not in self._caches:
+            self._caches[jid] = TractorJobCache(jid)
+        return self._caches[jid]
+
+    def _groupCaches(self) -> list[TractorJobCache]:
+        return [self._getCache(jid) for jid in self.jids]
+
+    def _nodeCache(self, uid) -> TractorJobCache:
+        """ Cache of the job that holds the tasks of the node """
+        for cache in self._groupCaches():
+            if uid in cache.index.byNode:
+                return cache
+        return self._cache
     
     def printInfos(self):
-        print(f"[Tractor Job] {self.jid}")
-        print(f"        job : {self.tractorJob}")
-        print(f"      tasks : ")
-        for _, task in self.tractorJobTasks.items():
-            meta = task.get('metadata')
-            uid = None
-            if meta:
-                uid = meta.get("uid")
-            print(f"            - [{uid}] {task}")
+        for cache in self._groupCaches():
+            print(f"[Tractor Job] {cache.jid}")
+            print(f"        job : {cache.job}")
+            print(f"      tasks : ")
+            for _, task in cache.tasks.items():
+                meta = task.get('metadata')
+                uid = None
+                if meta:
+                    uid = meta.get("nodeUid")
+                print(f"            - [{uid}] {task}")
     
-    def __getTractorInfos(self):
-        """ Find job """
-        self.__tractorJob = tq.getJob(self.jid)
-        self.__tractorJobTasks = tq.getJobTasks(self.jid)
+    def setTractorInfos(self, tractorJob, tractorJobTasks):
+        """ Set job infos that have already been fetched (e.g. by a batch query) """
+        self._cache.set(tractorJob, tractorJobTasks)
+
+    def refresh(self):
+        """ Fetch job and tasks infos from Tractor again """
+        for cache in self._groupCaches():
+            cache.refresh()
+
+    @property
+    def cacheStats(self):
+        stats = {"hits": 0, "misses": 0}
+        for cache in self._caches.values():
+            for key, value in cache.stats.items():
+                stats[key] += value
+        return stats
 
     @property
     def tractorJob(self):
-        if not self.__tractorJob:
-            self.__getTractorInfos()
-        return self.__tractorJob
+        return self._cache.job
     
     @property
     def tractorJobTasks(self):
-        if not self.__tractorJobTasks:
-            self.__getTractorInfos()
-        return self.__tractorJobTasks
+        return self._cache.tasks
+
+    @property
+    def tractorJobs(self) -> dict:
+        """ Infos of all the jobs of the group {jid: job} """
+        return {cache.jid: cache.job for cache in self._groupCaches()}
+
+    def tasksForNode(self, uid) -> list[dict]:
+        """ Get the tasks created for a Meshroom node (node task and chunk tasks) """
+        cache = self._nodeCache(uid)
+        tasks = cache.tasks
+        return [tasks[tid] for tid in cache.index.byNode.get(uid, [])]
+
+    def tasksInState(self, state) -> list[dict]:
+        """ Tasks in this state in all the jobs of the group """
+        matchingTasks = []
+        for cache in self._groupCaches():
+            tasks = cache.tasks
+            matchingTasks.extend(tasks[tid] for tid in cache.index.byState.get(state, []))
+        return matchingTasks
+
+    def getChunkTask(self, iteration, uid=None):
+        """ Get the task of a chunk. If uid is None, the chunk is searched across all nodes """
+        if uid is not None:
+            cache = self._nodeCache(uid)
+            tid = cache.index.chunkTid(uid, iteration)
+            return cache.tasks[tid] if tid is not None else None
+        matchingTasks = []
+        for cache in self._groupCaches():
+            tasks = cache.tasks
+            matchingTasks.extend(tasks[tid] for tid in cache.index.byIteration.get(iteration, []))
+        if len(matchingTasks) > 1:
+            logging.warning(f"TractorJob: Chunk iteration {iteration} matches several nodes, provide the node uid (jid={self.jid})")
+        return matchingTasks[0] if matchingTasks else None
+
+    def killTask(self, tid, jid=None):
+        """ :param jid: job of the task, if it is not the main job of the group """
+        jid = self.jid if jid is None else jid
+        tq.killTask(jid, tid)
+        self._getCache(jid).invalidate(tid)
+
+    def retryTask(self, tid, jid=None):
+        jid = self.jid if jid is None else jid
+        tq.retryTask(jid, tid)
+        self._getCache(jid).invalidate(tid)
+
+    def skipTask(self, tid, jid=None):
+        jid = self.jid if jid is None else jid
+        tq.skipTask(jid, tid)
+        self._getCache(jid).invalidate(tid)
+
+    def _nodeTids(self, uid, states=None, excludedStates=None, cache=None) -> list[int]:
+        """ Get the tids of the tasks of a node, optionally filtered by state """
+        cache = cache or self._nodeCache(uid)
+        tasks = cache.tasks
+        tids = cache.index.byNode.get(uid, [])
+        if states is not None or excludedStates is not None:
+            tids = [
+                tid for tid in tids 
+                if (states is None or str(tasks[tid].get("state", "")).lower() in states)
+                and (excludedStates is None or str(tasks[tid].get("state", "")).lower() not in excludedStates)
+            ]
+        return tids
+
+    def _nodeAction(self, action, uid, states=None, excludedStates=None):
+        """ Apply the action to all the tasks of the node (one request per MAX_REQUEST_IDS tasks) """
+        cache = self._nodeCache(uid)
+        tids = self._nodeTids(uid, states, excludedStates, cache=cache)
+        if not tids:
+            logging.info(f"TractorJob: No task to {action.__name__} for node {uid} (jid={cache.jid})")
+            return []
+        action(cache.jid, tids)
+        cache.invalidate(tids)
+        return tids
+
+    def stopNode(self, uid):
+        """ Kill all the running tasks of the node """
+        return self._nodeAction(tq.killTask, uid, states={TASK_STATE_ACTIVE})
+
+    def retryNode(self, uid):
+        """ Relaunch all the tasks of the node """
+        return self._nodeAction(tq.retryTask, uid)
+
+    def skipNode(self, uid):
+        """ Skip all the tasks of the node that are not done yet """
+        return self._nodeAction(tq.skipTask, uid, excludedStates={TASK_STATE_DONE})
+
+    def retryFailedChunks(self, uid):
+        """ Relaunch the tasks of the node that are in error """
+        return self._nodeAction(tq.retryTask, uid, states={TASK_STATE_ERROR})
 
     def interrupt(self):
         raise NotImplementedError("[TractorJob] 'interrupt' is not implemented yet")
@@ -64,17 +197,18 @@ class TractorJob(BaseSubmittedJob):
     def resume(self):
         raise NotImplementedError("[TractorJob] 'resume' is not implemented yet")
     
-    def stopChunkTask(self, iteration):
-        for _, task in self.tractorJobTasks.items():
-            taskIt = task["metadata"].get("iteration", -1)
-            if taskIt == iteration:
-                break
-        else:
-            logging.error(f"TractorJob: Could not retrieve task for chunk iteration {iteration} (jid={self.jid})")
+    def stopChunkTask(self, iteration, node=None):
+        """ Stop the task of a chunk
+        :param node: Meshroom node (or node uid) the chunk belongs to
+        """
+        uid = getattr(node, "_uid", node)
+        task = self.getChunkTask(iteration, uid)
+        if task is None:
+            logging.error(f"TractorJob: Could not retrieve task for chunk iteration {iteration} (node={uid}, jid={self.jid})")
             return
         # Stop task
         print("stop task", task)
-        tq.killTask(self.jid, task["tid"])
+        self.killTask(task["tid"], task.get("jid"))
 
 
 def loadConfig(configpath):
@@ -96,6 +230,17 @@ class TractorSubmitter(BaseSubmitter):
     _options = SubmitterOptions(SubmitterOptionsEnum.ALL)
     
     dryRun = False
+    # Remove redundant dependencies before spooling
+    reduceEdges = os.environ.get("MESHROOM_TRACTOR_REDUCE_EDGES", "0") == "1"
+    # Resolve rez packages at submit time and store the context next to the graph
+    # (or in MESHROOM_TRACTOR_REZ_CONTEXT_DIR) so that the blades don't resolve them again
+    bakeRezContext = os.environ.get("MESHROOM_TRACTOR_BAKE_REZ_CONTEXT", "0") == "1"
+    # Group short chunks in the same tractor task depending on recorded runtimes
+    adaptivePacketSize = os.environ.get("MESHROOM_TRACTOR_ADAPTIVE_PACKETS", "0") == "1"
+    # Dispatch the tasks on the critical path (longest estimated chain of dependencies) first
+    prioritizeCriticalPath = os.environ.get("MESHROOM_TRACTOR_CRITICAL_PATH", "0") == "1"
+    # Split submissions with more tractor tasks than this in linked jobs (0 : never split)
+    maxJobTasks = int(os.environ.get("MESHROOM_TRACTOR_MAX_JOB_TASKS", 0))
     environment = {}
     DEFAULT_TAGS = {"prod": ""}
 
@@ -108,7 +253,11 @@ class TractorSubmitter(BaseSubmitter):
         super().__init__(parent=parent)
         self.share = os.environ.get("MESHROOM_TRACTOR_SHARE", "vfx")
         self.prod = os.environ.get("PROD", "mvg")
-        self.reqPackages = getRequestPackages()
+        self.rezContext = RezContext.current()
+        self.reqPackages = self.rezContext.getRequestPackages()
+        self.packetSizer = PacketSizer() if self.adaptivePacketSize else None
+        self.submissions: list[Submission] = []  # Background submissions in progress
+        self._bakedRezContexts: dict[str, RezContext] = {}  # {bakeDirectory: context}
         if "REZ_DEV_PACKAGES_ROOT" in os.environ:
             self.environment["REZ_DEV_PACKAGES_ROOT"] = os.environ["REZ_DEV_PACKAGES_ROOT"]
         if "REZ_PROD_PACKAGES_PATH" in os.environ:
@@ -117,6 +266,34 @@ class TractorSubmitter(BaseSubmitter):
             self.environment["PROD"] = os.environ["PROD"]
         if "PROD_ROOT" in os.environ:
             self.environment["PROD_ROOT"] = os.environ["PROD_ROOT"]
+        if self.adaptivePacketSize:
+            self.environment["MESHROOM_TRACTOR_ADAPTIVE_PACKETS"] = "1"
+            for key in ("MESHROOM_TRACTOR_RUNTIMES_FILE", "MESHROOM_TRACTOR_HISTORY_DB",
+                        "MESHROOM_TRACTOR_TARGET_TASK_DURATION", "MESHROOM_TRACTOR_MAX_PACKET_SIZE"):
+                if key in os.environ:
+                    self.environment[key] = os.environ[key]
+        if self.bakeRezContext:
+            # Chunks created on the farm also use baked contexts
+            self.environment["MESHROOM_TRACTOR_BAKE_REZ_CONTEXT"] = "1"
+            if "MESHROOM_TRACTOR_REZ_CONTEXT_DIR" in os.environ:
+                self.environment["MESHROOM_TRACTOR_REZ_CONTEXT_DIR"] = os.environ["MESHROOM_TRACTOR_REZ_CONTEXT_DIR"]
+
+    def getRezContext(self, graphFile):
+        """ Rez context used for a submission
+        Baked contexts are memoized by bake directory : the packages of all the tasks of
+        the submission are resolved once, even when chunk tasks are created one by one
+        """
+        rezContext = RezContext.current()
+        if not self.bakeRezContext:
+            return rezContext
+        bakeDirectory = os.environ.get("MESHROOM_TRACTOR_REZ_CONTEXT_DIR")
+        if not bakeDirectory:
+            bakeDirectory = os.path.join(os.path.dirname(os.path.abspath(graphFile)), "rezContexts")
+        bakedContext = self._bakedRezContexts.get(bakeDirectory)
+        if bakedContext is None or bakedContext.key != rezContext.key:
+            bakedContext = rezContext.withBakeDirectory(bakeDirectory)
+            self._bakedRezContexts[bakeDirectory] = bakedContext
+        return bakedContext
     
     def getTaskService(self, node):
         service = self.config.get_config(
@@ -126,11 +303,35 @@ class TractorSubmitter(BaseSubmitter):
             excludeHosts=[]
         )
         return service
+
+    def getPacketSize(self, node, nbBlocks):
+        """ Number of chunks of the node to compute in each tractor task """
+        if self.packetSizer is None:
+            return 1
+        packetSize = self.packetSizer.getPacketSize(node.nodeType, nbBlocks)
+        if packetSize > 1:
+            logging.info(f"TractorSubmitter: {node.name}: {packetSize} chunks per task")
+        return packetSize
     
     def retrieveJob(self, jid) -> TractorJob:
         job = TractorJob(jid, self)
         return job
 
+    def retrieveJobs(self, jids) -> dict[int, TractorJob]:
+        """ Retrieve multiple jobs with batched requests instead of one request per job """
+        jids = [int(jid) for jid in jids]
+        tractorJobs = tq.getJobs(jids)
+        # With the change times, the next refresh of the jobs can be incremental
+        tractorJobsTasks = tq.getTasksForJobs(jids, columns=tq.POLL_TASK_KEYS)
+        jobs = {}
+        for jid in jids:
+            tractorJob = tractorJobs.get(jid)
+            group = tq.jobGroupFromMetadata(jid, tractorJob.get("metadata")) if tractorJob else None
+            job = TractorJob(jid, self, jids=group)
+            job.setTractorInfos(tractorJob, tractorJobsTasks.get(jid, {}))
+            jobs[jid] = job
+        return jobs
+
     def createTask(self, job: Job, meshroomFile: str, node) -> Task:
         tags = self.DEFAULT_TAGS.copy()  # copy to not modify default tags
         optionalArgs = {}
@@ -141,8 +342,12 @@ class TractorSubmitter(BaseSubmitter):
         elif node.isParallelized:
             blockSize, fullSize, nbBlocks = node.nodeDesc.parallelization.getSizes(node)
             if nbBlocks > 1:  # Is it better like this ?
-                optionalArgs["chunkParams"] = {'start': 0, 'end': nbBlocks - 1, 'step': 1}
+                optionalArgs["chunkParams"] = {
+                    'start': 0, 'end': nbBlocks - 1, 'step': 1, 
+                    'packetSize': self.getPacketSize(node, nbBlocks)
+                }
         tags['nbFrames'] = node.size
+        tags['nodeType'] = node.nodeType
         tags['prod'] = self.prod
         # Fetch licenses
         licenses = node.nodeDesc._licenses
@@ -159,7 +364,8 @@ class TractorSubmitter(BaseSubmitter):
         )
         return task
 
-    def createJob(self, nodes, edges, filepath, submitLabel="{projectName}"):
+    def buildJob(self, nodes, edges, filepath, submitLabel="{projectName}") -> Job:
+        """ Create the job and its tasks from the Meshroom nodes (nothing is cooked yet) """
         projectName = os.path.splitext(os.path.basename(filepath))[0]
         name = submitLabel.format(projectName=projectName)
         comment = filepath
@@ -169,12 +375,13 @@ class TractorSubmitter(BaseSubmitter):
             'nbFrames': str(maxNodeSize),
             'comment': comment,
         }
-        # Create job
+        # Create job (rez is resolved once per submission and shared by all the tasks)
         job = Job(
             name,
             tags=mainTags,
             environment=self.environment,
             user=os.environ.get('FARM_USER', os.environ.get('USER', getpass.getuser())),
+            rezContext=self.getRezContext(filepath),
         )
         # Create tasks
         nodeUidToTask: dict[str, Task] = {}
@@ -186,21 +393,79 @@ class TractorSubmitter(BaseSubmitter):
         # Connect tasks
         for u, v in edges:
             nodeUidToTask[u._uid].addChild(nodeUidToTask[v._uid])
-        # Submit job
-        res = job.submit(share=self.share, dryRun=self.dryRun)
+        return job
+
+    def getSubmitKwargs(self) -> dict:
+        """ Options of Job.submit """
+        estimateDuration = None
+        if self.prioritizeCriticalPath:
+            runtimes = self.packetSizer.runtimes if self.packetSizer else None
+            estimateDuration = DurationEstimator(runtimes).estimate
+        return {
+            "share": self.share, 
+            "dryRun": self.dryRun, 
+            "reduceEdges": self.reduceEdges, 
+            "estimateDuration": estimateDuration, 
+            "maxTasks": self.maxJobTasks,
+        }
+
+    def getSubmittedJob(self, res):
+        """ Job to return to Meshroom from the result of Job.submit """
         if self.dryRun:
             return True
         if len(res) == 0:
             return False
-        submittedJob = TractorJob(res.get("id"), TractorSubmitter)
+        submittedJob = TractorJob(res.get("id"), TractorSubmitter, jids=res.get("jids"))
         return submittedJob
 
+    def createJob(self, nodes, edges, filepath, submitLabel="{projectName}"):
+        job = self.buildJob(nodes, edges, filepath, submitLabel)
+        # Submit job
+        res = job.submit(**self.getSubmitKwargs())
+        return self.getSubmittedJob(res)
+
+    def createJobInBackground(self, nodes=None, edges=None, filepath=None, submitLabel="{projectName}", 
+                              progressCallback=None, job=None) -> Submission:
+        """ Create the tasks now, then cook and spool the job on a worker thread
+        Returns a Submission, its result is the same as createJob
+        (self.submissions holds the submissions that are not done yet)
+        """
+        if job is None:
+            job = self.buildJob(nodes, edges, filepath, submitLabel)
+        submission = job.submitInBackground(progressCallback, **self.getSubmitKwargs())
+        # Convert the result of Job.submit when it is requested
+        submission.transformResult(self.getSubmittedJob)
+        self.submissions.append(submission)
+        submission.addDoneCallback(self._onSubmissionDone)
+        return submission
+
+    def _onSubmissionDone(self, submission):
+        try:
+            self.submissions.remove(submission)
+        except ValueError:
+            pass
+        self._logSubmission(submission)
+
+    @staticmethod
+    def _logSubmission(submission):
+        if submission.cancelled():
+            return
+        error = submission.exception()
+        if error is not None:
+            logging.error(f"TractorSubmitter: Background submission of {submission.name} failed: {error}")
+            return
+        submittedJob = submission.result()
+        if isinstance(submittedJob, TractorJob):
+            logging.info(f"TractorSubmitter: {submission.name} submitted (jid={submittedJob.jid}, "
+                         f"{TRACTOR_JOB_URL.format(jid=submittedJob.jid)})")
+
     def createChunkTask(self, node, graphFile, **kwargs):
         """
         Keyword args : cache, forceStatus, forceCompute
         """
         taskTags = self.DEFAULT_TAGS.copy()
         taskTags['nbFrames'] = node.size
+        taskTags['nodeType'] = node.nodeType
         taskTags['prod'] = self.prod
         # Environment
         environment = self.environment.copy()
@@ -214,5 +479,7 @@ class TractorSubmitter(BaseSubmitter):
             service=self.getTaskService(node),
             tags=taskTags,
             rezPackages=self.reqPackages,
-            environment=environment
+            environment=environment,
+            rezContext=self.getRezContext(graphFile),
+            packetSize=self.getPacketSize(node, node.nodeDesc.parallelization.getSizes(node)[2])
         )
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+Tractor Runtime History
+Import the runtimes of finished Tractor jobs in the local history, and show statistics.
+
+Usage:
+    python tractorRuntimeHistory.py import 1234 1235 [--full]
+    python tractorRuntimeHistory.py import --file jids.txt
+    python tractorRuntimeHistory.py stats [FeatureExtraction] [--bySize]
+"""
+
+import sys
+import argparse
+
+from tractorSubmitter.api.runtimeHistory import RuntimeHistory, DEFAULT_HISTORY_DB
+
+
+def readJids(args):
+    jids = list(args.jids)
+    if args.file:
+        with open(args.file, "r") as jidsFile:
+            jids.extend(int(line) for line in jidsFile if line.strip())
+    return jids
+
+
+def importJobs(history, args):
+    jids = readJids(args)
+    if not jids:
+        sys.stderr.write("No job id given\n")
+        return 1
+    if args.full:
+        nbRecords = history.ingestJobs(jids)
+    else:
+        # First import of new jobs in batches, then incremental import of the known jobs :
+        # only the tasks that changed since their last import
+        importedJids = [jid for jid in jids if history.isImported(jid)]
+        newJids = sorted(set(jids).difference(importedJids))
+        nbRecords = history.ingestJobs(newJids) if newJids else 0
+        nbRecords += sum(history.ingestJob(jid) for jid in importedJids)
+    print(f"Imported {nbRecords} tasks from {len(jids)} jobs ({len(history)} tasks in {history.path})")
+    return 0
+
+
+def formatDuration(seconds):
+    return "-" if seconds is None else f"{seconds:.1f}s"
+
+
+def showStats(history, args):
+    stats = history.stats(args.nodeType, bySize=args.bySize)
+    for stat in stats:
+        size = f"  size ~2^{stat['sizeBucket'] - 1}" if args.bySize and stat["sizeBucket"] else ""
+        print(f"{stat['nodeType']:<32}{size}  n={stat['count']:<6} p50={formatDuration(stat['p50']):<10} "
+              f"p95={formatDuration(stat['p95']):<10} retries={stat['avgRetries']:.2f}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local history of the Tractor task runtimes")
+    parser.add_argument("--db", default=DEFAULT_HISTORY_DB, help="History database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    importParser = subparsers.add_parser("import", help="Import finished tasks of jobs")
+    importParser.add_argument("jids", type=int, nargs="*")
+    importParser.add_argument("--file", help="File with one job id per line")
+    importParser.add_argument("--full", action="store_true", help="Import all the tasks again")
+    statsParser = subparsers.add_parser("stats", help="Runtime percentiles per node type")
+    statsParser.add_argument("nodeType", nargs="?")
+    statsParser.add_argument("--bySize", action="store_true", help="Group by node size (power of 2)")
+    args = parser.parse_args()
+
+    history = RuntimeHistory(args.db)
+    try:
+        if args.command == "import":
+            return importJobs(history, args)
+        return showStats(history, args)
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
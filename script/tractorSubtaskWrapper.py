@@ -4,70 +4,337 @@
 Tractor Subtask Wrapper
 Redirects all normal output to stderr, leaving stdout for Tractor subtask definitions.
 
+The subtask definitions are relayed from the pipe to stdout without decoding them :
+with os.splice (Linux) the data doesn't go through python, otherwise it is copied in
+large binary blocks. Set TRACTOR_SUBTASK_RELAY to "copy" or "lines" (the previous
+line by line relay) to force a method.
+
+Modes (--mode or TRACTOR_SUBTASK_WRAPPER_MODE) :
+- shell : the command is run by bash (aliases are expanded)
+- exec : the command is run directly, without shell (falls back to bash if it is not found)
+- inprocess : a python entry point ("module:function", "-m module", or a python script
+  using the same interpreter) is run in the wrapper process : no new interpreter and no
+  relay, subtask definitions are written directly to stdout
+- auto : inprocess if possible, else exec, else shell
+The time spent before starting the command is logged to compare the modes.
+
 Usage:
     python tractorSubtaskWrapper.py createTasks.py arg1 arg2 --option=value
+    python tractorSubtaskWrapper.py --mode inprocess meshroom_createChunks --submitter Tractor ...
+    python tractorSubtaskWrapper.py --mode auto -m createTasks arg1
+    python tractorSubtaskWrapper.py --mode exec -- -m createTasks arg1
 """
 
 import sys
 import os
+import time
+import runpy
 import shlex
+import shutil
+import argparse
+import importlib
 import subprocess
 
-def main():
-    if len(sys.argv) < 2:
-        sys.stderr.write("Usage: tractorSubtaskWrapper.py <script> [args...]\n")
-        sys.exit(1)
+START_TIME = time.perf_counter()
 
-    command = sys.argv[1:]
-    
-    # Save original stdout (for Tractor subtask output)
-    original_stdout = sys.stdout
+# "shell", "exec" (no shell), "inprocess" (python entry point run by the wrapper) or "auto"
+WRAPPER_MODE = os.environ.get("TRACTOR_SUBTASK_WRAPPER_MODE", "shell")
+# "splice" (falls back to "copy" if not available), "copy" or "lines"
+RELAY_METHOD = os.environ.get("TRACTOR_SUBTASK_RELAY", "splice")
+RELAY_BLOCK_SIZE = 1 << 20
+# Size requested for the subtask pipe (Linux only, the default is 64 KiB)
+PIPE_SIZE = 1 << 20
+F_SETPIPE_SZ = 1031
+
+
+def setPipeSize(fd, size=PIPE_SIZE):
+    """ Larger pipe : fewer context switches between the command and the relay """
+    try:
+        import fcntl
+        fcntl.fcntl(fd, getattr(fcntl, "F_SETPIPE_SZ", F_SETPIPE_SZ), size)
+    except (ImportError, OSError):
+        pass
+
+
+def _writeAll(fd, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def relayCopy(read_fd, write_fd, blockSize=RELAY_BLOCK_SIZE):
+    """ Copy binary blocks from read_fd to write_fd until the end of the pipe """
+    nbBytes = 0
+    while True:
+        data = os.read(read_fd, blockSize)
+        if not data:
+            return nbBytes
+        _writeAll(write_fd, data)
+        nbBytes += len(data)
+
+
+def relaySplice(read_fd, write_fd, blockSize=RELAY_BLOCK_SIZE):
+    """ Move data from the pipe to write_fd in the kernel (zero-copy)
+    Falls back to relayCopy if splice is not supported (no os.splice, output not supported)
+    """
+    if not hasattr(os, "splice"):
+        return relayCopy(read_fd, write_fd, blockSize)
+    nbBytes = 0
+    while True:
+        try:
+            moved = os.splice(read_fd, write_fd, blockSize)
+        except OSError:
+            # e.g. EINVAL when stdout is opened in append mode. Nothing has been consumed from the pipe
+            return nbBytes + relayCopy(read_fd, write_fd, blockSize)
+        if not moved:
+            return nbBytes
+        nbBytes += moved
+
+
+def relayLines(read_fd, output):
+    """ Line by line relay in text mode (slow, kept for comparison) """
+    nbBytes = 0
+    with os.fdopen(read_fd, 'r', closefd=False) as pipe_reader:
+        for line in pipe_reader:
+            output.write(line)
+            output.flush()
+            nbBytes += len(line)
+    return nbBytes
+
+
+def relay(read_fd, output, method=RELAY_METHOD):
+    """ Relay the subtask definitions from the pipe to the output file, in order """
+    # Everything written on the output before (i.e. the Alfred header) must come first
+    output.flush()
+    if method == "lines":
+        return relayLines(read_fd, output)
+    if method == "copy":
+        return relayCopy(read_fd, output.fileno())
+    return relaySplice(read_fd, output.fileno())
+
+
+def log(text):
+    sys.stderr.write(f"[tractorSubtaskWrapper] {text}\n")
+    sys.stderr.flush()
+
+
+def _elapsed():
+    return f"{(time.perf_counter() - START_TIME) * 1000:.1f}ms"
+
+
+def _isSameInterpreter(interpreter):
+    path = shutil.which(interpreter)
+    return path is not None and os.path.realpath(path) == os.path.realpath(sys.executable)
+
+
+def isPythonScript(path):
+    """ True if the script can run with this interpreter (.py file, or python shebang
+    pointing to the same interpreter as the wrapper)
+    """
+    if path.endswith(".py"):
+        return True
+    try:
+        with open(path, "rb") as f:
+            firstLine = f.readline(256).decode(errors="replace")
+    except OSError:
+        return False
+    if not firstLine.startswith("#!") or "python" not in firstLine:
+        return False
+    words = firstLine[2:].split()
+    if os.path.basename(words[0]) == "env" and len(words) > 1:
+        return _isSameInterpreter(words[-1])
+    return _isSameInterpreter(words[0])
+
+
+def resolveEntryPoint(command):
+    """ Function running the command in this process, or None if it's not a python entry point
+    Accepted : "module:function", "-m module", a python script (path or on the PATH),
+    optionally prefixed with the python interpreter
+    """
+    name = command[0]
+    if len(command) > 1 and not os.path.isfile(name) and _isSameInterpreter(name):
+        # "python script.py ..." or "python -m module ..."
+        return resolveEntryPoint(command[1:])
+    if name == "-m" and len(command) > 1:
+        module = command[1]
+
+        def runModule():
+            sys.argv = [module] + command[2:]
+            runpy.run_module(module, run_name="__main__", alter_sys=True)
+        return runModule
+    if ":" in name and not os.path.exists(name):
+        module, function = name.split(":", 1)
+
+        def runFunction():
+            sys.argv = command
+            return getattr(importlib.import_module(module), function)()
+        return runFunction
+    path = name if os.path.isfile(name) else shutil.which(name)
+    if path and isPythonScript(path):
+        def runScript():
+            sys.argv = [path] + command[1:]
+            sys.path[0] = os.path.dirname(os.path.abspath(path))
+            runpy.run_path(path, run_name="__main__")
+        return runScript
+    return None
 
-    # Write Alfred header to stdout FIRST
-    original_stdout.write("##AlfredToDo 3.0\n")
-    original_stdout.flush()
 
+def resolveMode(command, mode):
+    """ Returns (mode, entry point) """
+    if mode in ("inprocess", "auto"):
+        entryPoint = resolveEntryPoint(command)
+        if entryPoint is not None:
+            return "inprocess", entryPoint
+        if mode == "inprocess":
+            log(f"{command[0]} is not a python entry point, it can't run in process")
+        mode = "auto"
+    if mode == "auto":
+        # Aliases and shell functions are only known by the shell
+        return ("exec" if shutil.which(command[0]) else "shell"), None
+    return mode, None
+
+
+def runInProcess(entryPoint, command, output):
+    """ Run the entry point with stdout redirected to stderr
+    Subtask definitions are written directly to the original stdout (no pipe, no relay)
+    """
+    output.flush()
+    subtaskFd = os.dup(output.fileno())
+    os.environ['TRACTOR_SUBTASK_STDOUT_FD'] = str(subtaskFd)
+    # Normal output goes to stderr (print statements, but also libraries and subprocesses)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), output.fileno())
+    log(f"Executing in process: {' '.join(command)} (started after {_elapsed()})")
+    returncode = 0
+    try:
+        res = entryPoint()
+        if isinstance(res, int):
+            returncode = res
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            returncode = e.code or 0
+        else:
+            sys.stderr.write(f"{e.code}\n")
+            returncode = 1
+    finally:
+        sys.stdout.flush()
+        # Subtasks queued without flush (the interpreter is not shut down yet)
+        subtaskCreator = sys.modules.get("tractorSubmitter.api.subtaskCreator")
+        if subtaskCreator is not None and subtaskCreator._stdout is not None:
+            subtaskCreator._stdout.flush()
+    return returncode
+
+
+def runSubprocess(command, output, shell):
+    """ Run the command in a subprocess, subtask definitions are relayed from a pipe """
+    if command[0] == "-m":
+        # Python module : run by the same interpreter as the wrapper
+        command = [sys.executable] + list(command)
     # Create a pipe for capturing subtask output
     read_fd, write_fd = os.pipe()
+    setPipeSize(write_fd)
     
     # Set environment variable so subtaskCreator.py can find the write end
     os.environ['TRACTOR_SUBTASK_STDOUT_FD'] = str(write_fd)
-    
-    # Log to stderr
-    sys.stderr.write(f"[tractorSubtaskWrapper] Executing: {' '.join(command)}\n")
-    sys.stderr.flush()
 
-    try:
+    if shell:
         # Convert command list to shell string for alias expansion
-        command_string = shlex.join(command)
-        
-        # Execute the command with stderr going to stderr, stdout going to stderr too
-        # (so print statements go to stderr)
-        # The subtaskCreator will write to write_fd
+        args = shlex.join(command)
+    else:
+        args = command
+    
+    # Execute the command with stderr going to stderr, stdout going to stderr too
+    # (so print statements go to stderr)
+    # The subtaskCreator will write to write_fd
+    try:
         process = subprocess.Popen(
-            command_string,
+            args,
             stdout=sys.stderr,  # Normal output goes to stderr
             stderr=sys.stderr,
             env=os.environ.copy(),
-            shell=True,
-            executable='/bin/bash',
+            shell=shell,
+            executable='/bin/bash' if shell else None,
             pass_fds=(write_fd,)  # Pass the write_fd to subprocess
         )
-        
+    except BaseException:
+        # Nothing will be relayed (e.g. FileNotFoundError before the fallback on bash)
+        os.close(read_fd)
+        raise
+    finally:
         # Close write end in parent (subprocess has it)
         os.close(write_fd)
+    log(f"Executing{' with bash' if shell else ''}: {' '.join(command)} (started after {_elapsed()})")
+    
+    # Read from pipe and write to original stdout
+    try:
+        nbBytes = relay(read_fd, output)
+    finally:
+        os.close(read_fd)
+    log(f"Relayed {nbBytes} bytes of subtask definitions")
+    
+    # Wait for subprocess to complete
+    return process.wait()
+
+
+def parseArgs(argv):
+    """ Options of the wrapper come first, everything after them (or after "--") is the command,
+    so that the command can start with an option (e.g. "-m module")
+    """
+    parser = argparse.ArgumentParser(description="Run a command that creates Tractor subtasks",
+                                     usage="%(prog)s [-h] [--mode MODE] [--] command [args...]")
+    parser.add_argument("--mode", default=WRAPPER_MODE, choices=["shell", "exec", "inprocess", "auto"],
+                        help="How the command is started (default : TRACTOR_SUBTASK_WRAPPER_MODE or shell)")
+    argv = list(argv)
+    wrapperArgs = []
+    while argv:
+        arg = argv[0]
+        if arg == "--":
+            argv.pop(0)
+            break
+        if arg in ("-h", "--help") or arg.startswith("--mode="):
+            wrapperArgs.append(argv.pop(0))
+        elif arg == "--mode":
+            wrapperArgs.extend(argv[:2])
+            del argv[:2]
+        else:
+            break
+    args = parser.parse_args(wrapperArgs)
+    args.command = argv
+    if not args.command:
+        parser.error("No command given")
+    return args
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage: tractorSubtaskWrapper.py [--mode shell|exec|inprocess|auto] [--] <script> [args...]\n")
+        sys.exit(1)
+
+    args = parseArgs(sys.argv[1:])
+    command = args.command
+    
+    # Save original stdout (for Tractor subtask output)
+    original_stdout = sys.stdout
+
+    # Write Alfred header to stdout FIRST
+    original_stdout.write("##AlfredToDo 3.0\n")
+    original_stdout.flush()
+
+    try:
+        mode, entryPoint = resolveMode(command, args.mode)
+        if mode == "inprocess":
+            returncode = runInProcess(entryPoint, command, original_stdout)
+        else:
+            try:
+                returncode = runSubprocess(command, original_stdout, shell=(mode == "shell"))
+            except FileNotFoundError:
+                # Not an executable (e.g. an alias) : use the shell
+                log(f"{command[0]} not found, executing with bash")
+                mode = "shell"
+                returncode = runSubprocess(command, original_stdout, shell=True)
         
-        # Read from pipe and write to original stdout
-        with os.fdopen(read_fd, 'r') as pipe_reader:
-            for line in pipe_reader:
-                original_stdout.write(line)
-                original_stdout.flush()
-        
-        # Wait for subprocess to complete
-        returncode = process.wait()
-        
-        sys.stderr.write(f"[tractorSubtaskWrapper] Command completed with exit code {returncode}\n")
-        sys.stderr.flush()
+        log(f"Command completed with exit code {returncode} ({mode}, {_elapsed()})")
         
         # Exit with the same code as the subprocess
         sys.exit(returncode)
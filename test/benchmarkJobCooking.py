@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""
+Benchmark job creation, cooking and TCL serialization
+
+Synthetic Meshroom-like graphs are submitted through TractorSubmitter.createJob
+in dry-run mode. For each phase we record the wall time, the peak memory
+(tracemalloc, measured in a separate run so that it doesn't slow down the timings)
+and, for the serialization, the size of the Alfred script :
+- create : Meshroom nodes -> Task objects (TractorSubmitter.createTask, edges)
+- cook : Task objects -> tractor.api.author tasks (Job.cook)
+- serialize : tractor job -> Alfred script (asTcl)
+
+Graph shapes :
+- chain : each node depends on the previous one
+- fanout : one node, `size` independent nodes, one node gathering them
+- chunked : layers of chunked nodes, each node depends on 2 nodes of the previous layer
+
+The Tractor and Meshroom APIs are replaced by stand-ins if they are not available.
+
+Usage:
+    python benchmarkJobCooking.py --sizes 100 1000 --shapes chain fanout chunked --output results.json
+    python benchmarkJobCooking.py --compare results.json  # Compare with previous results
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import logging
+import argparse
+import platform
+import tracemalloc
+
+import tractorAuthorStub
+usingAuthorStub = tractorAuthorStub.install()
+
+currentDir = os.path.dirname(os.path.realpath(__file__))
+os.environ.setdefault("MR_SUBMITTERS_CONFIGS", os.path.join(os.path.dirname(currentDir), "config"))
+os.environ.setdefault("DEFAULT_TRACTOR_SERVICE", "benchmark")
+
+PHASES = ["create", "cook", "serialize"]
+
+
+def installStubs():
+    """ Stand-ins for the Meshroom submitter base classes and the login manager
+    (no request is sent to the engine in dry-run mode)
+    """
+    try:
+        import meshroom.core.submitter  # noqa: F401
+    except ImportError:
+        submitter = types.ModuleType("meshroom.core.submitter")
+
+        class BaseSubmitter:
+            def __init__(self, parent=None):
+                pass
+
+        class BaseSubmittedJob:
+            def __init__(self, jid, submitter):
+                pass
+
+        class SubmitterOptions:
+            def __init__(self, *args):
+                pass
+
+        submitter.BaseSubmitter = BaseSubmitter
+        submitter.BaseSubmittedJob = BaseSubmittedJob
+        submitter.SubmitterOptions = SubmitterOptions
+        submitter.SubmitterOptionsEnum = types.SimpleNamespace(ALL=0)
+        for name in ("meshroom", "meshroom.core"):
+            sys.modules.setdefault(name, types.ModuleType(name))
+        sys.modules["meshroom.core.submitter"] = submitter
+    try:
+        import tractorLoginManager  # noqa: F401
+    except ImportError:
+        loginManager = types.ModuleType("tractorLoginManager")
+        loginManager.TractorLoginManager = type("TractorLoginManager", (), {"start_query": lambda self: None})
+        sys.modules["tractorLoginManager"] = loginManager
+
+
+#
+# Synthetic Meshroom graphs
+#
+
+class Attribute:
+    def __init__(self, value):
+        self.value = value
+
+
+class Parallelization:
+    def __init__(self, blockSize):
+        self.blockSize = blockSize
+
+    def getSizes(self, node):
+        nbBlocks = -(-node.size // self.blockSize)
+        return self.blockSize, node.size, nbBlocks
+
+
+class NodeDesc:
+    def __init__(self, blockSize=None):
+        self.cpu = Attribute(2)
+        self.ram = Attribute(2)
+        self.gpu = Attribute(0)
+        self._licenses = []
+        self.parallelization = Parallelization(blockSize) if blockSize else None
+
+
+class Node:
+    """ Attributes of meshroom.core.node.Node used by the submitter """
+    def __init__(self, name, nodeType, size=1, blockSize=None):
+        self.name = name
+        self.nodeType = nodeType
+        self._uid = f"{name}_uid"
+        self.size = size
+        self.nodeDesc = NodeDesc(blockSize)
+        self.isParallelized = blockSize is not None
+        self._chunksCreated = True
+
+
+def chainGraph(size, rng):
+    nodes = [Node(f"Chain_{i}", "Chain") for i in range(size)]
+    # Edges are (node, dependency)
+    edges = [(nodes[i], nodes[i - 1]) for i in range(1, size)]
+    return nodes, edges
+
+
+def fanoutGraph(size, rng):
+    first, last = Node("CameraInit_1", "CameraInit", size=size), Node("Publish_1", "Publish")
+    middle = [Node(f"Process_{i}", "Process", size=size) for i in range(size)]
+    edges = [(node, first) for node in middle] + [(last, node) for node in middle]
+    return [first] + middle + [last], edges
+
+
+def chunkedGraph(size, rng, width=10, nbFrames=500, blockSize=10):
+    nodes, edges, layers = [], [], []
+    for i in range(size):
+        if i % width == 0:
+            layers.append([])
+        node = Node(f"FeatureExtraction_{i}", "FeatureExtraction", size=nbFrames, blockSize=blockSize)
+        if len(layers) > 1:
+            for parent in rng.sample(layers[-2], min(2, len(layers[-2]))):
+                edges.append((node, parent))
+        layers[-1].append(node)
+        nodes.append(node)
+    return nodes, edges
+
+
+SHAPES = {"chain": chainGraph, "fanout": fanoutGraph, "chunked": chunkedGraph}
+
+
+#
+# Measures
+#
+
+class PhaseRecorder:
+    """ Wraps Job.cook and the tractor job asTcl to split createJob in phases """
+
+    def __init__(self, traceMemory=False):
+        self.traceMemory = traceMemory
+        self.times = {}
+        self.memory = {}
+        self.payloadBytes = None
+        self._start = None
+        self._current = None
+
+    def _switch(self, phase):
+        now = time.perf_counter()
+        if self._current:
+            self.times[self._current] = self.times.get(self._current, 0.0) + now - self._start
+            if self.traceMemory:
+                self.memory[self._current] = max(self.memory.get(self._current, 0), tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+        self._current, self._start = phase, now
+
+    def install(self):
+        from tractor.api import author
+        from tractorSubmitter.api import tractorJobCreation
+        recorder = self
+        cook, asTcl = tractorJobCreation.Job.cook, author.Job.asTcl
+
+        def timedCook(job, *args, **kwargs):
+            recorder._switch("cook")
+            try:
+                return cook(job, *args, **kwargs)
+            finally:
+                recorder._switch("other")
+
+        def timedAsTcl(job, *args, **kwargs):
+            recorder._switch("serialize")
+            try:
+                tcl = asTcl(job, *args, **kwargs)
+                recorder.payloadBytes = len(tcl.encode())
+                return tcl
+            finally:
+                recorder._switch("other")
+
+        tractorJobCreation.Job.cook = timedCook
+        author.Job.asTcl = timedAsTcl
+
+        def uninstall():
+            tractorJobCreation.Job.cook = cook
+            author.Job.asTcl = asTcl
+        return uninstall
+
+
+def runOnce(submitter, nodes, edges, traceMemory):
+    recorder = PhaseRecorder(traceMemory)
+    uninstall = recorder.install()
+    if traceMemory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        recorder._switch("create")
+        submitter.createJob(nodes, edges, "/tmp/benchmark.mg")
+        recorder._switch(None)
+        total = time.perf_counter() - start
+    finally:
+        uninstall()
+        if traceMemory:
+            tracemalloc.stop()
+    return recorder, total
+
+
+def benchmark(shape, size, repeat, seed=0):
+    from tractorSubmitter.tractorSubmitter import TractorSubmitter
+    submitter = TractorSubmitter()
+    submitter.dryRun = True
+    nodes, edges = SHAPES[shape](size, random.Random(seed))
+    timings = []
+    for _ in range(repeat):
+        recorder, total = runOnce(submitter, nodes, edges, traceMemory=False)
+        timings.append((recorder, total))
+    # Keep the fastest run
+    recorder, total = min(timings, key=lambda t: t[1])
+    memoryRecorder, _ = runOnce(submitter, nodes, edges, traceMemory=True)
+    result = {
+        "shape": shape,
+        "nodes": len(nodes),
+        "edges": len(edges),
+        "total": total,
+        "phases": {},
+    }
+    for phase in PHASES:
+        result["phases"][phase] = {
+            "time": recorder.times.get(phase, 0.0),
+            "peakMemory": memoryRecorder.memory.get(phase, 0),
+        }
+    result["phases"]["serialize"]["payloadBytes"] = recorder.payloadBytes
+    return result
+
+
+def formatResult(result, reference=None):
+    line = f"{result['shape']:<8} {result['nodes']:>6} nodes"
+    for phase in PHASES:
+        values = result["phases"][phase]
+        line += f" | {phase} {values['time'] * 1000:9.1f}ms {values['peakMemory'] / 2**20:7.1f}MiB"
+        if reference:
+            refTime = reference["phases"][phase]["time"]
+            if refTime:
+                line += f" ({(values['time'] - refTime) / refTime:+.0%})"
+    line += f" | {result['phases']['serialize']['payloadBytes'] / 1024:9.1f}KiB"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--shapes", nargs="+", default=list(SHAPES), choices=list(SHAPES))
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs (the fastest is kept)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with results from a previous JSON file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)  # The dry run logs the whole Alfred script
+    # Alfred scripts are serialized recursively (one level per dependency in a chain)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * max(args.sizes) + 1000))
+    installStubs()
+    references = {}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            references = {(r["shape"], r["nodes"]): r for r in json.load(f)["results"]}
+
+    results = []
+    for shape in args.shapes:
+        for size in args.sizes:
+            result = benchmark(shape, size, args.repeat)
+            results.append(result)
+            print(formatResult(result, references.get((shape, result["nodes"]))))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "authorStub": usingAuthorStub,
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the engine session pool used by the tractorQuery decorator
+
+We don't need a real engine here : a mock login manager is registered before
+importing tractorJobQuery. Opening a session costs `--login` seconds and each
+query costs `--query` seconds, which is roughly what we see on the farm.
+
+Then the handling of expired sessions is checked : a session idle for longer than
+the engine session timeout is replaced before it is reused (ping), and an error
+that is not a session error is raised without logging in again.
+
+Usage:
+    python benchmarkSessionPool.py --calls 200 --threads 8
+"""
+
+import sys
+import time
+import types
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SessionExpired(Exception):
+    """ Same name as the exception of the engine client """
+
+
+class MockQuery:
+    """ Mimics the object returned by TractorLoginManager.start_query() """
+    loginLatency = 0.05
+    queryLatency = 0.002
+    # The engine expires the sessions idle for more than this delay (None : never)
+    sessionTimeout = None
+    # Error raised by the next query
+    nextError = None
+
+    def __init__(self):
+        time.sleep(self.loginLatency)
+        self.closed = False
+        self.lastUsed = time.monotonic()
+
+    def _query(self):
+        now = time.monotonic()
+        if self.sessionTimeout is not None and now - self.lastUsed > self.sessionTimeout:
+            raise SessionExpired("Session has expired")
+        self.lastUsed = now
+        if MockQuery.nextError is not None:
+            error, MockQuery.nextError = MockQuery.nextError, None
+            raise error
+        time.sleep(self.queryLatency)
+
+    def jobs(self, search, columns=None, limit=None, **kwargs):
+        self._query()
+        return [{"jid": 1, "title": "mock job"}]
+
+    def tasks(self, search, columns=None, limit=None, **kwargs):
+        self._query()
+        return [{"jid": 1, "tid": 1, "metadata": "{}"}]
+
+    def closeEngineClient(self):
+        self.closed = True
+
+
+class MockLoginManager:
+    def __init__(self):
+        self.nbLogins = 0
+        self._lock = threading.Lock()
+
+    def start_query(self):
+        with self._lock:
+            self.nbLogins += 1
+        return MockQuery()
+
+
+def installMockLoginManager():
+    module = types.ModuleType("tractorLoginManager")
+    module.TractorLoginManager = MockLoginManager
+    sys.modules["tractorLoginManager"] = module
+
+
+def run(tjq, nbCalls, nbThreads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=nbThreads) as executor:
+        list(executor.map(lambda i: tjq.getJob(i), range(nbCalls)))
+    elapsed = time.perf_counter() - start
+    return nbCalls / elapsed, elapsed
+
+
+def checkExpiredSessions(tjq, SessionPool):
+    """ Returns True if the expired sessions are handled as expected """
+    MockQuery.sessionTimeout = 0.1
+    tjq._pool = SessionPool(tjq._tlm.start_query, maxSize=1, ping=tjq.pingSession, pingAfter=0.05)
+    tjq._tlm.nbLogins = 0
+    tjq.getJob(1)
+    time.sleep(0.2)
+    tjq.getJob(1)
+    pool = tjq._pool
+    ok = pool.nbPingFailures == 1 and tjq._tlm.nbLogins == 2
+    print(f"[expired]   idle session : {pool.nbPings} pings, {pool.nbPingFailures} failed, "
+          f"{tjq._tlm.nbLogins} logins {'OK' if ok else 'WRONG'}")
+
+    # A query error that mentions a session is not a session error
+    tjq._tlm.nbLogins = 0
+    MockQuery.nextError = ValueError("unknown column 'session' in search")
+    try:
+        tjq.getJob(1)
+        raised = False
+    except ValueError:
+        raised = True
+    queryOk = raised and tjq._tlm.nbLogins == 0
+    print(f"[expired]   query error : raised={raised}, {tjq._tlm.nbLogins} logins {'OK' if queryOk else 'WRONG'}")
+    tjq._pool.closeAll()
+    MockQuery.sessionTimeout = None
+    return ok and queryOk
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--poolSize", type=int, default=4)
+    parser.add_argument("--login", type=float, default=MockQuery.loginLatency, help="Login latency (s)")
+    parser.add_argument("--query", type=float, default=MockQuery.queryLatency, help="Query latency (s)")
+    args = parser.parse_args()
+    MockQuery.loginLatency = args.login
+    MockQuery.queryLatency = args.query
+
+    installMockLoginManager()
+    import tractorSubmitter.api.tractorJobQuery as tjq
+    from tractorSubmitter.api.sessionPool import SessionPool
+
+    # Before : one session per call
+    tjq._pool = None
+    tjq._tlm.nbLogins = 0
+    cps, elapsed = run(tjq, args.calls, args.threads)
+    print(f"[no pool]   {args.calls} calls in {elapsed:.3f}s -> {cps:8.1f} calls/s ({tjq._tlm.nbLogins} logins)")
+
+    # After : pooled sessions
+    tjq._pool = SessionPool(tjq._tlm.start_query, maxSize=args.poolSize)
+    tjq._tlm.nbLogins = 0
+    cps, elapsed = run(tjq, args.calls, args.threads)
+    print(f"[pool={args.poolSize}]  {args.calls} calls in {elapsed:.3f}s -> {cps:8.1f} calls/s ({tjq._tlm.nbLogins} logins)")
+    tjq._pool.closeAll()
+
+    return 0 if checkExpiredSessions(tjq, SessionPool) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the relay of the subtask definitions in tractorSubtaskWrapper
+
+The wrapper runs a command that emits `--subtasks` subtask definitions (100k by default)
+with subtaskCreator, and its stdout is read by this script like the engine would.
+For each relay method (TRACTOR_SUBTASK_RELAY) we report the wall time and the
+throughput, and we check that the outputs are identical and start with the Alfred header.
+
+Emitters :
+- batch : queueSubtasks (large blocks, one flush)
+- single : queueSubtask (one write and one flush per subtask)
+- file : the definitions are generated once and the command only copies them to the pipe,
+  so that the time is spent in the relay
+
+Usage:
+    python benchmarkSubtaskRelay.py --subtasks 100000 --relays splice copy lines --emitters batch single
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import subprocess
+
+
+currentDir = os.path.dirname(os.path.realpath(__file__))
+rootDir = os.path.dirname(currentDir)
+WRAPPER = os.path.join(rootDir, "script", "tractorSubtaskWrapper.py")
+ALFRED_HEADER = b"##AlfredToDo 3.0\n"
+
+EMITTERS = {
+    "batch": (
+        "import sys\n"
+        "from tractorSubmitter.api.subtaskCreator import queueSubtasks\n"
+        "queueSubtasks(dict(title=f'frame_{i:06d}', argv=['render', '--frame', str(i)], service='render',\n"
+        "                   limits=['render'], metadata={'iteration': i}, envkey=['setenv PROD=mvg'])\n"
+        "              for i in range(int(sys.argv[1])))\n"
+    ),
+    "single": (
+        "import sys\n"
+        "from tractorSubmitter.api.subtaskCreator import queueSubtask\n"
+        "for i in range(int(sys.argv[1])):\n"
+        "    queueSubtask(f'frame_{i:06d}', ['render', '--frame', str(i)], service='render',\n"
+        "                 limits=['render'], metadata={'iteration': i}, envkey=['setenv PROD=mvg'])\n"
+    ),
+    "file": (
+        "import os, sys\n"
+        "fd = int(os.environ['TRACTOR_SUBTASK_STDOUT_FD'])\n"
+        "with open(sys.argv[2], 'rb') as f:\n"
+        "    for block in iter(lambda: f.read(1 << 20), b''):\n"
+        "        os.write(fd, block)\n"
+    ),
+}
+
+
+def generateDefinitions(path, nbSubtasks):
+    """ Subtask definitions written by the batch emitter (for the file emitter) """
+    sys.path.insert(0, os.path.join(rootDir, "meshroom"))
+    from tractorSubmitter.api.subtaskCreator import queueSubtasks
+    with open(path, "w") as f:
+        queueSubtasks((dict(title=f"frame_{i:06d}", argv=["render", "--frame", str(i)], service="render",
+                            limits=["render"], metadata={"iteration": i}, envkey=["setenv PROD=mvg"])
+                       for i in range(nbSubtasks)), stream=f)
+
+
+def runWrapper(relay, emitter, nbSubtasks, definitionsFile=None, readSize=1 << 16):
+    """ Returns (elapsed, output size, output md5, starts with the header) """
+    env = os.environ.copy()
+    env["TRACTOR_SUBTASK_RELAY"] = relay
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.join(rootDir, "meshroom"), env.get("PYTHONPATH")]))
+    cmd = [sys.executable, WRAPPER, sys.executable, "-c", EMITTERS[emitter], str(nbSubtasks)]
+    if emitter == "file":
+        cmd.append(definitionsFile)
+    digest, size, header = hashlib.md5(), 0, b""
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+    while True:
+        data = process.stdout.read1(readSize)
+        if not data:
+            break
+        if len(header) < len(ALFRED_HEADER):
+            header += data[:len(ALFRED_HEADER) - len(header)]
+        digest.update(data)
+        size += len(data)
+    returncode = process.wait()
+    elapsed = time.perf_counter() - start
+    if returncode != 0:
+        raise RuntimeError(f"Wrapper failed with exit code {returncode} ({relay}, {emitter})")
+    return elapsed, size, digest.hexdigest(), header == ALFRED_HEADER
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subtasks", type=int, default=100000)
+    parser.add_argument("--relays", nargs="+", default=["splice", "copy", "lines"], choices=["splice", "copy", "lines"])
+    parser.add_argument("--emitters", nargs="+", default=list(EMITTERS), choices=list(EMITTERS))
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs (the fastest is kept)")
+    args = parser.parse_args()
+
+    definitionsFile = None
+    if "file" in args.emitters:
+        definitionsFile = os.path.join(tempfile.mkdtemp(prefix="benchmarkSubtaskRelay_"), "subtasks.alf")
+        generateDefinitions(definitionsFile, args.subtasks)
+    digests = set()
+    for emitter in args.emitters:
+        for relay in args.relays:
+            runs = [runWrapper(relay, emitter, args.subtasks, definitionsFile) for _ in range(args.repeat)]
+            elapsed, size, digest, header = min(runs)
+            digests.update(run[2] for run in runs)
+            print(f"{emitter:<7} {relay:<7} {elapsed:8.3f}s | {args.subtasks / elapsed:10.0f} subtasks/s | "
+                  f"{size / elapsed / 2**20:8.1f} MiB/s | {size / 2**20:.1f} MiB" + ("" if header else " | NO HEADER"))
+    print("Outputs are identical" if len(digests) == 1 else f"DIFFERENT OUTPUTS ({len(digests)} versions)")
+    if definitionsFile:
+        shutil.rmtree(os.path.dirname(definitionsFile))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the startup of the commands run by tractorSubtaskWrapper in each mode
+
+An expanding task runs `tractorSubtaskWrapper <command>`. Depending on the mode the
+command is started by bash (shell), directly (exec) or run in the wrapper process
+(inprocess). The command used here is a python script on the PATH (like
+meshroom_createChunks) that imports `--imports` modules and emits `--subtasks` subtasks.
+
+For each mode we report :
+- startup : time until the first subtask definition is received (after the header)
+- total : time until the wrapper exits
+The outputs of all the modes are checked to be identical.
+
+Usage:
+    python benchmarkSubtaskWrapper.py --repeat 10 --subtasks 100
+    python benchmarkSubtaskWrapper.py --imports json tractorSubmitter.api.tractorJobCreation
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+
+currentDir = os.path.dirname(os.path.realpath(__file__))
+rootDir = os.path.dirname(currentDir)
+WRAPPER = os.path.join(rootDir, "script", "tractorSubtaskWrapper.py")
+ALFRED_HEADER = b"##AlfredToDo 3.0\n"
+MODES = ["shell", "exec", "inprocess"]
+COMMAND_NAME = "benchmarkCreateSubtasks"
+
+COMMAND = """#!{python}
+import sys
+try:
+    import tractor.api.author
+except ImportError:
+    # Without the tractor package, modules importing it use the stand-in
+    import tractorAuthorStub
+    tractorAuthorStub.install()
+for module in {imports!r}:
+    __import__(module)
+from tractorSubmitter.api.subtaskCreator import queueSubtasks
+
+
+def main():
+    queueSubtasks(dict(title=f"frame_{{i:06d}}", argv=["render", "--frame", str(i)])
+                  for i in range(int(sys.argv[1])))
+
+
+if __name__ == "__main__":
+    main()
+"""
+
+
+def createCommand(directory, imports):
+    """ Python script on the PATH, using the same interpreter as the wrapper """
+    path = os.path.join(directory, COMMAND_NAME)
+    with open(path, "w") as f:
+        f.write(COMMAND.format(python=sys.executable, imports=list(imports)))
+    os.chmod(path, 0o755)
+    return path
+
+
+def runWrapper(mode, nbSubtasks, env):
+    """ Returns (startup, total, output md5) """
+    cmd = [sys.executable, WRAPPER, "--mode", mode, COMMAND_NAME, str(nbSubtasks)]
+    digest, received, startup = hashlib.md5(), 0, None
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+    while True:
+        data = process.stdout.read1(1 << 16)
+        if not data:
+            break
+        received += len(data)
+        if startup is None and received > len(ALFRED_HEADER):
+            startup = time.perf_counter() - start
+        digest.update(data)
+    returncode = process.wait()
+    total = time.perf_counter() - start
+    if returncode != 0:
+        raise RuntimeError(f"Wrapper failed with exit code {returncode} ({mode})")
+    return startup or total, total, digest.hexdigest()
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES + ["auto"])
+    parser.add_argument("--subtasks", type=int, default=100)
+    parser.add_argument("--imports", nargs="*", default=["tractorSubmitter.api.base"],
+                        help="Modules imported by the command (startup cost of the command itself). "
+                             "tractor.api.author is replaced by tractorAuthorStub if it is not installed")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of runs (the median is kept)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="benchmarkSubtaskWrapper_")
+    createCommand(directory, args.imports)
+    env = os.environ.copy()
+    env["PATH"] = os.pathsep.join([directory, env.get("PATH", "")])
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.join(rootDir, "meshroom"), currentDir,
+                                                      env.get("PYTHONPATH")]))
+    digests = set()
+    try:
+        for mode in args.modes:
+            runs = [runWrapper(mode, args.subtasks, env) for _ in range(args.repeat)]
+            digests.update(run[2] for run in runs)
+            startup, total = median([run[0] for run in runs]), median([run[1] for run in runs])
+            print(f"{mode:<10} startup {startup * 1000:8.1f}ms | total {total * 1000:8.1f}ms")
+    finally:
+        shutil.rmtree(directory)
+    print("Outputs are identical" if len(digests) == 1 else f"DIFFERENT OUTPUTS ({len(digests)} versions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""
+Benchmark TaskGraph construction (task registration, edges, roots and leaves)
+
+Builds synthetic graphs through Job.createTask/Task.addChild, the same way
+TractorSubmitter.createJob does. Construction time should grow linearly
+with the number of nodes.
+
+Usage:
+    python benchmarkTaskGraph.py --sizes 1000 2000 5000 10000
+"""
+
+import os
+import time
+import random
+import argparse
+
+import tractorAuthorStub
+tractorAuthorStub.install()
+
+from tractorSubmitter.api.tractorJobCreation import Job
+
+
+def buildGraph(nbNodes, nbParents=2, seed=0):
+    """ Each node depends on up to nbParents random previous nodes """
+    rng = random.Random(seed)
+    job = Job("benchmark", requirements="benchmark")
+    tasks = []
+    for i in range(nbNodes):
+        task = job.createTask(f"Node_{i}", f"--node Node_{i} graph.mg --extern", uid=f"uid{i}", service="benchmark")
+        for parent in rng.sample(tasks, min(nbParents, len(tasks))):
+            parent.addChild(task)
+        tasks.append(task)
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 10000])
+    parser.add_argument("--parents", type=int, default=2)
+    args = parser.parse_args()
+    os.environ.setdefault("DEFAULT_TRACTOR_SERVICE", "benchmark")
+    for size in args.sizes:
+        start = time.perf_counter()
+        job = buildGraph(size, args.parents)
+        built = time.perf_counter()
+        roots, leaves = job._graph.roots, job._graph.leaves
+        end = time.perf_counter()
+        print(f"{size:>7} nodes : build {built - start:7.3f}s  roots/leaves {(end - built) * 1000:7.3f}ms "
+              f"({len(roots)} roots, {len(leaves)} leaves)")
+
+
+if __name__ == "__main__":
+    main()
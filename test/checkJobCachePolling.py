@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Check the incremental polls of the job cache (TractorJobCache) against the mock engine
+
+The engine clock is offset from the local clock (`--skew` seconds) and advanced by steps,
+so the state times of the tasks don't follow the local clock. After each step the cached
+tasks are compared with a full fetch of the tasks :
+- run : the job runs until it is done, each poll must see all the state changes
+- delete last : the tasks with the highest tids are deleted (as the subtasks of a retried
+  expanding task), they must be dropped by the next poll
+- delete : other tasks are deleted, they must be dropped by the periodic full fetch
+
+Usage:
+    python checkJobCachePolling.py --skew -60
+    python checkJobCachePolling.py --skew 3600 --nodes 30 --fullRefreshPolls 5
+"""
+
+import sys
+import time
+import random
+import logging
+import argparse
+
+from mockTractorEngine import MockEngine
+
+
+class Clock:
+    """ Engine clock, only advanced by the check """
+
+    def __init__(self, skew):
+        self.now = time.time() + skew
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def compare(cache, tq):
+    """ Tids missing or with another state in the cache, and tids that should not be in the cache """
+    tasks = tq.getJobTasks(cache.jid)
+    cached = cache.tasks
+    wrong = [tid for tid, task in tasks.items() if tid not in cached or cached[tid]["state"] != task["state"]]
+    extra = [tid for tid in cached if tid not in tasks]
+    return wrong, extra
+
+
+def report(name, wrong, extra):
+    ok = not wrong and not extra
+    print(f"{name:<12} | wrong states {len(wrong):4} | deleted tasks in cache {len(extra):4} "
+          f"{'OK' if ok else 'WRONG'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--skew", type=float, default=-60, help="Engine clock - local clock (s)")
+    parser.add_argument("--nodes", type=int, default=20, help="Number of nodes of the job")
+    parser.add_argument("--step", type=float, default=0.4, help="Engine time between two polls (s)")
+    parser.add_argument("--fullRefreshPolls", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    clock = Clock(args.skew)
+    engine = MockEngine(slots=4, taskDuration=1.0, jitter=0.0, clock=clock).install()
+    import benchmarkJobCooking
+    benchmarkJobCooking.installStubs()
+    import tractorSubmitter.api.tractorJobQuery as tq
+    from tractorSubmitter.api.tractorJobCache import TractorJobCache
+    from tractorSubmitter.tractorSubmitter import TractorSubmitter
+
+    nodes, edges = benchmarkJobCooking.SHAPES["fanout"](args.nodes, random.Random(0))
+    job = TractorSubmitter().createJob(nodes, edges, "/tmp/checkJobCachePolling.mg")
+    cache = TractorJobCache(job.jid, ttl=0, incremental=True, fullRefreshPolls=args.fullRefreshPolls)
+    failed = False
+
+    # Run
+    wrong, extra, nbPolls = set(), set(), 0
+    while not engine.isJobDone(job.jid):
+        clock.advance(args.step)
+        stepWrong, stepExtra = compare(cache, tq)
+        wrong.update(stepWrong)
+        extra.update(stepExtra)
+        nbPolls += 1
+    failed |= not report(f"run ({nbPolls})", wrong, extra)
+
+    # Delete the last tasks : dropped by the next poll
+    tids = sorted(engine.jobs[job.jid].tasks)
+    engine.deleteTasks(job.jid, tids[-3:])
+    clock.advance(args.step)
+    failed |= not report("delete last", *compare(cache, tq))
+
+    # Delete other tasks : dropped by the full fetch
+    engine.deleteTasks(job.jid, tids[1:3])
+    for _ in range(args.fullRefreshPolls + 1):
+        clock.advance(args.step)
+        wrong, extra = compare(cache, tq)
+    failed |= not report("delete", wrong, extra)
+    print(f"cache {cache.stats} | engine {engine.stats['counters']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+Check the commands of the chunk tasks created on the farm (queueChunkTask)
+
+The subtask definitions written by queueChunkTask are evaluated by a Tcl interpreter
+(RemoteCmd only records its argv), then each command is run with a fake
+meshroom_compute on the PATH that records its arguments. Every iteration of the node
+must be computed exactly once, including when chunks are grouped in packets
+(the packet command is "bash -c <meshroom_compute ... && meshroom_compute ...>").
+
+The iterations of the packets are also checked against the unpacked chunks for frame
+ranges that don't start at 0 or use a step (they are iteration indices, not frames).
+
+Requires tkinter (Tcl) and bash.
+
+Usage:
+    python checkPacketCommands.py --iterations 7 --packetSizes 1 2 3 10
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from benchmarkJobCooking import installStubs, Node
+
+TCL_COLLECTOR = """
+set ::commands {}
+proc Task {args} {
+    set i [lsearch -exact $args -cmds]
+    if {$i >= 0} { eval [lindex $args [expr {$i + 1}]] }
+}
+proc RemoteCmd {argv args} { lappend ::commands $argv }
+"""
+
+FAKE_COMPUTE = """#!/bin/bash
+echo "$@" >> "{log}"
+"""
+
+
+def writeChunkTasks(node, packetSize, path):
+    """ Definitions written by queueChunkTask, as in an expanding task """
+    from tractorSubmitter.api.base import RezContext
+    import tractorSubmitter.api.subtaskCreator as subtaskCreator
+    # The subtask stdout is opened (and closed here) by subtaskCreator
+    os.environ["TRACTOR_SUBTASK_STDOUT_FD"] = str(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC))
+    subtaskCreator._stdout = None
+    subtaskCreator.queueChunkTask(node, f"--node {node.name} \"/tmp/check project.mg\" --extern", service="check",
+                                  rezContext=RezContext({}), packetSize=packetSize)
+    subtaskCreator._stdout.close()
+    subtaskCreator._stdout = None
+    with open(path) as f:
+        return f.read()
+
+
+def commandsOf(script):
+    import tkinter
+    tcl = tkinter.Tcl()
+    tcl.eval(TCL_COLLECTOR)
+    tcl.eval(script)
+    return [list(tcl.splitlist(argv)) for argv in tcl.splitlist(tcl.getvar("::commands"))]
+
+
+def computedIterations(commands, directory):
+    """ Run the commands with the fake meshroom_compute, returns the list of computed iterations """
+    log = os.path.join(directory, "compute.log")
+    if os.path.exists(log):
+        os.remove(log)
+    env = dict(os.environ, PATH=os.pathsep.join([directory, os.environ.get("PATH", "")]))
+    for argv in commands:
+        subprocess.run(argv, env=env, check=True)
+    iterations = []
+    with open(log) as f:
+        for line in f:
+            words = line.split()
+            # None : meshroom_compute called without iteration
+            iterations.append(int(words[words.index("--iteration") + 1]) if "--iteration" in words else None)
+    return iterations
+
+
+def packetIterations(start, end, step, packetSize):
+    """ Iterations computed by the chunk tasks of the frame range, in order """
+    from tractorSubmitter.api.base import TaskInfos, ChunkTaskInfos, RezContext
+    chunkParams = {"start": start, "end": end, "step": step, "packetSize": packetSize}
+    taskInfos = TaskInfos("Check", "", "check_uid", service="check", chunkParams=chunkParams,
+                          rezContext=RezContext({}))
+    return [i for chunk in taskInfos.chunks for i in ChunkTaskInfos(taskInfos, chunk).iterations]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=7, help="Number of iterations of the node")
+    parser.add_argument("--packetSizes", type=int, nargs="+", default=[1, 2, 3, 10])
+    args = parser.parse_args()
+
+    installStubs()
+    directory = tempfile.mkdtemp(prefix="checkPacketCommands_")
+    fakeCompute = os.path.join(directory, "meshroom_compute")
+    with open(fakeCompute, "w") as f:
+        f.write(FAKE_COMPUTE.replace("{log}", os.path.join(directory, "compute.log")))
+    os.chmod(fakeCompute, 0o755)
+    node = Node("FeatureExtraction_1", "FeatureExtraction", size=args.iterations, blockSize=1)
+    failed = False
+    try:
+        for packetSize in args.packetSizes:
+            commands = commandsOf(writeChunkTasks(node, packetSize, os.path.join(directory, "subtasks.alf")))
+            iterations = computedIterations(commands, directory)
+            ok = iterations == list(range(args.iterations))
+            failed |= not ok
+            print(f"packetSize {packetSize:<4} {len(commands):4} tasks | iterations {iterations} "
+                  f"{'OK' if ok else 'WRONG'}")
+    finally:
+        shutil.rmtree(directory)
+    for start, end, step in [(0, 9, 1), (10, 20, 2), (5, 40, 3)]:
+        expected = packetIterations(start, end, step, 1)
+        for packetSize in args.packetSizes:
+            iterations = packetIterations(start, end, step, packetSize)
+            ok = iterations == expected
+            failed |= not ok
+            print(f"frames {start}-{end}:{step} packetSize {packetSize:<4} | iterations {iterations} "
+                  f"{'OK' if ok else 'WRONG'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
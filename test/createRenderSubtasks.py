@@ -7,13 +7,16 @@ The stdout is redirected to stderr with the wrapper so if we want to spool subta
 we can use  queueSubtask :
 >>> from subtaskCreator import queueSubtask
 >>> queueSubtask(title, cmd, service, tags, metadata, envkey)
+or a SubtaskBatch to write them in large blocks :
+>>> with SubtaskBatch() as batch:
+...     batch.queue(title, cmd, service, tags, metadata, envkey)
 """
 
 import os
 import re
 import getpass
 import logging
-from tractorSubmitter.api.subtaskCreator import queueSubtask
+from tractorSubmitter.api.subtaskCreator import SubtaskBatch
 from tractorSubmitter.api.base import rezWrapCommand
 
 
@@ -53,24 +56,26 @@ def main(nb_subtasks):
     service = "mikrosRender"
     
     # Create subtasks
-    for index in range(nb_subtasks):
-        metadata = {
-            'prod': "mvg",
-            'comment': "",
-            'iteration': str(index),
-            'user': user
-        }
-        cmd = f"testRenderSubtask --frame {index}"
-        cmd = rezWrapCommand(cmd, useCurrentContext=False, useRequestedContext=True)
-        
-        queueSubtask(
-            title=f"{name}_{index:04d}",
-            argv=cmd,
-            service=service,
-            limits=limits,
-            metadata=metadata,
-            envkey=get_envkey()
-        )
+    envkey = get_envkey()
+    with SubtaskBatch() as batch:
+        for index in range(nb_subtasks):
+            metadata = {
+                'prod': "mvg",
+                'comment': "",
+                'iteration': str(index),
+                'user': user
+            }
+            cmd = f"testRenderSubtask --frame {index}"
+            cmd = rezWrapCommand(cmd, useCurrentContext=False, useRequestedContext=True)
+            
+            batch.queue(
+                title=f"{name}_{index:04d}",
+                argv=cmd,
+                service=service,
+                limits=limits,
+                metadata=metadata,
+                envkey=envkey
+            )
     
     logger.info(f"Successfully queued {nb_subtasks} subtasks")
     print(f"Done! Created subtasks for frames 0-{nb_subtasks-1}")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""
+Load test of the submission and polling paths against the mock engine (mockTractorEngine)
+
+- submit : `--jobs` synthetic Meshroom graphs are submitted with TractorSubmitter.createJob
+  from `--threads` threads (cook, serialization, parsing of the script by the engine)
+- poll : while the engine runs the tasks, the jobs are polled every `--pollInterval`
+  seconds, either with one TractorJob.refresh() per job (incremental polls) or with
+  TractorSubmitter.retrieveJobs (batched requests), until all the jobs are done
+- actions : when the jobs are blocked by tasks in error, these tasks are retried with
+  TractorJob.retryTask and the jobs are polled again (at most `--maxRetries` times)
+
+For each phase we report the latency percentiles and the throughput, and the
+number of requests received by the engine.
+
+Usage:
+    python loadTestEngine.py --jobs 20 --nodes 50 --threads 4 --slots 64 --taskDuration 0.02
+    python loadTestEngine.py --poll batched --queryLatency 0.002 --output results.json
+    python loadTestEngine.py --maxJobTasks 500
+"""
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+from mockTractorEngine import MockEngine, STATE_ERROR
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def at(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50": at(0.5), "p95": at(0.95), "max": values[-1],
+            "mean": sum(values) / len(values)}
+
+
+def formatLatencies(name, stats, elapsed=None, unit="ops"):
+    if not stats["count"]:
+        return f"{name:<8} no operation"
+    line = (f"{name:<8} n={stats['count']:<6} p50={stats['p50'] * 1000:8.2f}ms p95={stats['p95'] * 1000:8.2f}ms "
+            f"max={stats['max'] * 1000:8.2f}ms")
+    if elapsed:
+        line += f" | {stats['count'] / elapsed:8.1f} {unit}/s"
+    return line
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    res = function(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+def submitJobs(submitter, graphs, nbThreads):
+    """ Returns (submitted jobs, latencies, elapsed) """
+    def submit(i):
+        nodes, edges = graphs[i]
+        return timed(submitter.createJob, nodes, edges, f"/tmp/loadTest_{i}.mg")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=nbThreads) as executor:
+        results = list(executor.map(submit, range(len(graphs))))
+    elapsed = time.perf_counter() - start
+    return [job for job, _ in results], [latency for _, latency in results], elapsed
+
+
+def pollJobs(engine, submitter, jobs, mode, interval, timeout):
+    """ Poll until all the jobs are done. Returns (latencies of the poll rounds, elapsed, all done) """
+    jids = [jid for job in jobs for jid in job.jids]
+    latencies = []
+    start = time.perf_counter()
+    while True:
+        roundStart = time.perf_counter()
+        if mode == "batched":
+            retrieved = submitter.retrieveJobs([job.jid for job in jobs])
+            tractorJobs = [job for retrievedJob in retrieved.values() for job in retrievedJob.tractorJobs.values()]
+        else:
+            tractorJobs = []
+            for job in jobs:
+                job.refresh()
+                tractorJobs.extend(job.tractorJobs.values())
+        latencies.append(time.perf_counter() - roundStart)
+        # Done from the point of view of the submitter (the engine is not asked directly)
+        remaining = sum(job["numdone"] < job["maxtid"] for job in tractorJobs if job)
+        errors = sum(job["numerror"] for job in tractorJobs if job)
+        elapsed = time.perf_counter() - start
+        if remaining == 0:
+            return latencies, elapsed, True
+        if errors and engine.isIdle(jids):
+            # Blocked by tasks in error
+            return latencies, elapsed, False
+        if elapsed > timeout:
+            return latencies, elapsed, False
+        time.sleep(interval)
+
+
+def retryErrors(jobs):
+    latencies = []
+    start = time.perf_counter()
+    for job in jobs:
+        job.refresh()
+        for task in job.tasksInState(STATE_ERROR):
+            _, latency = timed(job.retryTask, task["tid"], task["jid"])
+            latencies.append(latency)
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=20, help="Number of submissions")
+    parser.add_argument("--nodes", type=int, default=50, help="Number of nodes per submission")
+    parser.add_argument("--shape", default="chunked", help="Graph shape (see benchmarkJobCooking)")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent submissions")
+    parser.add_argument("--maxJobTasks", type=int, default=0, help="Split submissions (0 : never)")
+    parser.add_argument("--poll", default="incremental", choices=["incremental", "batched"])
+    parser.add_argument("--pollInterval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--maxRetries", type=int, default=3, help="Rounds of retries of the tasks in error")
+    # Engine
+    parser.add_argument("--slots", type=int, default=64)
+    parser.add_argument("--taskDuration", type=float, default=0.02, help="Task duration (s)")
+    parser.add_argument("--errorRate", type=float, default=0.0)
+    parser.add_argument("--loginLatency", type=float, default=0.0)
+    parser.add_argument("--queryLatency", type=float, default=0.0)
+    parser.add_argument("--spoolLatency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    engine = MockEngine(slots=args.slots, taskDuration=args.taskDuration, errorRate=args.errorRate,
+                        loginLatency=args.loginLatency, queryLatency=args.queryLatency,
+                        spoolLatency=args.spoolLatency, seed=args.seed).install()
+    import benchmarkJobCooking
+    benchmarkJobCooking.installStubs()
+    # Alfred scripts are serialized recursively by the author stand-in
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * args.nodes + 1000))
+    from tractorSubmitter.tractorSubmitter import TractorSubmitter
+    submitter = TractorSubmitter()
+    submitter.maxJobTasks = args.maxJobTasks
+
+    rng = random.Random(args.seed)
+    graphs = [benchmarkJobCooking.SHAPES[args.shape](args.nodes, rng) for _ in range(args.jobs)]
+    results = {"engine": {k: getattr(engine, k) for k in ("slots", "taskDuration", "errorRate", "loginLatency",
+                                                            "queryLatency", "spoolLatency")}}
+
+    jobs, latencies, elapsed = submitJobs(submitter, graphs, args.threads)
+    nbTasks = engine.stats["counters"].get("spooledTasks", 0)
+    results["submit"] = dict(percentiles(latencies), elapsed=elapsed, tasks=nbTasks)
+    print(formatLatencies("submit", results["submit"], elapsed, "jobs") + f" | {nbTasks / elapsed:9.1f} tasks/s")
+
+    pollLatencies, retryLatencies = [], []
+    pollTime, retryTime, nbRequests = 0.0, 0.0, 0
+    allDone = False
+    for retry in range(args.maxRetries + 1):
+        requests = dict(engine.counters)
+        latencies, elapsed, allDone = pollJobs(engine, submitter, jobs, args.poll, args.pollInterval, args.timeout)
+        nbRequests += sum(engine.counters[k] - requests.get(k, 0) for k in ("jobs", "tasks", "logins"))
+        pollLatencies.extend(latencies)
+        pollTime += elapsed
+        if allDone or retry == args.maxRetries:
+            break
+        # Tasks in error block the jobs
+        latencies, elapsed = retryErrors(jobs)
+        retryLatencies.extend(latencies)
+        retryTime += elapsed
+    results["poll"] = dict(percentiles(pollLatencies), elapsed=pollTime, done=allDone, requests=nbRequests)
+    print(formatLatencies("poll", results["poll"], pollTime, "rounds") +
+          f" | {nbRequests / pollTime:8.1f} requests/s | {'done' if allDone else 'NOT DONE'} after {pollTime:.2f}s")
+    results["retry"] = dict(percentiles(retryLatencies), elapsed=retryTime)
+    print(formatLatencies("retry", results["retry"], retryTime, "retries"))
+
+    results["engineStats"] = engine.stats
+    print(f"engine   {results['engineStats']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "args": vars(args),
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,835 @@
+#!/usr/bin/env python
+
+"""
+In-process stand-in for a Tractor engine
+
+Used by the load test scripts to measure submission and polling throughput without
+a live engine. The MockEngine :
+- accepts spooled Alfred scripts (the subset written by tractor.api.author : Job, Task,
+  Instance, RemoteCmd, -subtasks, -cmds, -serialsubtasks, afterjids...) and creates the jobs and tasks with the same tids as the engine
+  (depth first, in the order of the script)
+- simulates the task state transitions (blocked -> ready -> active -> done/error)
+  with configurable durations, error rate and number of slots (blades)
+- answers the jobs/tasks/invocations queries used in tractorJobQuery, with the
+  same search expressions ('jid in [...] and (jid>1 or (jid=1 and tid>5))',
+  statetime>'...', columns, sortby, limit)
+- applies the job and task actions (pause, interrupt, retryerrors, retry, kill, skip...)
+
+The simulation is lazy : the state of the farm is advanced to the current time each
+time the engine is queried, so no thread is needed. Latencies can be added to the
+logins, queries and spools to get closer to a loaded engine.
+
+Expanding commands (-expand 1) complete like regular commands, they don't create tasks.
+
+Example :
+>>> engine = MockEngine(slots=16, taskDuration=0.05, errorRate=0.01)
+>>> engine.install()  # Before importing tractorSubmitter
+>>> from tractorSubmitter.tractorSubmitter import TractorSubmitter
+>>> submittedJob = TractorSubmitter().createJob(nodes, edges, "/tmp/project.mg")
+>>> engine.waitJobs(timeout=60)
+>>> engine.stats
+"""
+
+import re
+import sys
+import time
+import heapq
+import types
+import random
+import threading
+import itertools
+from collections import defaultdict
+
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+STATE_BLOCKED = "blocked"
+STATE_READY = "ready"
+STATE_ACTIVE = "active"
+STATE_DONE = "done"
+STATE_ERROR = "error"
+
+
+def formatTime(timestamp):
+    return time.strftime(TIME_FORMAT, time.localtime(timestamp)) if timestamp else ""
+
+
+#
+# Alfred scripts
+#
+
+class AlfredElement:
+    """ Job, Task, Instance or command of an Alfred script """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.value = None  # argv of a command, title of an Instance
+        self.attributes = {}
+        self.subtasks = []
+        self.cmds = []
+
+
+BLOCK_ATTRIBUTES = {"-subtasks": "subtasks", "-cmds": "cmds"}
+
+
+def _skipSpaces(script, i):
+    n = len(script)
+    while i < n:
+        c = script[i]
+        if c.isspace():
+            i += 1
+        elif c == "#" and (i == 0 or script[i - 1] == "\n"):
+            # Comment line (e.g. ##AlfredToDo 3.0)
+            end = script.find("\n", i)
+            i = n if end < 0 else end + 1
+        else:
+            break
+    return i
+
+
+BACKSLASH_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+BACKSLASH_ESCAPES = {"n": "\n", "t": "\t", "r": "\r"}
+
+
+def _readWord(script, i):
+    """ Returns (word, position after the word). Braces are removed from a braced word,
+    backslash escapes are substituted in a bare word
+    """
+    if script[i] == "{":
+        depth, j = 1, i + 1
+        while depth:
+            c = script[j]
+            if c == "\\":
+                j += 1  # Escaped braces are not counted
+            elif c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+            j += 1
+        return script[i + 1:j - 1], j
+    j = i
+    n = len(script)
+    while j < n and not script[j].isspace() and script[j] != "}":
+        j += 2 if script[j] == "\\" else 1
+    word = script[i:j]
+    if "\\" in word:
+        word = BACKSLASH_PATTERN.sub(lambda m: BACKSLASH_ESCAPES.get(m.group(1), m.group(1)), word)
+    return word, j
+
+
+def parseAlfred(script) -> AlfredElement:
+    """ Parse an Alfred script and return the Job element
+    The script is read in one pass with an explicit stack (long chains of tasks are deeply nested)
+    """
+    job = None
+    current = None  # Element whose options are being read
+    stack = []  # (element, block) of the open -subtasks/-cmds blocks
+    i, n = 0, len(script)
+    while True:
+        i = _skipSpaces(script, i)
+        if i >= n:
+            break
+        c = script[i]
+        if c == "}":
+            current, _ = stack.pop()
+            i += 1
+            continue
+        if c == "-" and current is not None:
+            key, i = _readWord(script, i)
+            i = _skipSpaces(script, i)
+            if key in BLOCK_ATTRIBUTES and script[i] == "{":
+                stack.append((current, BLOCK_ATTRIBUTES[key]))
+                current = None
+                i += 1
+            else:
+                current.attributes[key[1:]], i = _readWord(script, i)
+            continue
+        word, i = _readWord(script, i)
+        element = AlfredElement(word)
+        if word in ("Instance", "RemoteCmd", "Cmd"):
+            i = _skipSpaces(script, i)
+            element.value, i = _readWord(script, i)
+        if not stack:
+            if job is not None:
+                raise ValueError(f"MockEngine: Unexpected {word} after the job")
+            job = element
+        else:
+            parent, block = stack[-1]
+            getattr(parent, block).append(element)
+        current = element
+    if job is None or job.kind != "Job":
+        raise ValueError("MockEngine: The script does not define a job")
+    return job
+
+
+#
+# Engine
+#
+
+class MockJob:
+    def __init__(self, jid, element, owner, spoolTime):
+        self.jid = jid
+        attributes = element.attributes
+        self.title = attributes.get("title", "")
+        self.metadata = attributes.get("metadata", "")
+        self.priority = float(attributes.get("priority", 5000))
+        self.afterjids = [int(j) for j in attributes.get("afterjids", "").split()]
+        self.paused = attributes.get("paused") in ("1", "True", "true")
+        self.owner = owner
+        self.spoolTime = spoolTime
+        self.doneTime = None
+        self.tasks = {}  # {tid: MockTask}
+        self.nbCommands = 0
+
+
+class MockTask:
+    def __init__(self, job, tid, element):
+        self.job = job
+        self.tid = tid
+        self.title = element.attributes.get("title", "")
+        self.metadata = element.attributes.get("metadata", "")
+        self.service = element.attributes.get("service", "")
+        self.serialSubtasks = element.attributes.get("serialsubtasks") == "1"
+        self.nbCommands = len(element.cmds)
+        self.cids = []
+        self.ptids = []
+        self.dependencies = []  # Tasks that must be done before this one (subtasks, instances)
+        self.dependents = []
+        self.state = STATE_BLOCKED
+        self.stateTime = job.spoolTime
+        self.activeTime = None
+        self.retryCount = 0
+        self.blade = ""
+        self.elapsed = 0.0
+        self.finishTime = None
+        self.runId = 0  # Ignore the end of a run that has been killed or retried
+        self.row = None  # Cached query row, reset when the state changes
+
+    @property
+    def key(self):
+        return self.job.jid, self.tid
+
+
+def buildTasks(job, element):
+    """ Create the tasks of the job from the Job element, tids are given depth first """
+    tids = itertools.count(1)
+    byTitle = {}
+    # (element, parent task)
+    stack = [(subtask, None) for subtask in reversed(element.subtasks)]
+    previousSiblings = {}
+    while stack:
+        element, parent = stack.pop()
+        if element.kind == "Instance":
+            task = byTitle.get(element.value)
+            if task is not None and parent is not None:
+                task.ptids.append(parent.tid)
+                parent.dependencies.append(task)
+                task.dependents.append(parent)
+            continue
+        task = MockTask(job, next(tids), element)
+        job.tasks[task.tid] = task
+        byTitle.setdefault(task.title, task)
+        for _ in range(task.nbCommands):
+            job.nbCommands += 1
+            task.cids.append(job.nbCommands)
+        if parent is not None:
+            task.ptids.append(parent.tid)
+            parent.dependencies.append(task)
+            task.dependents.append(parent)
+            # Serial subtasks run one after the other
+            if parent.serialSubtasks:
+                previous = previousSiblings.get(parent.tid)
+                if previous is not None:
+                    task.dependencies.append(previous)
+                    previous.dependents.append(task)
+                previousSiblings[parent.tid] = task
+        stack.extend((subtask, task) for subtask in reversed(element.subtasks))
+
+
+class MockEngine:
+    """ Simulated Tractor engine
+    :param slots: number of tasks that can run at the same time
+    :param taskDuration: duration of a task with commands (in seconds), or a function task -> duration
+    :param jitter: random variation of the durations (fraction of the duration)
+    :param errorRate: probability for a command to fail
+    :param loginLatency, queryLatency, spoolLatency: added delays (in seconds)
+    """
+
+    def __init__(self, slots=64, taskDuration=0.05, jitter=0.2, errorRate=0.0,
+                 loginLatency=0.0, queryLatency=0.0, spoolLatency=0.0, seed=0, clock=time.time):
+        self.slots = slots
+        self.taskDuration = taskDuration
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.loginLatency = loginLatency
+        self.queryLatency = queryLatency
+        self.spoolLatency = spoolLatency
+        self.clock = clock
+        self.jobs = {}
+        self.counters = defaultdict(int)
+        self._rng = random.Random(seed)
+        self._jids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._ready = []  # Heap of (-priority, jid, tid)
+        self._running = []  # Heap of (finishTime, jid, tid, runId)
+        self._simulationTime = clock()
+
+    #
+    # Spool
+    #
+
+    def spool(self, script, owner=None):
+        """ Spool an Alfred script, returns the job id """
+        if self.spoolLatency:
+            time.sleep(self.spoolLatency)
+        element = parseAlfred(script)
+        with self._lock:
+            self._advance()
+            now = self._simulationTime
+            job = MockJob(next(self._jids), element, owner, now)
+            buildTasks(job, element)
+            self.jobs[job.jid] = job
+            self.counters["spools"] += 1
+            self.counters["spooledTasks"] += len(job.tasks)
+            self.counters["spooledBytes"] += len(script)
+            for task in job.tasks.values():
+                self._updateBlocked(task, now)
+            self._advance()
+            return job.jid
+
+    #
+    # Simulation
+    #
+
+    def _duration(self, task):
+        duration = self.taskDuration(task) if callable(self.taskDuration) else self.taskDuration
+        return max(0.0, duration * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def _isJobBlocked(self, job):
+        return job.paused or any(
+            jid in self.jobs and self.jobs[jid].doneTime is None for jid in job.afterjids)
+
+    def _setState(self, task, state, now):
+        task.state = state
+        task.stateTime = now
+        task.row = None
+
+    def _updateBlocked(self, task, now):
+        """ A blocked task becomes ready when all its dependencies are done """
+        if task.state != STATE_BLOCKED:
+            return
+        if any(dependency.state != STATE_DONE for dependency in task.dependencies):
+            return
+        if task.nbCommands == 0:
+            self._finish(task, now, STATE_DONE)
+            return
+        self._setState(task, STATE_READY, now)
+        heapq.heappush(self._ready, (-task.job.priority, task.job.jid, task.tid))
+
+    def _finish(self, task, now, state):
+        self._setState(task, state, now)
+        if state != STATE_DONE:
+            return
+        for dependent in task.dependents:
+            self._updateBlocked(dependent, now)
+        job = task.job
+        if job.doneTime is None and all(t.state == STATE_DONE for t in job.tasks.values()):
+            job.doneTime = now
+            # Jobs waiting for this one
+            for otherJob in self.jobs.values():
+                if job.jid in otherJob.afterjids and not self._isJobBlocked(otherJob):
+                    self._requeue(otherJob)
+
+    def _requeue(self, job):
+        for task in job.tasks.values():
+            if task.state == STATE_READY:
+                heapq.heappush(self._ready, (-job.priority, job.jid, task.tid))
+
+    def _nbActive(self):
+        return len(self._running)
+
+    def _launch(self, now):
+        """ Start ready tasks while there are free slots """
+        while self._ready and self._nbActive() < self.slots:
+            _, jid, tid = heapq.heappop(self._ready)
+            job = self.jobs[jid]
+            task = job.tasks[tid]
+            if task.state != STATE_READY:
+                continue
+            if self._isJobBlocked(job):
+                # Pushed again when the job is unblocked
+                continue
+            task.runId += 1
+            task.blade = f"blade{self._rng.randrange(self.slots):03d}"
+            task.activeTime = now
+            task.elapsed = self._duration(task)
+            task.finishTime = now + task.elapsed
+            self._setState(task, STATE_ACTIVE, now)
+            heapq.heappush(self._running, (task.finishTime, jid, tid, task.runId))
+            self.counters["launches"] += 1
+
+    def _advance(self):
+        """ Run the simulation until now """
+        now = self.clock()
+        self._launch(self._simulationTime)
+        while self._running and self._running[0][0] <= now:
+            finishTime, jid, tid, runId = heapq.heappop(self._running)
+            task = self.jobs[jid].tasks[tid]
+            if task.runId != runId or task.state != STATE_ACTIVE:
+                continue
+            self._simulationTime = max(self._simulationTime, finishTime)
+            failed = self.errorRate and self._rng.random() < self.errorRate
+            self._finish(task, finishTime, STATE_ERROR if failed else STATE_DONE)
+            self._launch(finishTime)
+        self._simulationTime = max(self._simulationTime, now)
+        self._launch(now)
+
+    def _stop(self, task, now, state):
+        """ Stop a running task """
+        if task.state == STATE_ACTIVE:
+            task.runId += 1
+            self._running = [r for r in self._running if (r[1], r[2]) != task.key]
+            heapq.heapify(self._running)
+            task.elapsed = now - task.activeTime
+        self._setState(task, state, now)
+
+    def _retry(self, task, now):
+        if task.state == STATE_ACTIVE:
+            self._stop(task, now, STATE_BLOCKED)
+        task.retryCount += 1
+        self._setState(task, STATE_BLOCKED, now)
+        self._updateBlocked(task, now)
+
+    #
+    # Queries
+    #
+
+    def _query(self, name):
+        self.counters[name] += 1
+        if self.queryLatency:
+            time.sleep(self.queryLatency)
+
+    def _jobRow(self, job):
+        states = defaultdict(int)
+        for task in job.tasks.values():
+            states[task.state] += 1
+        return {
+            "jid": job.jid, "title": job.title, "spoolhost": "localhost", "owner": job.owner,
+            "numactive": states[STATE_ACTIVE], "numready": states[STATE_READY],
+            "numdone": states[STATE_DONE], "numerror": states[STATE_ERROR], "numblocked": states[STATE_BLOCKED],
+            "maxtid": max(job.tasks, default=0), "priority": job.priority, "afterjids": list(job.afterjids),
+            "metadata": job.metadata, "paused": job.paused,
+            "spooltime": formatTime(job.spoolTime), "stoptime": formatTime(job.doneTime),
+        }
+
+    def _taskRow(self, task):
+        if task.row is None:
+            task.row = self._buildTaskRow(task)
+        return task.row
+
+    def _buildTaskRow(self, task):
+        return {
+            "jid": task.job.jid, "tid": task.tid, "title": task.title, "state": task.state,
+            "ptids": list(task.ptids), "progress": 100 if task.state == STATE_DONE else 0,
+            "retrycount": task.retryCount, "currcid": task.cids[-1] if task.cids else 0,
+            "cids": list(task.cids), "metadata": task.metadata, "service": task.service,
+            "statetime": formatTime(task.stateTime), "activetime": formatTime(task.activeTime),
+            "blade": task.blade,
+        }
+
+    def _invocationRows(self, task):
+        if task.activeTime is None:
+            return []
+        elapsed = task.elapsed if task.state != STATE_ACTIVE else self._simulationTime - task.activeTime
+        return [{"jid": task.job.jid, "tid": task.tid, "cid": cid, "blade": task.blade,
+                 "elapsedreal": elapsed, "current": True} for cid in task.cids]
+
+    @staticmethod
+    def _select(rows, search, columns=None, sortby=None, limit=None):
+        condition = parseSearch(search)
+        rows = [row for row in rows if condition(row)]
+        if sortby:
+            rows.sort(key=lambda row: tuple(row.get(key) for key in sortby))
+        if limit:
+            rows = rows[:limit]
+        if columns:
+            return [{key: row.get(key) for key in columns} for row in rows]
+        return [dict(row) for row in rows]
+
+    def queryJobs(self, search, columns=None, sortby=None, limit=None):
+        self._query("jobs")
+        with self._lock:
+            self._advance()
+            rows = [self._jobRow(job) for job in self.jobs.values()]
+        return self._select(rows, search, columns, sortby, limit)
+
+    def _candidateTasks(self, search):
+        """ Only the tasks of the jobs referenced in the search (most queries are on a few jobs) """
+        jids = searchJids(search)
+        jobs = self.jobs.values() if jids is None else [self.jobs[jid] for jid in jids if jid in self.jobs]
+        for job in jobs:
+            yield from job.tasks.values()
+
+    def queryTasks(self, search, columns=None, sortby=None, limit=None):
+        self._query("tasks")
+        with self._lock:
+            self._advance()
+            rows = [self._taskRow(task) for task in self._candidateTasks(search)]
+        return self._select(rows, search, columns, sortby or ["jid", "tid"], limit)
+
+    def queryInvocations(self, search, columns=None, sortby=None, limit=None):
+        self._query("invocations")
+        with self._lock:
+            self._advance()
+            rows = [row for task in self._candidateTasks(search) for row in self._invocationRows(task)]
+        return self._select(rows, search, columns, sortby, limit)
+
+    #
+    # Actions
+    #
+
+    def _jobAction(self, name, search, action):
+        self._query(name)
+        with self._lock:
+            self._advance()
+            now = self._simulationTime
+            for row in self._select([self._jobRow(job) for job in self.jobs.values()], search):
+                action(self.jobs[row["jid"]], now)
+            self._advance()
+
+    def _taskAction(self, name, search, action):
+        self._query(name)
+        with self._lock:
+            self._advance()
+            now = self._simulationTime
+            condition = parseSearch(search)
+            for task in list(self._candidateTasks(search)):
+                if condition(self._taskRow(task)):
+                    action(task, now)
+            self._advance()
+
+    def pause(self, search):
+        def pauseJob(job, now):
+            job.paused = True
+        self._jobAction("pause", search, pauseJob)
+
+    def unpause(self, search):
+        def unpauseJob(job, now):
+            job.paused = False
+            self._requeue(job)
+        self._jobAction("unpause", search, unpauseJob)
+
+    def interrupt(self, search):
+        """ Stop the running tasks (they are ready again) and pause the job """
+        def interruptJob(job, now):
+            job.paused = True
+            for task in job.tasks.values():
+                if task.state == STATE_ACTIVE:
+                    self._stop(task, now, STATE_READY)
+        self._jobAction("interrupt", search, interruptJob)
+
+    def retryerrors(self, search):
+        def retryErrors(job, now):
+            for task in job.tasks.values():
+                if task.state == STATE_ERROR:
+                    self._retry(task, now)
+        self._jobAction("retryerrors", search, retryErrors)
+
+    def retry(self, search):
+        self._taskAction("retry", search, self._retry)
+
+    def resume(self, search):
+        def resumeTask(task, now):
+            if task.state == STATE_ERROR:
+                self._retry(task, now)
+        self._taskAction("resume", search, resumeTask)
+
+    def kill(self, search):
+        def killTask(task, now):
+            if task.state == STATE_ACTIVE:
+                self._stop(task, now, STATE_ERROR)
+        self._taskAction("kill", search, killTask)
+
+    def skip(self, search):
+        def skipTask(task, now):
+            if task.state != STATE_DONE:
+                self._stop(task, now, STATE_BLOCKED)
+                self._finish(task, now, STATE_DONE)
+        self._taskAction("skip", search, skipTask)
+
+    #
+    # Load tests helpers
+    #
+
+    def deleteTasks(self, jid, tids):
+        """ Delete tasks of a job, as the engine does with the subtasks of an expanding task
+        that is retried (the new subtasks get new tids)
+        """
+        with self._lock:
+            self._advance()
+            now = self._simulationTime
+            job = self.jobs[jid]
+            for tid in tids:
+                task = job.tasks.pop(tid, None)
+                if task is None:
+                    continue
+                task.runId += 1
+                for dependent in task.dependents:
+                    dependent.dependencies.remove(task)
+                    self._updateBlocked(dependent, now)
+            self._running = [r for r in self._running if r[1] != jid or r[2] in job.tasks]
+            self._ready = [r for r in self._ready if r[1] != jid or r[2] in job.tasks]
+            heapq.heapify(self._running)
+            heapq.heapify(self._ready)
+            self._advance()
+
+    def isJobDone(self, jid):
+        with self._lock:
+            self._advance()
+            return self.jobs[jid].doneTime is not None
+
+    def isIdle(self, jids=None):
+        """ True if no task of these jobs is running or waiting for a slot
+        (the jobs are done or blocked by tasks in error)
+        """
+        with self._lock:
+            self._advance()
+            jobs = [self.jobs[jid] for jid in (jids or list(self.jobs))]
+            return not any(task.state in (STATE_READY, STATE_ACTIVE) and not self._isJobBlocked(job)
+                           for job in jobs for task in job.tasks.values())
+
+    def waitJobs(self, jids=None, timeout=None, interval=0.01):
+        """ Wait until the jobs are done (or have errors that block them)
+        Returns True if all the jobs are done
+        """
+        start = time.monotonic()
+        while True:
+            if self.isIdle(jids):
+                with self._lock:
+                    return all(self.jobs[jid].doneTime is not None for jid in (jids or list(self.jobs)))
+            if timeout is not None and time.monotonic() - start > timeout:
+                return False
+            time.sleep(interval)
+
+    @property
+    def stats(self):
+        with self._lock:
+            self._advance()
+            states = defaultdict(int)
+            for job in self.jobs.values():
+                for task in job.tasks.values():
+                    states[task.state] += 1
+            return {"jobs": len(self.jobs), "states": dict(states), "counters": dict(self.counters)}
+
+    def install(self):
+        """ Use this engine for the tractorJobQuery sessions and for the spools
+        Should be called before importing tractorSubmitter
+        """
+        import tractorAuthorStub
+        tractorAuthorStub.install()
+        from tractor.api import author
+        engine = self
+
+        class TractorLoginManager:
+            def start_query(self):
+                engine.counters["logins"] += 1
+                if engine.loginLatency:
+                    time.sleep(engine.loginLatency)
+                return MockQuery(engine)
+
+        loginManager = types.ModuleType("tractorLoginManager")
+        loginManager.TractorLoginManager = TractorLoginManager
+        sys.modules["tractorLoginManager"] = loginManager
+
+        def spool(job, block=False, owner=None, **kwargs):
+            return engine.spool(job.asTcl(), owner)
+
+        author.Job.spool = spool
+        return self
+
+
+class MockQuery:
+    """ Engine session returned by TractorLoginManager.start_query() (same methods as tractor.api.query) """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def jobs(self, search, columns=None, sortby=None, limit=None, **kwargs):
+        return self.engine.queryJobs(search, columns, sortby, limit)
+
+    def tasks(self, search, columns=None, sortby=None, limit=None, **kwargs):
+        return self.engine.queryTasks(search, columns, sortby, limit)
+
+    def invocations(self, search, columns=None, sortby=None, limit=None, **kwargs):
+        return self.engine.queryInvocations(search, columns, sortby, limit)
+
+    def __getattr__(self, name):
+        # Actions : pause, unpause, interrupt, retryerrors, retry, resume, kill, skip
+        if name in ("pause", "unpause", "interrupt", "retryerrors", "retry", "resume", "kill", "skip"):
+            return getattr(self.engine, name)
+        raise AttributeError(name)
+
+    def closeEngineClient(self):
+        pass
+
+
+#
+# Search expressions
+#
+
+def _tokenize(search):
+    tokens, i, n = [], 0, len(search)
+    while i < n:
+        c = search[i]
+        if c.isspace():
+            i += 1
+        elif c in "()[]":
+            tokens.append(c)
+            i += 1
+        elif c in "'\"":
+            end = search.index(c, i + 1)
+            tokens.append(("str", search[i + 1:end]))
+            i = end + 1
+        elif c in "=!<>":
+            op = search[i:i + 2] if search[i:i + 2] in ("!=", ">=", "<=") else c
+            tokens.append(op)
+            i += len(op)
+        else:
+            j = i
+            while j < n and not search[j].isspace() and search[j] not in "()[]=!<>'\"":
+                j += 1
+            tokens.append(search[i:j])
+            i = j
+    return tokens
+
+
+def _value(token):
+    if isinstance(token, tuple):
+        return token[1]
+    try:
+        return int(token)
+    except ValueError:
+        try:
+            return float(token)
+        except ValueError:
+            return token
+
+
+def _compare(op, a, b):
+    if a is None:
+        return False
+    if isinstance(b, (int, float)) and not isinstance(a, (int, float)):
+        try:
+            a = float(a)
+        except (TypeError, ValueError):
+            return False
+    elif isinstance(b, str):
+        a = str(a)
+    if op == "=":
+        return a == b
+    if op == "!=":
+        return a != b
+    if op == ">":
+        return a > b
+    if op == "<":
+        return a < b
+    if op == ">=":
+        return a >= b
+    return a <= b
+
+
+class _SearchParser:
+    """ Recursive descent parser : or > and > not > comparison """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.i += 1
+        return token
+
+    def parseOr(self):
+        left = self.parseAnd()
+        while self.peek() == "or":
+            self.next()
+            right = self.parseAnd()
+            left = (lambda l, r: lambda row: l(row) or r(row))(left, right)
+        return left
+
+    def parseAnd(self):
+        left = self.parseNot()
+        while self.peek() == "and":
+            self.next()
+            right = self.parseNot()
+            left = (lambda l, r: lambda row: l(row) and r(row))(left, right)
+        return left
+
+    def parseNot(self):
+        if self.peek() == "not":
+            self.next()
+            operand = self.parseNot()
+            return lambda row: not operand(row)
+        return self.parseAtom()
+
+    def parseAtom(self):
+        token = self.next()
+        if token == "(":
+            condition = self.parseOr()
+            self.next()  # )
+            return condition
+        key = token
+        op = self.peek()
+        if op == "in":
+            self.next()
+            self.next()  # [
+            values = []
+            while self.peek() != "]":
+                values.append(_value(self.next()))
+            self.next()
+            values = set(values)
+            return lambda row: row.get(key) in values
+        if op in ("=", "!=", ">", "<", ">=", "<="):
+            self.next()
+            value = _value(self.next())
+            return lambda row: _compare(op, row.get(key), value)
+        # Boolean column (e.g. 'current')
+        return lambda row: bool(row.get(key))
+
+
+_searchCache = {}
+
+
+def parseSearch(search):
+    """ Returns a function row -> bool for a search expression """
+    if not search:
+        return lambda row: True
+    condition = _searchCache.get(search)
+    if condition is None:
+        condition = _SearchParser(_tokenize(search)).parseOr()
+        if len(_searchCache) < 10000:
+            _searchCache[search] = condition
+    return condition
+
+
+def searchJids(search):
+    """ Jobs referenced by the first condition of the search ('jid=1 and ...' or 'jid in [...] and ...')
+    Returns None if the search is not restricted to some jobs
+    """
+    tokens = _tokenize(search or "")
+    if len(tokens) < 3 or tokens[0] != "jid":
+        return None
+    depth = 0
+    for token in tokens:
+        depth += (token == "(") - (token == ")")
+        if token == "or" and depth == 0:
+            return None
+    if tokens[1] == "=":
+        return [int(tokens[2])]
+    if tokens[1] == "in":
+        return [int(t) for t in tokens[3:tokens.index("]")]]
+    return None
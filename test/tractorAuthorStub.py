@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+Minimal stand-in for tractor.api.author
+
+Only used by the benchmark and load test scripts when the Tractor python API is not
+available. It implements the subset of the author API used by tractorJobCreation
+(Job, Task, newTask, addChild, cmds, asTcl, spool) and writes Alfred scripts
+with a layout close to the real module, so that payload sizes are comparable.
+The quoting of the values is simplified (values with special characters are not escaped).
+
+Example :
+>>> import tractorAuthorStub
+>>> tractorAuthorStub.install()  # Does nothing if tractor.api.author is importable
+"""
+
+import sys
+import types
+import itertools
+
+
+def tclQuote(value):
+    """ Quote a value for an Alfred script """
+    value = str(value)
+    return "{" + value + "}"
+
+
+def tclArgv(argv):
+    return "{" + " ".join(tclQuote(a) if (" " in a or not a) else a for a in argv) + "}"
+
+
+class Command:
+    def __init__(self, argv, service=None):
+        self.argv = list(argv)
+        self.service = service
+        self.tags = []
+        self.envkey = []
+        self.expand = False
+
+    def asTcl(self):
+        parts = ["RemoteCmd", tclArgv(self.argv)]
+        if self.service:
+            parts.append(f"-service {tclQuote(self.service)}")
+        if self.tags:
+            parts.append(f"-tags {tclQuote(' '.join(self.tags))}")
+        if self.envkey:
+            parts.append(f"-envkey {tclQuote(' '.join(self.envkey))}")
+        if self.expand:
+            parts.append("-expand 1")
+        return " ".join(parts)
+
+
+class Task:
+    _ids = itertools.count(1)
+
+    def __init__(self, title=None, argv=None, service=None, metadata=None, serialsubtasks=False, **kwargs):
+        self.id = next(self._ids)
+        self.title = title
+        self.service = service
+        self.metadata = metadata
+        self.serialsubtasks = serialsubtasks
+        self.cmds = [Command(argv, service)] if argv else []
+        self.subtasks = []
+
+    def newTask(self, **kwargs):
+        task = Task(**kwargs)
+        self.addChild(task)
+        return task
+
+    def addChild(self, task):
+        self.subtasks.append(task)
+
+    def _attributesTcl(self):
+        parts = [f"-title {tclQuote(self.title)}"]
+        if self.service:
+            parts.append(f"-service {tclQuote(self.service)}")
+        if self.metadata:
+            parts.append(f"-metadata {tclQuote(self.metadata)}")
+        if self.serialsubtasks:
+            parts.append("-serialsubtasks 1")
+        return " ".join(parts)
+
+    def asTcl(self, indent="", emitted=None):
+        emitted = set() if emitted is None else emitted
+        if self.id in emitted:
+            return f"{indent}Instance {tclQuote(self.title)}\n"
+        emitted.add(self.id)
+        tcl = f"{indent}Task {self._attributesTcl()}"
+        if self.subtasks:
+            tcl += " -subtasks {\n"
+            for subtask in self.subtasks:
+                tcl += subtask.asTcl(indent + "  ", emitted)
+            tcl += indent + "}"
+        if self.cmds:
+            tcl += " -cmds {\n"
+            for cmd in self.cmds:
+                tcl += f"{indent}  {cmd.asTcl()}\n"
+            tcl += indent + "}"
+        return tcl + "\n"
+
+
+class Job(Task):
+    JOB_ATTRIBUTES = ["title", "service", "metadata", "envkey", "paused", "comment", "spoolcwd", "projects", 
+                      "afterjids"]
+
+    def __init__(self, **kwargs):
+        super().__init__(title=kwargs.get("title"))
+        self.attributes = {k: kwargs.get(k) for k in self.JOB_ATTRIBUTES}
+        self.priority = None
+
+    def asTcl(self):
+        parts = ["Job"]
+        for key, value in self.attributes.items():
+            if value in (None, "", [], False):
+                continue
+            if isinstance(value, (list, tuple)):
+                value = " ".join(str(v) for v in value)
+            if value is True:
+                value = 1
+            parts.append(f"-{key} {tclQuote(value)}")
+        if self.priority is not None:
+            parts.append(f"-priority {tclQuote(self.priority)}")
+        tcl = "##AlfredToDo 3.0\n" + " ".join(parts) + " -subtasks {\n"
+        emitted = set()
+        for subtask in self.subtasks:
+            tcl += subtask.asTcl("  ", emitted)
+        return tcl + "}\n"
+
+    def spool(self, block=False, owner=None, **kwargs):
+        self.asTcl()
+        return 0
+
+
+def install():
+    """ Register this module as tractor.api.author if the real one is not available """
+    try:
+        import tractor.api.author  # noqa: F401
+        return False
+    except ImportError:
+        pass
+    module = sys.modules[__name__]
+    tractor = sys.modules.setdefault("tractor", types.ModuleType("tractor"))
+    api = sys.modules.setdefault("tractor.api", types.ModuleType("tractor.api"))
+    tractor.api = api
+    api.author = module
+    sys.modules["tractor.api.author"] = module
+    return True